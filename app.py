@@ -1,60 +1,134 @@
+import time
+_INICIO_BOOT = time.perf_counter() # Orçamento de inicialização: medido do primeiro import até o fim do módulo
 from sqlalchemy.orm import relationship 
+from sqlalchemy import inspect as sa_inspect, tuple_, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError, TimeoutError as PoolEsgotado
+from sqlalchemy.pool import QueuePool, NullPool
 import pytz
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_from_directory 
+from flask import Flask, request, jsonify, render_template, redirect, url_for, send_from_directory, send_file, Response, stream_with_context, make_response, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt, datetime
-from functools import wraps
+from functools import wraps, partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from flask_cors import CORS
 import os
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
 from dotenv import load_dotenv
+import click
 import json
+import base64
+import csv
+import io
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import multiprocessing
+import queue
+import re
+from bisect import bisect_left
+import zlib
+import zipfile
+import secrets
+import shutil
+import random
+import cProfile
+from collections import namedtuple, deque, OrderedDict
 
 # Carrega variáveis de ambiente do arquivo .env (apenas para desenvolvimento local)
 load_dotenv()
+TEMPOS_BOOT = {'importacoes_ms': round((time.perf_counter() - _INICIO_BOOT) * 1000, 1)} # Etapas da inicialização deste worker
 
 # CONFIGURAÇÃO OPCIONAL DE S3 (se quiser uploads persistentes em produção)
+UPLOAD_CACHE_MAX_AGE = int(os.environ.get('UPLOAD_CACHE_MAX_AGE', 31536000)) # Cache no navegador dos arquivos enviados (s)
 USE_S3 = bool(os.environ.get('AWS_S3_BUCKET_NAME'))
 if USE_S3:
-    import boto3
-    from botocore.exceptions import ClientError
-
     AWS_S3_BUCKET_NAME = os.environ.get('AWS_S3_BUCKET_NAME')
     AWS_REGION = os.environ.get('AWS_REGION')
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 
-    s3_client = boto3.client(
-        's3',
-        region_name=AWS_REGION,
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    )
-
-    def upload_to_s3(fileobj, key):
-        try:
-            # fileobj: werkzeug FileStorage -> supports .stream
-            s3_client.upload_fileobj(fileobj.stream, AWS_S3_BUCKET_NAME, key)
-            return True
-        except ClientError as e:
-            app.logger.error(f"S3 upload error: {e}")
-            return False
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL') or None # Ex.: MinIO/LocalStack em desenvolvimento e testes
+
+    # O boto3 leva algumas centenas de ms para importar e montar o cliente: só carrega no primeiro uso
+    # (envio em segundo plano, URL assinada, limpeza), não na inicialização de cada worker
+    _s3 = {}
+    _s3_lock = threading.Lock()
+
+    def cliente_s3():
+        if 'cliente' not in _s3:
+            with _s3_lock:
+                if 'cliente' not in _s3:
+                    import boto3
+                    from boto3.s3.transfer import TransferConfig
+                    from botocore.config import Config as BotoConfig
+                    # Arquivos grandes vão em partes enviadas em paralelo; os pequenos, em um único PUT
+                    _s3['transferencia'] = TransferConfig(
+                        multipart_threshold=int(os.environ.get('S3_MULTIPART_MB', 8)) * 1024 * 1024,
+                        multipart_chunksize=int(os.environ.get('S3_MULTIPART_MB', 8)) * 1024 * 1024,
+                        max_concurrency=int(os.environ.get('S3_CONCORRENCIA', 8)),
+                    )
+                    _s3['cliente'] = boto3.client(
+                        's3',
+                        region_name=AWS_REGION,
+                        aws_access_key_id=AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                        endpoint_url=AWS_S3_ENDPOINT_URL,
+                        config=BotoConfig(retries={'max_attempts': 5, 'mode': 'standard'}, max_pool_connections=int(os.environ.get('S3_CONCORRENCIA', 8)) * 2),
+                    )
+        return _s3['cliente']
+
+    def enviar_arquivo_s3(caminho, key):
+        # Envia do disco, sem carregar o arquivo na memória; exceções ficam para quem chamou (novas tentativas)
+        cliente_s3().upload_file(caminho, AWS_S3_BUCKET_NAME, key, Config=_s3['transferencia'])
 
     def get_presigned_url(key, expires_in=3600):
         try:
-            return s3_client.generate_presigned_url(
+            return cliente_s3().generate_presigned_url(
                 'get_object',
-                Params={'Bucket': AWS_S3_BUCKET_NAME, 'Key': key},
+                # A chave é o sha256 do conteúdo: a mesma chave sempre tem os mesmos bytes, então o navegador pode guardar o objeto
+                Params={'Bucket': AWS_S3_BUCKET_NAME, 'Key': key, 'ResponseCacheControl': f'private, max-age={UPLOAD_CACHE_MAX_AGE}, immutable'},
                 ExpiresIn=expires_in,
             )
-        except ClientError as e:
+        except Exception as e: # ClientError ou credenciais ausentes
             app.logger.error(f"S3 presigned URL error: {e}")
             return None
 
+    # Cache de URLs pré-assinadas (por worker): a mesma URL é reaproveitada até faltar S3_URL_RENOVAR
+    # segundos para expirar, o que também deixa o navegador reutilizar o objeto que já baixou
+    S3_URL_VALIDADE = int(os.environ.get('S3_URL_VALIDADE', 3600)) # Validade de cada URL assinada (s)
+    S3_URL_RENOVAR = int(os.environ.get('S3_URL_RENOVAR', 600)) # Margem antes do vencimento para gerar outra (s)
+    S3_URL_CACHE_MAX = int(os.environ.get('S3_URL_CACHE_MAX', 20000))
+    _urls_assinadas = OrderedDict() # chave -> (url, expira_em monotônico)
+    _urls_assinadas_lock = threading.Lock()
+    _urls_assinadas_stats = {'hits': 0, 'misses': 0}
+
+    def url_assinada(key):
+        # Devolve (url, segundos em que ainda pode ser reutilizada) ou (None, 0)
+        agora = time.monotonic()
+        with _urls_assinadas_lock:
+            item = _urls_assinadas.get(key)
+            if item and item[1] - S3_URL_RENOVAR > agora:
+                _urls_assinadas.move_to_end(key)
+                _urls_assinadas_stats['hits'] += 1
+                return item[0], int(item[1] - S3_URL_RENOVAR - agora)
+            _urls_assinadas_stats['misses'] += 1
+        url = get_presigned_url(key, S3_URL_VALIDADE)
+        if not url:
+            return None, 0
+        with _urls_assinadas_lock:
+            _urls_assinadas[key] = (url, agora + S3_URL_VALIDADE)
+            _urls_assinadas.move_to_end(key)
+            while len(_urls_assinadas) > S3_URL_CACHE_MAX:
+                _urls_assinadas.popitem(last=False) # Remove a menos usada
+        return url, S3_URL_VALIDADE - S3_URL_RENOVAR
+
 # CONFIGURAÇÕES INICIAIS
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor']) # Permite que clientes de outras origens leiam o cursor da próxima página
 
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'chave_super_secreta') # Em produção, defina SECRET_KEY como variável de ambiente
 # Permite configurar a URI do banco via variável de ambiente (ex: PostgreSQL em produção)
@@ -63,8 +137,96 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Desativa o rastreamento d
 # Pastas de upload (podem ser configuradas via variáveis de ambiente)
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', os.path.join(app.root_path, 'static', 'uploads'))
 app.config['UPLOAD_FOLDER_PERFIL'] = os.environ.get('UPLOAD_FOLDER_PERFIL', os.path.join(app.root_path, 'static', 'uploads', 'perfil'))
+# PDFs de holerites já gerados, nomeados pelo hash do conteúdo (pode ser apagada a qualquer momento)
+app.config['PDF_CACHE_FOLDER'] = os.environ.get('PDF_CACHE_FOLDER', os.path.join(tempfile.gettempdir(), 'neorh_pdf'))
+# Partes de uploads em andamento (fora de static/, para não serem servidas antes de concluídas)
+app.config['UPLOAD_PARCIAL_FOLDER'] = os.environ.get('UPLOAD_PARCIAL_FOLDER', os.path.join(tempfile.gettempdir(), 'neorh_uploads_parciais'))
+# Com S3, os uploads ficam aqui até o envio em segundo plano terminar (e são servidos daqui enquanto isso)
+app.config['S3_SPOOL_FOLDER'] = os.environ.get('S3_SPOOL_FOLDER', os.path.join(app.root_path, 'spool'))
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024)) # Limite de qualquer requisição (413)
+
+# POOL DE CONEXÕES DO BANCO
+# Cada worker tem o seu pool. Com PostgreSQL gerenciado, conexões ociosas são derrubadas pelo servidor ou pelo
+# balanceador: o pre-ping testa a conexão antes de entregá-la e o recycle a troca antes desse limite.
+# DB_PGBOUNCER=1: o PgBouncer (modo transaction) é quem mantém o pool; cada worker abre e devolve conexões a
+# ele (NullPool), e o statement_timeout vai por SET LOCAL em cada transação, pois o PgBouncer rejeita o
+# parâmetro 'options' na conexão.
+DB_POOL_TAMANHO = int(os.environ.get('DB_POOL_TAMANHO', 5)) # Conexões mantidas abertas por worker
+DB_POOL_EXTRA = int(os.environ.get('DB_POOL_EXTRA', 10)) # Conexões além do tamanho nos picos (fechadas ao devolver)
+DB_POOL_ESPERA = int(os.environ.get('DB_POOL_ESPERA', 10)) # Segundos (inteiros) esperando uma conexão livre antes de falhar
+DB_POOL_RECICLAR = int(os.environ.get('DB_POOL_RECICLAR', 1800)) # Idade máxima de uma conexão (s); -1 desativa
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0)) # Limite por comando no PostgreSQL; 0 desativa
+DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() in ('1', 'true', 'yes')
+POOL_FAIXAS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000) # Faixas do histograma de espera por conexão
+
+_pool_stats_lock = threading.Lock()
+_pool_stats = {'retiradas': 0, 'espera_total_ms': 0.0, 'espera_maxima_ms': 0.0, 'esgotado': 0,
+               'faixas_ms': dict.fromkeys([*map(str, POOL_FAIXAS_MS), '+Inf'], 0)}
+
+class _MedicaoPool:
+    # Mede quanto cada retirada de conexão esperou (fila do pool ou abertura de uma conexão nova)
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolEsgotado:
+            with _pool_stats_lock:
+                _pool_stats['esgotado'] += 1
+            raise
+        finally:
+            espera = (time.perf_counter() - inicio) * 1000
+            faixa = next((str(f) for f in POOL_FAIXAS_MS if espera <= f), '+Inf')
+            with _pool_stats_lock:
+                _pool_stats['retiradas'] += 1
+                _pool_stats['espera_total_ms'] += espera
+                _pool_stats['espera_maxima_ms'] = max(_pool_stats['espera_maxima_ms'], espera)
+                _pool_stats['faixas_ms'][faixa] += 1
+
+class PoolMedido(_MedicaoPool, QueuePool):
+    pass
+
+class PoolSemReuso(_MedicaoPool, NullPool):
+    pass
+
+def opcoes_engine(uri):
+    if uri.startswith('sqlite') and (':memory:' in uri or uri.rstrip('/') == 'sqlite:'):
+        return {} # Banco em memória: o Flask-SQLAlchemy usa um pool próprio (uma conexão compartilhada)
+    if DB_PGBOUNCER:
+        return {'poolclass': PoolSemReuso}
+    opcoes = {'poolclass': PoolMedido, 'pool_size': DB_POOL_TAMANHO, 'max_overflow': DB_POOL_EXTRA,
+              'pool_timeout': DB_POOL_ESPERA, 'pool_recycle': DB_POOL_RECICLAR, 'pool_pre_ping': DB_POOL_PRE_PING}
+    if DB_STATEMENT_TIMEOUT_MS and uri.startswith('postgres'):
+        opcoes['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+    return opcoes
+
+def _timeout_por_transacao(conexao):
+    conexao.exec_driver_sql(f'SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}')
+
+def estatisticas_pool():
+    pool = db.engine.pool
+    with _pool_stats_lock:
+        stats = {**_pool_stats, 'faixas_ms': dict(_pool_stats['faixas_ms'])}
+    stats['espera_media_ms'] = round(stats['espera_total_ms'] / stats['retiradas'], 3) if stats['retiradas'] else 0.0
+    stats['espera_total_ms'] = round(stats['espera_total_ms'], 3)
+    stats['espera_maxima_ms'] = round(stats['espera_maxima_ms'], 3)
+    if isinstance(pool, QueuePool):
+        capacidade = pool.size() + max(pool._max_overflow, 0)
+        stats.update({'tamanho': pool.size(), 'em_uso': pool.checkedout(), 'livres': pool.checkedin(),
+                      'extras': max(pool.overflow(), 0), 'capacidade': capacidade,
+                      'saturacao': round(pool.checkedout() / capacidade, 3) if capacidade else None})
+    else: # NullPool (PgBouncer) ou pool do SQLite em memória
+        stats.update({'tamanho': None, 'em_uso': None, 'saturacao': None})
+    stats.update({'classe': type(pool).__name__, 'pgbouncer': DB_PGBOUNCER, 'statement_timeout_ms': DB_STATEMENT_TIMEOUT_MS})
+    return stats
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(app.config['SQLALCHEMY_DATABASE_URI'])
 
 db = SQLAlchemy(app) # Inicializa o SQLAlchemy com a aplicação Flask
+if DB_PGBOUNCER and DB_STATEMENT_TIMEOUT_MS:
+    with app.app_context():
+        event.listen(db.engine, 'begin', _timeout_por_transacao)
+TEMPOS_BOOT['configuracao_ms'] = round((time.perf_counter() - _INICIO_BOOT) * 1000, 1)
 
 BRASILIA_TZ = pytz.timezone('America/Sao_Paulo')
 
@@ -82,6 +244,10 @@ class Usuario(db.Model):
     atestados = db.relationship('Atestado', backref='usuario', lazy=True, cascade="all, delete-orphan")
     dados_adicionais = db.relationship('DadosUsuario', backref='usuario', uselist=False, lazy=True, cascade="all, delete-orphan")
     contabilidade = db.relationship('ContabilidadeFuncionario', backref='funcionario', uselist=False, lazy=True, cascade="all, delete-orphan")
+    resumos_diarios = db.relationship('ResumoPontoDiario', lazy=True, cascade="all, delete-orphan")
+    resumos_mensais = db.relationship('ResumoPontoMensal', lazy=True, cascade="all, delete-orphan")
+    uploads = db.relationship('UploadSessao', lazy=True, cascade="all, delete-orphan")
+    holerites = db.relationship('Holerite', lazy=True, cascade="all, delete-orphan")
 
 # Modelo para dados adicionais do usuário
 class DadosUsuario(db.Model):
@@ -92,6 +258,7 @@ class DadosUsuario(db.Model):
     nascimento = db.Column(db.Date, nullable=True)
     endereco = db.Column(db.String(255), nullable=True)
     foto_perfil = db.Column(db.String(255), nullable=True, default='default-user.png')
+    foto_miniatura = db.Column(db.String(255), nullable=True) # WEBP quadrada gerada no upload (nome local ou chave S3)
 
 # Modelo para avisos
 class Aviso(db.Model):
@@ -104,6 +271,12 @@ class Aviso(db.Model):
 # Modelo para pontos de entrada/saída
 class Ponto(db.Model):
     __tablename__ = 'pontos'
+    __table_args__ = (
+        db.Index('ix_pontos_usuario_entrada', 'usuario_id', 'entrada'), # Pontos de um usuário por período
+        # No máximo um ponto aberto (sem saída) por usuário; também localiza o turno aberto sem varrer o histórico
+        db.Index('ux_pontos_usuario_aberto', 'usuario_id', unique=True,
+                 sqlite_where=db.text('saida IS NULL'), postgresql_where=db.text('saida IS NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
     entrada = db.Column(db.DateTime, nullable=False)
@@ -127,14 +300,43 @@ class Atestado(db.Model):
     criado_em = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     status = db.Column(db.String(50), default='pendente') # 'pendente', 'aprovado', 'rejeitado'
 
+# Arquivo gravado no spool local aguardando envio ao S3 (a chave é a mesma gravada em Atestado/DadosUsuario)
+class EnvioArmazenamento(db.Model):
+    __tablename__ = 'envios_armazenamento'
+    __table_args__ = (db.Index('ix_envios_armazenamento_status_proximo', 'status', 'proximo_em'),)
+    id = db.Column(db.Integer, primary_key=True)
+    chave = db.Column(db.String(255), unique=True, nullable=False) # Chave no bucket, ex.: 'atestados/atestado_...pdf'
+    status = db.Column(db.String(20), nullable=False, default='pendente') # 'pendente', 'enviado', 'falhou', 'apagando' (limpeza de órfãos)
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proximo_em = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow) # Próxima tentativa
+    reservado_ate = db.Column(db.DateTime, nullable=True) # Worker que está enviando reserva o item até este horário
+    erro = db.Column(db.String(255), nullable=True)
+    criado_em = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    enviado_em = db.Column(db.DateTime, nullable=True)
+    ultimo_uso = db.Column(db.DateTime, nullable=True) # Último upload que reaproveitou o objeto (a carência da limpeza conta daqui)
+
+# Upload de atestado em partes: o arquivo vai sendo gravado em UPLOAD_PARCIAL_FOLDER até ser concluído
+class UploadSessao(db.Model):
+    __tablename__ = 'upload_sessoes'
+    id = db.Column(db.String(32), primary_key=True) # Token aleatório, usado na URL das partes
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    motivo = db.Column(db.String(255), nullable=False)
+    nome_arquivo = db.Column(db.String(255), nullable=False)
+    tamanho = db.Column(db.Integer, nullable=False) # Tamanho total declarado, em bytes
+    sha256 = db.Column(db.String(64), nullable=True) # Hash esperado do arquivo inteiro (opcional)
+    recebido = db.Column(db.Integer, nullable=False, default=0) # Bytes já gravados, sempre contíguos desde o início
+    criado_em = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+
 class FeedbackVisualizado(db.Model):
     __tablename__ = 'feedbacks_visualizados'
+    __table_args__ = (db.Index('ux_feedbacks_visualizados_feedback_id', 'feedback_id', unique=True),) # Uma marcação por feedback
     id = db.Column(db.Integer, primary_key=True)
     feedback_id = db.Column(db.Integer, db.ForeignKey('feedbacks.id'), nullable=False)
     visualizado_em = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
 class AtestadoVisualizado(db.Model):
     __tablename__ = 'atestados_visualizados'
+    __table_args__ = (db.Index('ux_atestados_visualizados_atestado_id', 'atestado_id', unique=True),) # Uma marcação por atestado
     id = db.Column(db.Integer, primary_key=True)
     atestado_id = db.Column(db.Integer, db.ForeignKey('atestados.id'), nullable=False)
     visualizado_em = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -151,58 +353,686 @@ class ContabilidadeFuncionario(db.Model):
     vale_transporte = db.Column(db.Float, default=0) # Novo campo para vale transporte
     vale_refeicao = db.Column(db.Float, default=0) # Novo campo para vale refeição
     bolsa_educacao = db.Column(db.Float, default=0) # Novo campo para bolsa de educação
-    historico_pagamentos = db.Column(db.Text, default='[]') # JSON com histórico de pagamentos
+    historico_pagamentos = db.Column(db.Text, default='[]') # Legado: migrado para a tabela holerites e esvaziado
+
+# Um holerite por funcionário e mês (antes era um item do JSON historico_pagamentos)
+class Holerite(db.Model):
+    __tablename__ = 'holerites'
+    __table_args__ = (db.UniqueConstraint('funcionario_id', 'mes_ano', name='ux_holerites_funcionario_mes'),
+                      db.Index('ix_holerites_mes_ano', 'mes_ano')) # Totais da empresa por mês
+    id = db.Column(db.Integer, primary_key=True)
+    funcionario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    mes_ano = db.Column(db.String(7), nullable=False) # Formato 'YYYY-MM' (ordena como data)
+    salario_bruto = db.Column(db.Float, nullable=False, default=0)
+    comissao = db.Column(db.Float, nullable=False, default=0)
+    abonos = db.Column(db.Float, nullable=False, default=0)
+    descontos_falta = db.Column(db.Float, nullable=False, default=0)
+    descontos = db.Column(db.Float, nullable=False, default=0) # Total de descontos
+    inss_percentual = db.Column(db.Float, nullable=False, default=0)
+    inss_valor = db.Column(db.Float, nullable=False, default=0)
+    irrf_percentual = db.Column(db.Float, nullable=False, default=0)
+    irrf_valor = db.Column(db.Float, nullable=False, default=0)
+    salario_liquido = db.Column(db.Float, nullable=False, default=0)
+    base_calc_fgts = db.Column(db.Float, nullable=False, default=0)
+    fgts_mes = db.Column(db.Float, nullable=False, default=0)
+    base_calc_inss = db.Column(db.Float, nullable=False, default=0)
+    base_calc_irrf = db.Column(db.Float, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='Pago') # 'Pago', 'Pendente', 'Atrasado'
+
+# Versão do esquema do banco (uma única linha, id=1), gravada por 'flask migrar-esquema'
+class VersaoEsquema(db.Model):
+    __tablename__ = 'versao_esquema'
+    id = db.Column(db.Integer, primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, nullable=True)
+
+# Versão de cada recurso listado pelas páginas; as rotas de escrita incrementam na mesma transação
+class VersaoRecurso(db.Model):
+    __tablename__ = 'versoes_recurso'
+    recurso = db.Column(db.String(50), primary_key=True) # 'avisos', 'atestados', 'feedbacks', 'funcionarios'
+    versao = db.Column(db.Integer, nullable=False, default=0)
+
+# Eventos enviados por Server-Sent Events; gravados na mesma transação da escrita que os origina
+class Evento(db.Model):
+    __tablename__ = 'eventos'
+    id = db.Column(db.Integer, primary_key=True) # Também é o Last-Event-ID usado para retomar o stream
+    tipo = db.Column(db.String(50), nullable=False) # 'aviso', 'feedback', 'atestado', 'atestado_status'
+    audiencia = db.Column(db.String(50), nullable=False) # 'todos', 'funcionarios', 'gerentes' ou 'usuario:<id>'
+    dados = db.Column(db.Text, nullable=False) # JSON
+    criado_em = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+
+# Minutos trabalhados por funcionário e dia (atualizado a cada saída registrada)
+class ResumoPontoDiario(db.Model):
+    __tablename__ = 'resumo_pontos_diario'
+    __table_args__ = (db.UniqueConstraint('usuario_id', 'dia', name='ux_resumo_pontos_diario_usuario_dia'),
+                      db.Index('ix_resumo_pontos_diario_dia', 'dia'))
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    dia = db.Column(db.Date, nullable=False) # Dia no horário de Brasília
+    minutos = db.Column(db.Integer, nullable=False, default=0)
+
+# Minutos trabalhados por funcionário e mês
+class ResumoPontoMensal(db.Model):
+    __tablename__ = 'resumo_pontos_mensal'
+    __table_args__ = (db.UniqueConstraint('usuario_id', 'ano', 'mes', name='ux_resumo_pontos_mensal_usuario_mes'),
+                      db.Index('ix_resumo_pontos_mensal_ano_mes', 'ano', 'mes'))
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    ano = db.Column(db.Integer, nullable=False)
+    mes = db.Column(db.Integer, nullable=False)
+    minutos = db.Column(db.Integer, nullable=False, default=0)
 
 
 # GARANTE QUE OS DIRETÓRIOS DE UPLOAD EXISTEM
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['UPLOAD_FOLDER_PERFIL'], exist_ok=True)
+os.makedirs(app.config['PDF_CACHE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOAD_PARCIAL_FOLDER'], exist_ok=True)
+if USE_S3:
+    os.makedirs(app.config['S3_SPOOL_FOLDER'], exist_ok=True)
+
+
+# CACHE DE AUTENTICAÇÃO (por worker)
+# Evita uma consulta ao banco a cada requisição autenticada. Cada worker do gunicorn mantém o seu
+# próprio cache; as rotas que alteram o usuário invalidam a entrada local e o TTL limita o tempo
+# em que os demais workers podem enxergar dados antigos.
+PRINCIPAL_CACHE_TTL = int(os.environ.get('PRINCIPAL_CACHE_TTL', 60)) # Segundos (0 desativa o cache)
+PRINCIPAL_CACHE_MAX = int(os.environ.get('PRINCIPAL_CACHE_MAX', 10000)) # Número máximo de usuários em cache
+
+# Snapshot leve do usuário autenticado, entregue às rotas como current_user
+UsuarioAutenticado = namedtuple('UsuarioAutenticado', ['id', 'nome', 'tipo_usuario', 'funcao'])
+
+_principal_cache = {} # user_id -> (expira_em, UsuarioAutenticado)
+_principal_cache_lock = threading.Lock()
+_principal_cache_stats = {'hits': 0, 'misses': 0, 'invalidacoes': 0}
+
+def carregar_principal(user_id):
+    agora = time.monotonic()
+    with _principal_cache_lock:
+        item = _principal_cache.get(user_id)
+        if item and item[0] > agora:
+            _principal_cache_stats['hits'] += 1
+            return item[1]
+        _principal_cache_stats['misses'] += 1
+
+    usuario = Usuario.query.filter_by(id=user_id).first() # Busca o usuário
+    if not usuario:
+        return None # Usuários inexistentes não são cacheados
+    principal = UsuarioAutenticado(usuario.id, usuario.nome, usuario.tipo_usuario, usuario.funcao)
+    if PRINCIPAL_CACHE_TTL > 0:
+        with _principal_cache_lock:
+            if len(_principal_cache) >= PRINCIPAL_CACHE_MAX:
+                # Remove as entradas expiradas e, se ainda estiver cheio, a mais antiga
+                for chave in [k for k, (expira_em, _) in _principal_cache.items() if expira_em <= agora]:
+                    del _principal_cache[chave]
+                if len(_principal_cache) >= PRINCIPAL_CACHE_MAX:
+                    del _principal_cache[next(iter(_principal_cache))]
+            _principal_cache[user_id] = (agora + PRINCIPAL_CACHE_TTL, principal)
+    return principal
+
+def invalidar_principal(user_id):
+    with _principal_cache_lock:
+        if _principal_cache.pop(user_id, None) is not None:
+            _principal_cache_stats['invalidacoes'] += 1
+
+def estatisticas_cache_principal():
+    with _principal_cache_lock:
+        total = _principal_cache_stats['hits'] + _principal_cache_stats['misses']
+        return {
+            **_principal_cache_stats,
+            'taxa_acerto': round(_principal_cache_stats['hits'] / total, 4) if total else 0.0,
+            'tamanho': len(_principal_cache),
+            'ttl': PRINCIPAL_CACHE_TTL
+        }
+
+
+# CACHE COMPARTILHADO ENTRE WORKERS
+# Arquivo SQLite local visto por todos os workers do gunicorn da mesma instância. Cada entrada guarda
+# a versão do recurso com que foi gerada; uma versão diferente conta como ausência.
+CACHE_COMPARTILHADO_PATH = os.environ.get('CACHE_COMPARTILHADO_PATH', os.path.join(tempfile.gettempdir(), 'neorh_cache.sqlite'))
+
+class CacheCompartilhado:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local() # Uma conexão SQLite por thread
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5)
+            conexao.execute('PRAGMA journal_mode=WAL') # Leituras não bloqueiam a escrita de outro worker
+            conexao.execute('CREATE TABLE IF NOT EXISTS cache (chave TEXT PRIMARY KEY, versao INTEGER NOT NULL, corpo BLOB NOT NULL)')
+            self._local.conexao = conexao
+        return conexao
+
+    def obter(self, chave, versao):
+        try:
+            linha = self._conexao().execute('SELECT versao, corpo FROM cache WHERE chave = ?', (chave,)).fetchone()
+        except sqlite3.Error as e:
+            app.logger.warning(f'Cache compartilhado indisponível: {e}')
+            return None
+        return linha[1] if linha and linha[0] == versao else None
 
+    def gravar(self, chave, versao, corpo):
+        try:
+            with self._conexao() as conexao:
+                conexao.execute('INSERT OR REPLACE INTO cache (chave, versao, corpo) VALUES (?, ?, ?)', (chave, versao, corpo))
+        except sqlite3.Error as e:
+            app.logger.warning(f'Cache compartilhado indisponível: {e}')
+
+cache_compartilhado = CacheCompartilhado(CACHE_COMPARTILHADO_PATH)
+
+
+# POOLS DE PROCESSOS
+# Cada worker do gunicorn tem os seus pools (hash de senhas, PDFs): o padrão divide os núcleos entre os workers.
+# Os processos filhos saem de um forkserver (ou spawn), nunca de um fork do worker, que já tem outras threads
+# rodando: um lock preso por uma delas no momento do fork (ex.: o do logging) travaria o filho para sempre.
+GUNICORN_WORKERS = int(os.environ.get('GUNICORN_WORKERS', 4)) # Mesmo valor do -w do entrypoint.sh/Procfile
+PROCESSOS_POR_WORKER = max((os.cpu_count() or 1) // GUNICORN_WORKERS, 1)
+CONTEXTO_PROCESSOS = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# HASH DE SENHAS
+# O pbkdf2 é intensivo em CPU: os hashes rodam em um pool de processos por worker, com um limite de
+# tarefas em andamento. Acima do limite, a requisição espera até HASH_ESPERA_MAXIMA e depois recebe 503,
+# em vez de todas as threads do worker ficarem presas na CPU durante um pico de logins.
+SENHA_HASH_METODO = os.environ.get('SENHA_HASH_METODO', 'pbkdf2:sha256:600000') # Custo do hash (werkzeug)
+HASH_PROCESSOS = int(os.environ.get('HASH_PROCESSOS', PROCESSOS_POR_WORKER)) # Por worker; 0 executa na própria thread
+HASH_FILA_MAXIMA = int(os.environ.get('HASH_FILA_MAXIMA', max(HASH_PROCESSOS, 1) * 8)) # Hashes em andamento por worker
+HASH_ESPERA_MAXIMA = float(os.environ.get('HASH_ESPERA_MAXIMA', 2.0)) # Segundos aguardando uma vaga na fila
+HASH_LOTE_MAXIMO = int(os.environ.get('HASH_LOTE_MAXIMO', max(HASH_FILA_MAXIMA // 2, 1))) # Vagas que a importação em lote pode ocupar
+
+class FilaHashCheia(Exception):
+    pass
+
+@app.errorhandler(FilaHashCheia)
+def fila_hash_cheia(e):
+    resposta = jsonify({'message': 'Servidor ocupado. Tente novamente em instantes.'})
+    resposta.headers['Retry-After'] = '1'
+    return resposta, 503
+
+_pool_hash = None
+_pool_hash_lock = threading.Lock()
+_vagas_hash = threading.BoundedSemaphore(HASH_FILA_MAXIMA)
+_vagas_hash_lote = threading.BoundedSemaphore(HASH_LOTE_MAXIMO) # O restante da fila fica para logins e cadastros
+_hash_stats = {'em_andamento': 0, 'pico': 0, 'concluidos': 0, 'falhas': 0, 'rejeitados': 0}
+_hash_stats_lock = threading.Lock()
+
+def _executor_hash():
+    global _pool_hash
+    with _pool_hash_lock:
+        if _pool_hash is None: # Criado sob demanda, uma vez por worker
+            _pool_hash = ProcessPoolExecutor(max_workers=HASH_PROCESSOS, mp_context=CONTEXTO_PROCESSOS)
+        return _pool_hash
+
+def _descartar_executor_hash(quebrado):
+    # Um processo filho morreu (OOM, segfault): o pool não aceita mais tarefas e é recriado no próximo uso
+    global _pool_hash
+    with _pool_hash_lock:
+        if _pool_hash is quebrado: # Outra thread pode já ter trocado o pool
+            _pool_hash = None
+    quebrado.shutdown(wait=False)
+    app.logger.warning('Pool de hash de senhas quebrado; recriando')
+
+def _liberar_vaga_hash(futuro=None, lote=False):
+    # Sem futuro: o envio ao pool falhou; com exceção no futuro: o hash não foi concluído (ex.: BrokenProcessPool)
+    _vagas_hash.release()
+    if lote:
+        _vagas_hash_lote.release()
+    falhou = futuro is None or futuro.cancelled() or futuro.exception() is not None
+    with _hash_stats_lock:
+        _hash_stats['em_andamento'] -= 1
+        _hash_stats['falhas' if falhou else 'concluidos'] += 1
+
+def _submeter_hash(funcao, *args, espera=HASH_ESPERA_MAXIMA, lote=False):
+    # Retorna um Future; lote=True aguarda sem limite, mas ocupa no máximo HASH_LOTE_MAXIMO vagas
+    if lote:
+        _vagas_hash_lote.acquire()
+        espera = None
+    if not _vagas_hash.acquire(timeout=espera):
+        with _hash_stats_lock:
+            _hash_stats['rejeitados'] += 1
+        raise FilaHashCheia()
+    with _hash_stats_lock:
+        _hash_stats['em_andamento'] += 1
+        _hash_stats['pico'] = max(_hash_stats['pico'], _hash_stats['em_andamento'])
+    try:
+        if HASH_PROCESSOS <= 0:
+            futuro = Future()
+            futuro.set_result(funcao(*args))
+        else:
+            executor = _executor_hash()
+            try:
+                futuro = executor.submit(funcao, *args)
+            except BrokenProcessPool:
+                _descartar_executor_hash(executor)
+                futuro = _executor_hash().submit(funcao, *args) # Uma nova tentativa, já no pool recriado
+    except BaseException:
+        _liberar_vaga_hash(lote=lote)
+        raise
+    futuro.add_done_callback(partial(_liberar_vaga_hash, lote=lote))
+    return futuro
+
+def gerar_hash_senha(senha):
+    return _submeter_hash(partial(generate_password_hash, method=SENHA_HASH_METODO), senha).result()
+
+def gerar_hashes_senha(senhas):
+    # Em lote, no máximo HASH_LOTE_MAXIMO hashes por vez: o resto da fila continua livre para logins concorrentes
+    futuros = [_submeter_hash(partial(generate_password_hash, method=SENHA_HASH_METODO), senha, lote=True) for senha in senhas]
+    return [futuro.result() for futuro in futuros]
+
+def verificar_senha(senha_hash, senha):
+    return _submeter_hash(check_password_hash, senha_hash, senha).result()
+
+_metodo_hash_normalizado = None
+
+def precisa_rehash(senha_hash):
+    # Compara o método gravado no hash (ex.: 'pbkdf2:sha256:600000') com o configurado
+    global _metodo_hash_normalizado
+    if _metodo_hash_normalizado is None: # O werkzeug completa o método com os parâmetros padrão
+        _metodo_hash_normalizado = generate_password_hash('', method=SENHA_HASH_METODO).split('$', 1)[0]
+    return senha_hash.split('$', 1)[0] != _metodo_hash_normalizado
+
+def estatisticas_hash():
+    with _hash_stats_lock:
+        return {**_hash_stats, 'fila_maxima': HASH_FILA_MAXIMA, 'lote_maximo': HASH_LOTE_MAXIMO, 'processos': HASH_PROCESSOS, 'metodo': SENHA_HASH_METODO}
+
+#  AUTENTICAÇÃO POR TOKEN
+def autenticar_requisicao(permitir_query=False):
+    # Retorna (usuário, None) ou (None, resposta de erro). permitir_query aceita ?token=, para clientes
+    # como o EventSource do navegador, que não conseguem enviar o cabeçalho Authorization.
+    token = None
+    if 'Authorization' in request.headers: # Verifica o cabeçalho Authorization
+        try:
+            token = request.headers['Authorization'].split()[1] # Espera o formato
+        except IndexError:
+            return None, (jsonify({'message': 'Token malformado'}), 401) # Token malformado
+    elif permitir_query:
+        token = request.args.get('token')
+    if not token:
+        return None, (jsonify({'message': 'Token está faltando!'}), 401) # Verifica se o token está presente
+    try:
+        data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"] # Decodifica o token
+        )
+        current_user = carregar_principal(data['user_id']) # Busca o usuário (cache ou banco)
+        if not current_user:
+            return None, (jsonify({'message': 'Usuário do token não encontrado!'}), 401) # Verifica se o usuário existe
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'message': 'Token expirado!'}), 401) # Token expirado
+    except jwt.InvalidTokenError: 
+        return None, (jsonify({'message': 'Token inválido!'}), 401)  # Token inválido
+    except Exception as e: # Captura outras exceções para depuração
+        return None, (jsonify({'message': f'Erro no token: {str(e)}'}), 401) # Retorna erro genérico
+    return current_user, None
 
 #  DECORADOR PARA ROTAS PROTEGIDAS
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers: # Verifica o cabeçalho Authorization
-            try:
-                token = request.headers['Authorization'].split()[1] # Espera o formato
-            except IndexError:
-                return jsonify({'message': 'Token malformado'}), 401 # Token malformado
-        if not token:
-            return jsonify({'message': 'Token está faltando!'}), 401 # Verifica se o token está presente
-        try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"] # Decodifica o token
-            )
-            current_user = Usuario.query.filter_by(id=data['user_id']).first() # Busca o usuário
-            if not current_user:
-                return jsonify({'message': 'Usuário do token não encontrado!'}), 401 # Verifica se o usuário existe
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token expirado!'}), 401 # Token expirado
-        except jwt.InvalidTokenError: 
-            return jsonify({'message': 'Token inválido!'}), 401  # Token inválido
-        except Exception as e: # Captura outras exceções para depuração
-            return jsonify({'message': f'Erro no token: {str(e)}'}), 401 # Retorna erro genérico
+        inicio = time.perf_counter()
+        current_user, erro = autenticar_requisicao()
+        g.tempo_autenticacao = time.perf_counter() - inicio # Custo da autenticação, separado nas métricas
+        if erro:
+            return erro
         return f(current_user, *args, **kwargs) # Passa o usuário atual para a função decorada
     return decorated # Retorna a função decorada
 
-# CRIA AS TABELAS NO BANCO DE DADOS
+# PAGINAÇÃO POR CURSOR (KEYSET)
+# Quando a requisição traz `limit` ou `cursor`, as listas são paginadas pela própria chave de ordenação
+# (ex.: Ponto.entrada + id), então qualquer página custa o mesmo que a primeira. O corpo continua sendo
+# uma lista JSON e o cursor da próxima página vai no cabeçalho X-Next-Cursor.
+PAGINACAO_LIMITE_PADRAO = int(os.environ.get('PAGINACAO_LIMITE_PADRAO', 50))
+PAGINACAO_LIMITE_MAXIMO = int(os.environ.get('PAGINACAO_LIMITE_MAXIMO', 500))
+
+class CursorInvalido(ValueError):
+    pass
+
+@app.errorhandler(413)
+def requisicao_grande_demais(e):
+    return jsonify({'message': 'Arquivo ou requisição maior que o permitido.'}), 413
+
+@app.errorhandler(CursorInvalido)
+def cursor_invalido(e):
+    return jsonify({'message': str(e)}), 400
+
+def _codificar_cursor(valores):
+    valores = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in valores]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+def _decodificar_cursor(cursor, colunas):
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(valores, list) or len(valores) != len(colunas):
+            raise ValueError
+        return tuple(
+            datetime.datetime.fromisoformat(v) if isinstance(c.type, db.DateTime) else c.type.python_type(v)
+            for c, v in zip(colunas, valores)
+        )
+    except (ValueError, TypeError):
+        raise CursorInvalido('Cursor de paginação inválido.')
+
+def paginar(query, colunas, chave, descendente=True):
+    # colunas: colunas de ordenação (a última deve ser única, ex.: id); chave: extrai esses valores de uma linha
+    query = query.order_by(*[c.desc() if descendente else c.asc() for c in colunas])
+    limite = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    if limite is None and not cursor:
+        return query.all(), None # Sem paginação: mantém o comportamento original
+    limite = min(max(limite or PAGINACAO_LIMITE_PADRAO, 1), PAGINACAO_LIMITE_MAXIMO)
+    if cursor:
+        posicao = _decodificar_cursor(cursor, colunas)
+        comparacao = tuple_(*colunas) < posicao if descendente else tuple_(*colunas) > posicao
+        query = query.filter(comparacao) # Continua exatamente após a última linha da página anterior
+    linhas = query.limit(limite + 1).all() # Uma linha extra indica se existe próxima página
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        return linhas, _codificar_cursor(chave(linhas[-1]))
+    return linhas, None
+
+def resposta_paginada(itens, proximo_cursor):
+    resposta = jsonify(itens)
+    if proximo_cursor:
+        resposta.headers['X-Next-Cursor'] = proximo_cursor # Cursor para a próxima página
+    return resposta
+
+# FILTROS DE PERÍODO
+def intervalo_mes(year, month):
+    start_date = datetime.datetime(year, month, 1) # Lança ValueError se o mês for inválido
+    if month == 12: # Se for dezembro, o próximo mês é janeiro do próximo ano
+        end_date = datetime.datetime(year + 1, 1, 1) # Próximo ano
+    else:
+        end_date = datetime.datetime(year, month + 1, 1) # Próximo mês
+    return start_date, end_date
+
+def _ler_data(nome):
+    valor = request.args.get(nome)
+    if not valor:
+        return None
+    return datetime.datetime.strptime(valor, '%Y-%m-%d') # Lança ValueError se o formato for inválido
+
+def filtrar_periodo(query, coluna):
+    # Aplica ?month=&year= e/ou ?inicio=&fim= (YYYY-MM-DD, inclusive) como intervalo [início, fim) na coluna,
+    # o que permite ao banco usar o índice da coluna. Lança ValueError para parâmetros inválidos.
+    month = request.args.get('month', type=int) # Mês
+    year = request.args.get('year', type=int) # Ano
+    if month or year:
+        if not (month and year):
+            raise ValueError('Informe mês e ano juntos.')
+        start_date, end_date = intervalo_mes(year, month)
+        query = query.filter(coluna >= start_date, coluna < end_date)
+    inicio = _ler_data('inicio') # Data inicial (inclusive)
+    fim = _ler_data('fim') # Data final (inclusive)
+    if inicio:
+        query = query.filter(coluna >= inicio)
+    if fim:
+        query = query.filter(coluna < fim + datetime.timedelta(days=1))
+    return query
+
+# VERSÕES DE RECURSOS E GET CONDICIONAL (ETag / If-None-Match)
+RECURSOS_VERSIONADOS = ('avisos', 'atestados', 'feedbacks', 'funcionarios')
+
+def incrementar_versao(*recursos):
+    # Deve ser chamada antes do commit da escrita, para que a versão mude junto com os dados
+    for recurso in recursos:
+        atualizados = VersaoRecurso.query.filter_by(recurso=recurso).update(
+            {VersaoRecurso.versao: VersaoRecurso.versao + 1}, synchronize_session=False)
+        if not atualizados:
+            db.session.add(VersaoRecurso(recurso=recurso, versao=1))
+
+def versoes_recursos(recursos):
+    versoes = dict(db.session.query(VersaoRecurso.recurso, VersaoRecurso.versao).filter(VersaoRecurso.recurso.in_(recursos)).all())
+    return [versoes.get(recurso, 0) for recurso in recursos]
+
+def condicional(*recursos):
+    # Responde 304 sem executar a consulta da lista quando nenhum dos recursos mudou desde o ETag do cliente.
+    # A versão é lida antes da consulta: se uma escrita acontecer no meio, o próximo pedido recebe os dados novos.
+    def decorador(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            assinatura = f'{recursos}:{versoes_recursos(recursos)}:{current_user.id}:{request.full_path}'
+            etag = hashlib.sha1(assinatura.encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                resposta = Response(status=304) # Não modificado
+            else:
+                resposta = make_response(f(current_user, *args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+            resposta.set_etag(etag)
+            resposta.headers['Cache-Control'] = 'private, no-cache' # O navegador sempre revalida com If-None-Match
+            return resposta
+        return decorated
+    return decorador
+
+# AJUDANTES DAS MIGRAÇÕES
+# db.create_all() não cria índices nem colunas em tabelas que já existem; estas rotinas criam os que faltarem.
+def _criar_indice_se_faltar(modelo, nome, preparar=None):
+    indice = next(i for i in modelo.__table__.indexes if i.name == nome)
+    existentes = {i['name'] for i in sa_inspect(db.engine).get_indexes(indice.table.name)}
+    if indice.name in existentes:
+        return
+    if preparar:
+        preparar() # Ajusta (ou recusa, com exceção) os dados atuais antes de criar o índice
+    indice.create(bind=db.engine)
+    app.logger.info(f'migrar-esquema: índice {indice.name} criado')
+
+def _adicionar_coluna_se_faltar(modelo, nome):
+    # Colunas novas em tabelas existentes (sempre anuláveis, sem valor padrão no banco)
+    tabela = modelo.__table__
+    if nome in {c['name'] for c in sa_inspect(db.engine).get_columns(tabela.name)}:
+        return
+    tipo = tabela.c[nome].type.compile(dialect=db.engine.dialect)
+    with db.engine.begin() as conexao:
+        conexao.execute(db.text(f'ALTER TABLE {tabela.name} ADD COLUMN {nome} {tipo}'))
+    app.logger.info(f'migrar-esquema: coluna {tabela.name}.{nome} criada')
+
+def _remover_visualizacoes_duplicadas(tabela, coluna):
+    def preparar():
+        db.session.execute(db.text(
+            f'DELETE FROM {tabela} WHERE id NOT IN (SELECT MIN(id) FROM {tabela} GROUP BY {coluna})'
+        )) # Mantém apenas a primeira marcação de cada registro
+        db.session.commit()
+    return preparar
+
+def _verificar_pontos_abertos_duplicados():
+    duplicados = db.session.query(Ponto.usuario_id).filter(Ponto.saida.is_(None)).group_by(Ponto.usuario_id).having(
+        db.func.count(Ponto.id) > 1).all()
+    if duplicados:
+        # Não fecha pontos automaticamente: a migração falha (e a versão não avança) até o gerente corrigir os
+        # registros e rodar 'flask migrar-esquema' de novo
+        raise RuntimeError(f'migrar-esquema: usuários com mais de um ponto aberto {[u for u, in duplicados]}; '
+                           'feche os pontos duplicados para criar o índice ux_pontos_usuario_aberto')
+
+# HOLERITES
+CAMPOS_VALORES_HOLERITE = ('salario_bruto', 'comissao', 'abonos', 'descontos_falta', 'descontos', 'inss_percentual',
+                           'inss_valor', 'irrf_percentual', 'irrf_valor', 'salario_liquido', 'base_calc_fgts',
+                           'fgts_mes', 'base_calc_inss', 'base_calc_irrf')
+MES_ANO_RE = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+def validar_mes_ano(valor):
+    valor = (valor or '').strip()
+    if not MES_ANO_RE.match(valor):
+        raise ValueError(f'Mês inválido: {valor!r}. Use o formato YYYY-MM.')
+    return valor
+
+def dados_holerite(item):
+    # Converte um item do histórico (JSON do formulário) nas colunas da tabela; ValueError se inválido
+    if not isinstance(item, dict):
+        raise ValueError('Cada holerite deve ser um objeto.')
+    dados = {'mes_ano': validar_mes_ano(item.get('mes_ano')), 'status': str(item.get('status') or 'Pago')[:20]}
+    for campo in CAMPOS_VALORES_HOLERITE:
+        try:
+            dados[campo] = float(item.get(campo) or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"Valor inválido em {campo} ({dados['mes_ano']}).")
+    return dados
+
+def serializar_holerite(h):
+    return {'mes_ano': h.mes_ano, **{campo: getattr(h, campo) for campo in CAMPOS_VALORES_HOLERITE}, 'status': h.status}
+
+def holerites_do_funcionario(funcionario_id):
+    return [serializar_holerite(h) for h in Holerite.query.filter_by(funcionario_id=funcionario_id).order_by(Holerite.mes_ano)]
+
+def salvar_holerites(funcionario_id, historico):
+    # O formulário envia o histórico completo: atualiza os meses existentes, cria os novos e remove os ausentes
+    novos = {}
+    for item in historico:
+        dados = dados_holerite(item)
+        if dados['mes_ano'] in novos:
+            raise ValueError(f"Holerite repetido para {dados['mes_ano']}.")
+        novos[dados['mes_ano']] = dados
+    for holerite in Holerite.query.filter_by(funcionario_id=funcionario_id).all():
+        dados = novos.pop(holerite.mes_ano, None)
+        if dados is None:
+            db.session.delete(holerite)
+        else:
+            for campo, valor in dados.items():
+                setattr(holerite, campo, valor)
+    db.session.add_all([Holerite(funcionario_id=funcionario_id, **dados) for dados in novos.values()])
+
+def migrar_historico_pagamentos(lote=200):
+    # Copia os JSONs legados para a tabela holerites e tira do JSON, na mesma transação, só o que foi migrado (idempotente).
+    # Itens inválidos (e JSONs ilegíveis) continuam no historico_pagamentos para correção manual; o cursor pelo id
+    # evita reler esses registros a cada lote.
+    pendentes = ContabilidadeFuncionario.historico_pagamentos.notin_(['[]', ''])
+    funcionarios = holerites = ignorados = 0
+    ultimo_id = 0
+    while True:
+        contabilidades = ContabilidadeFuncionario.query.filter(pendentes, ContabilidadeFuncionario.id > ultimo_id).order_by(
+            ContabilidadeFuncionario.id).limit(lote).all()
+        if not contabilidades:
+            return funcionarios, holerites, ignorados
+        ultimo_id = contabilidades[-1].id
+        existentes = set(db.session.query(Holerite.funcionario_id, Holerite.mes_ano).filter(
+            Holerite.funcionario_id.in_([c.funcionario_id for c in contabilidades])).all())
+        for contabilidade in contabilidades:
+            try:
+                historico = json.loads(contabilidade.historico_pagamentos)
+            except ValueError:
+                historico = None
+            if not isinstance(historico, list): # Mantém o texto original intacto
+                app.logger.warning('migrar_historico_pagamentos: funcionário %s: historico_pagamentos ilegível, mantido',
+                                   contabilidade.funcionario_id)
+                ignorados += 1
+                continue
+            restantes = []
+            for item in historico:
+                try:
+                    dados = dados_holerite(item)
+                except ValueError as e:
+                    app.logger.warning('migrar_historico_pagamentos: funcionário %s: %s (item mantido)', contabilidade.funcionario_id, e)
+                    restantes.append(item)
+                    ignorados += 1
+                    continue
+                if (contabilidade.funcionario_id, dados['mes_ano']) in existentes: # Mês repetido no JSON ou já migrado
+                    ignorados += 1
+                    continue
+                existentes.add((contabilidade.funcionario_id, dados['mes_ano']))
+                db.session.add(Holerite(funcionario_id=contabilidade.funcionario_id, **dados))
+                holerites += 1
+            contabilidade.historico_pagamentos = json.dumps(restantes)
+            funcionarios += 1
+        db.session.commit()
+
+# MIGRAÇÕES VERSIONADAS DO ESQUEMA
+# Cada migração roda uma única vez por banco, em ordem, e grava a versão alcançada em versao_esquema.
+# Quem aplica é o passo de inicialização ('flask migrar-esquema', chamado pelo entrypoint.sh antes do gunicorn);
+# os workers só conferem a versão ao subir. Novas alterações de esquema entram no fim de MIGRACOES.
+def _migracao_tabelas():
+    db.create_all() # Banco novo: cria tudo; banco antigo: só as tabelas que faltam
+
+def _migracao_indices_unicos_visualizacoes():
+    _criar_indice_se_faltar(FeedbackVisualizado, 'ux_feedbacks_visualizados_feedback_id',
+                            _remover_visualizacoes_duplicadas('feedbacks_visualizados', 'feedback_id'))
+    _criar_indice_se_faltar(AtestadoVisualizado, 'ux_atestados_visualizados_atestado_id',
+                            _remover_visualizacoes_duplicadas('atestados_visualizados', 'atestado_id'))
+
+def _migracao_indices_pontos():
+    _criar_indice_se_faltar(Ponto, 'ix_pontos_usuario_entrada') # O índice de ponto aberto único é a migração 8
+
+def _migracao_versoes_recurso():
+    existentes = {r for r, in db.session.query(VersaoRecurso.recurso).all()}
+    db.session.add_all([VersaoRecurso(recurso=r, versao=0) for r in RECURSOS_VERSIONADOS if r not in existentes])
+    db.session.commit() # Cria as linhas de versão de antemão, evitando inserções concorrentes
+
+def _migracao_holerites():
+    if ContabilidadeFuncionario.query.filter(ContabilidadeFuncionario.historico_pagamentos.notin_(['[]', ''])).first():
+        app.logger.info('migrar-esquema: historico_pagamentos migrado para holerites: %s', migrar_historico_pagamentos())
+
+def _migracao_foto_miniatura():
+    _adicionar_coluna_se_faltar(DadosUsuario, 'foto_miniatura')
+
+def _migracao_ultimo_uso_envios():
+    _adicionar_coluna_se_faltar(EnvioArmazenamento, 'ultimo_uso')
+
+def _migracao_ponto_aberto_unico():
+    # Separada da migração 3: bancos que já passaram dela com pontos duplicados (o índice era pulado) também o recebem
+    _criar_indice_se_faltar(Ponto, 'ux_pontos_usuario_aberto', _verificar_pontos_abertos_duplicados)
+
+def _migracao_gerente_padrao():
+    # Adiciona o usuário gerente padrão se não existir
+    if not Usuario.query.filter_by(email='gerente@empresa.com').first():
+        senha_hash = generate_password_hash('Gerente123!', method=SENHA_HASH_METODO) # Senha padrão
+        gerente = Usuario(nome='Gerente Padrão', email='gerente@empresa.com', senha=senha_hash, tipo_usuario='gerente') # Cria o gerente
+        db.session.add(gerente) # Adiciona ao banco
+        db.session.flush() # Gera o id do gerente
+        db.session.add(DadosUsuario(user_id=gerente.id)) # Cria os dados adicionais
+        db.session.commit() # Salva as mudanças
+        app.logger.info('migrar-esquema: default manager created')
+
+MIGRACOES = ( # (versão, descrição, função)
+    (1, 'tabelas iniciais', _migracao_tabelas),
+    (2, 'índices únicos de visualizações', _migracao_indices_unicos_visualizacoes),
+    (3, 'índices de pontos', _migracao_indices_pontos),
+    (4, 'linhas de versões de recursos', _migracao_versoes_recurso),
+    (5, 'holerites a partir do historico_pagamentos', _migracao_holerites),
+    (6, 'coluna dados_usuario.foto_miniatura', _migracao_foto_miniatura),
+    (7, 'gerente padrão', _migracao_gerente_padrao),
+    (8, 'índice único de ponto aberto', _migracao_ponto_aberto_unico),
+    (9, 'coluna envios_armazenamento.ultimo_uso', _migracao_ultimo_uso_envios),
+)
+ESQUEMA_VERSAO = MIGRACOES[-1][0] # Versão que este código espera encontrar no banco
+ESQUEMA_LOCK_ID = 7305110 # Chave do advisory lock do PostgreSQL (impede dois passos de inicialização simultâneos)
+
+def versao_do_esquema():
+    # None se a tabela versao_esquema ainda não existe (banco novo ou anterior às migrações versionadas)
+    try:
+        return db.session.query(VersaoEsquema.versao).filter_by(id=1).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return None
+    finally:
+        db.session.rollback()
+
+def aplicar_migracoes():
+    # Aplica as migrações pendentes; devolve a lista de versões aplicadas
+    with db.engine.connect() as conexao_lock:
+        if db.engine.dialect.name == 'postgresql': # Outro container subindo ao mesmo tempo espera aqui
+            conexao_lock.execute(db.text('SELECT pg_advisory_lock(:id)'), {'id': ESQUEMA_LOCK_ID})
+        try:
+            VersaoEsquema.__table__.create(bind=db.engine, checkfirst=True)
+            atual = versao_do_esquema() or 0
+            aplicadas = []
+            for versao, descricao, migracao in MIGRACOES:
+                if versao <= atual:
+                    continue
+                inicio = time.perf_counter()
+                migracao()
+                registro = db.session.get(VersaoEsquema, 1) or VersaoEsquema(id=1)
+                registro.versao, registro.atualizado_em = versao, datetime.datetime.utcnow()
+                db.session.add(registro)
+                db.session.commit() # Uma falha no meio recomeça da migração seguinte à última gravada
+                app.logger.info(f'migrar-esquema: {versao} ({descricao}) aplicada em {(time.perf_counter() - inicio) * 1000:.0f} ms')
+                aplicadas.append(versao)
+            return aplicadas
+        finally:
+            if db.engine.dialect.name == 'postgresql':
+                conexao_lock.execute(db.text('SELECT pg_advisory_unlock(:id)'), {'id': ESQUEMA_LOCK_ID})
+                conexao_lock.commit()
+
+# CRIA AS TABELAS NO BANCO DE DADOS (passo de inicialização e desenvolvimento local)
 def create_tables():
     with app.app_context():
-        app.logger.info('create_tables: starting db.create_all()')
-        db.create_all()
-        # Adiciona o usuário gerente padrão se não existir
-        if not Usuario.query.filter_by(email='gerente@empresa.com').first():
-            senha_hash = generate_password_hash('Gerente123!', method='pbkdf2:sha256') # Senha padrão
-            gerente = Usuario(nome='Gerente Padrão', email='gerente@empresa.com', senha=senha_hash, tipo_usuario='gerente') # Cria o gerente
-            db.session.add(gerente) # Adiciona ao banco
-            db.session.commit() # Salva as mudanças
-            # Cria os dados adicionais para o gerente
-            dados_gerente = DadosUsuario(user_id=gerente.id) # Cria os dados adicionais
-            db.session.add(dados_gerente) # Adiciona ao banco
-            db.session.commit() # Salva as mudanças
-            app.logger.info('create_tables: default manager created')
-
+        aplicadas = aplicar_migracoes()
+        app.logger.info(f'create_tables: esquema na versão {ESQUEMA_VERSAO} (aplicadas agora: {aplicadas or "nenhuma"})')
+        return aplicadas
 
 # Configurações de upload de arquivos (atestados)
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
@@ -210,17 +1040,6 @@ ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS # Verifica extensões permitidas
 
-# Garante que as tabelas existam quando o módulo for importado (ex: gunicorn)
-try:
-    app.logger.info('create_tables: import-time call attempting')
-    create_tables()
-except Exception:
-    # Em alguns ambientes (build, ou se DB não estiver disponível) falhar aqui é aceitável;
-    # o container/serviço deverá logar o erro e tentar novamente quando o DB estiver pronto.
-    app.logger.exception('create_tables: import-time call failed')
-    pass
-
-
 # ROTAS DE AUTENTICAÇÃO
 @app.route('/register', methods=['POST']) # ROTA DE REGISTRO
 def register(): 
@@ -240,9 +1059,10 @@ def register():
     elif data['tipo_usuario'] != 'funcionario': # Apenas 'gerente' ou 'funcionario' são permitidos
         return jsonify({'message': 'Tipo de usuário inválido para registro.'}), 400 # Tipo inválido
 
-    hashed = generate_password_hash(data['senha'], method='pbkdf2:sha256') # Hash da senha
+    hashed = gerar_hash_senha(data['senha']) # Hash da senha
     user = Usuario(nome=data['nome'], email=data['email'], senha=hashed, tipo_usuario=data['tipo_usuario']) # Cria o usuário
     db.session.add(user) # Adiciona ao banco
+    incrementar_versao('funcionarios')
     db.session.commit() # Salva as mudanças
     # Cria os dados adicionais do usuário
     dados_adicionais = DadosUsuario(user_id=user.id) 
@@ -262,8 +1082,11 @@ def login():
         return jsonify({'message': 'Email e senha são obrigatórios!'}), 400 # Verifica campos obrigatórios
     # Busca o usuário no banco de dados
     user = Usuario.query.filter_by(email=email).first()
-    if not user or not check_password_hash(user.senha, senha):
+    if not user or not verificar_senha(user.senha, senha):
         return jsonify({'message': 'Credenciais inválidas!'}), 401 # Verifica credenciais
+    if precisa_rehash(user.senha): # Atualiza hashes gerados com outro método/custo
+        user.senha = gerar_hash_senha(senha)
+        db.session.commit()
     # Gera o token JWT com expiração de 8 horas
     token = jwt.encode({'user_id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=8)}, app.config['SECRET_KEY'], algorithm="HS256")
     return jsonify({'token': token, 'tipo_usuario': user.tipo_usuario, 'nome_usuario': user.nome}) # Retorna o token e tipo de usuário
@@ -355,22 +1178,101 @@ def cadastrar_funcionario(current_user):
     if Usuario.query.filter_by(email=email).first():
         return jsonify({'message': 'E-mail já cadastrado.'}), 400 # Verifica email duplicado
 
-    hashed_password = generate_password_hash(senha) # Hash da senha
+    hashed_password = gerar_hash_senha(senha) # Hash da senha
     novo_usuario = Usuario(nome=nome, email=email, senha=hashed_password, tipo_usuario='funcionario') # Cria o usuário
     db.session.add(novo_usuario)
     db.session.commit()
 
     # Dados adicionais (corrigido: user_id)
     dados = DadosUsuario(user_id=novo_usuario.id, telefone=telefone) # Cria os dados adicionais
-    if foto:
-        filename = secure_filename(foto.filename) # Segurança no nome do arquivo
-        foto.save(os.path.join(app.config['UPLOAD_FOLDER_PERFIL'], filename)) # Salva a foto
-        dados.foto_perfil = filename # Salva o nome do arquivo no banco
+    if foto and foto.filename:
+        salvar_foto_perfil(dados, foto) # Nomeada pelo conteúdo (não pelo nome do arquivo enviado), com miniatura
     db.session.add(dados)
+    incrementar_versao('funcionarios')
     db.session.commit() # Salva as mudanças
+    if USE_S3 and foto:
+        enviador_s3.acordar()
 
     return jsonify({'message': 'Funcionário cadastrado com sucesso!'}) # Retorna sucesso
 
+# IMPORTAÇÃO EM LOTE DE FUNCIONÁRIOS
+IMPORTACAO_MAX_LINHAS = int(os.environ.get('IMPORTACAO_MAX_LINHAS', 5000))
+IMPORTACAO_LOTE = 500 # Linhas por consulta de e-mails e por INSERT em lote
+CAMPOS_IMPORTACAO = ('nome', 'email', 'senha', 'telefone', 'funcao')
+
+def _ler_linhas_importacao():
+    # Aceita um CSV (campo 'arquivo') ou JSON (lista ou {'funcionarios': [...]})
+    arquivo = request.files.get('arquivo')
+    if arquivo:
+        leitor = csv.DictReader(io.TextIOWrapper(arquivo.stream, encoding='utf-8-sig'))
+        return [{k.strip().lower(): (v or '').strip() for k, v in linha.items() if k} for linha in leitor]
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('funcionarios')
+    if not isinstance(data, list) or not all(isinstance(linha, dict) for linha in data):
+        raise ValueError
+    return [{k: str(linha.get(k) or '').strip() for k in CAMPOS_IMPORTACAO} for linha in data]
+
+@app.route('/api/gerente/funcionarios/importar', methods=['POST'])
+@token_required
+def importar_funcionarios(current_user):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403 # Verifica se é gerente
+    try:
+        linhas = _ler_linhas_importacao()
+    except (ValueError, UnicodeDecodeError, csv.Error):
+        return jsonify({'message': 'Envie um CSV no campo arquivo ou uma lista JSON de funcionários.'}), 400
+    if len(linhas) > IMPORTACAO_MAX_LINHAS:
+        return jsonify({'message': f'Máximo de {IMPORTACAO_MAX_LINHAS} funcionários por importação.'}), 400
+
+    # Validação por linha (no CSV, a linha 1 é o cabeçalho)
+    erros, validas, emails_vistos = [], [], set()
+    for numero, linha in enumerate(linhas, 2 if request.files.get('arquivo') else 1):
+        email = linha.get('email', '').lower()
+        if not linha.get('nome') or not email or not linha.get('senha'):
+            erros.append({'linha': numero, 'email': email, 'message': 'Nome, email e senha são obrigatórios.'})
+        elif '@' not in email:
+            erros.append({'linha': numero, 'email': email, 'message': 'E-mail inválido.'})
+        elif email in emails_vistos:
+            erros.append({'linha': numero, 'email': email, 'message': 'E-mail repetido no arquivo.'})
+        else:
+            emails_vistos.add(email)
+            validas.append((numero, email, linha))
+
+    # E-mails já cadastrados: uma consulta por lote, em vez de uma por funcionário
+    cadastrados = set()
+    emails = [email for _, email, _ in validas]
+    for i in range(0, len(emails), IMPORTACAO_LOTE):
+        lote = emails[i:i + IMPORTACAO_LOTE]
+        cadastrados.update(e.lower() for e, in db.session.query(Usuario.email).filter(db.func.lower(Usuario.email).in_(lote)))
+    erros.extend({'linha': numero, 'email': email, 'message': 'E-mail já cadastrado.'}
+                 for numero, email, _ in validas if email in cadastrados)
+    validas = [v for v in validas if v[1] not in cadastrados]
+
+    hashes = gerar_hashes_senha([linha['senha'] for _, _, linha in validas])
+
+    # Insere tudo em uma única transação, em lotes
+    try:
+        for i in range(0, len(validas), IMPORTACAO_LOTE):
+            lote = validas[i:i + IMPORTACAO_LOTE]
+            usuarios = [Usuario(nome=linha['nome'], email=email, senha=senha_hash, tipo_usuario='funcionario',
+                                funcao=linha.get('funcao') or None)
+                        for (_, email, linha), senha_hash in zip(lote, hashes[i:i + IMPORTACAO_LOTE])]
+            db.session.add_all(usuarios)
+            db.session.flush() # Gera os ids em lote
+            db.session.add_all([DadosUsuario(user_id=u.id, telefone=linha.get('telefone') or None)
+                                for u, (_, _, linha) in zip(usuarios, lote)])
+            db.session.flush()
+        if validas:
+            incrementar_versao('funcionarios')
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback() # Um e-mail foi cadastrado por outra requisição durante a importação
+        return jsonify({'message': 'Conflito ao importar: um dos e-mails foi cadastrado durante a importação. Tente novamente.'}), 409
+
+    erros.sort(key=lambda e: e['linha'])
+    return jsonify({'importados': len(validas), 'erros': erros}) # Relatório por linha
+
 # ROTA PARA LISTAR FUNCIONÁRIOS
 @app.route('/api/funcionarios', methods=['GET'])
 @token_required # Protege a rota
@@ -406,10 +1308,12 @@ def editar_funcionario(current_user, user_id):
             return jsonify({'message': 'Email já registrado para outro usuário!'}), 400 # Verifica email duplicado
         funcionario.email = data['email']
     if 'senha' in data and data['senha']:
-        funcionario.senha = generate_password_hash(data['senha'], method='pbkdf2:sha256') # Atualiza a senha se fornecida
+        funcionario.senha = gerar_hash_senha(data['senha']) # Atualiza a senha se fornecida
     if 'funcao' in data:  # <-- ADICIONE ESTA LINHA
         funcionario.funcao = data['funcao'] # Atualiza a função se fornecida
+    incrementar_versao('funcionarios')
     db.session.commit() # Salva as mudanças
+    invalidar_principal(user_id) # Remove o usuário do cache de autenticação
     return jsonify({'message': 'Funcionário atualizado com sucesso!'}) # Retorna sucesso
 
 # ROTA PARA EXCLUIR FUNCIONÁRIO
@@ -424,59 +1328,461 @@ def excluir_funcionario(current_user, user_id):
     
     # A remoção em cascata é configurada nos relacionamentos do modelo Usuario
     # db.session.delete(funcionario) irá automaticamente deletar DadosUsuario, Ponto, Feedback, Atestado
+    # Os arquivos dos atestados e da foto ficam para 'flask limpar-arquivos-orfaos' (podem ser usados por outras linhas)
     db.session.delete(funcionario)
+    incrementar_versao('funcionarios', 'feedbacks', 'atestados') # Feedbacks e atestados do funcionário também são removidos
     db.session.commit()
+    invalidar_principal(user_id) # Remove o usuário do cache de autenticação
     return jsonify({'message': 'Funcionário excluído com sucesso!'}) # Retorna sucesso
 
+# EVENTOS EM TEMPO REAL (SERVER-SENT EVENTS)
+EVENTOS_INTERVALO = float(os.environ.get('EVENTOS_INTERVALO', 1.0)) # Segundos entre consultas à tabela de eventos
+EVENTOS_HEARTBEAT = int(os.environ.get('EVENTOS_HEARTBEAT', 15)) # Segundos entre comentários de keep-alive
+EVENTOS_DURACAO_MAXIMA = int(os.environ.get('EVENTOS_DURACAO_MAXIMA', 300)) # O navegador reconecta com Last-Event-ID
+EVENTOS_BUFFER = 1000 # Eventos recentes mantidos em memória por worker
+EVENTOS_ESPERA_LACUNA = float(os.environ.get('EVENTOS_ESPERA_LACUNA', 5.0)) # Segundos esperando um id que ainda não apareceu
+
+def registrar_evento(tipo, audiencia, dados):
+    # Deve ser chamada antes do commit: o evento só existe se a escrita for confirmada
+    db.session.add(Evento(tipo=tipo, audiencia=audiencia, dados=json.dumps(dados, ensure_ascii=False)))
+
+def audiencias_do_usuario(usuario):
+    audiencias = {'todos', f'usuario:{usuario.id}'}
+    if usuario.tipo_usuario == 'gerente':
+        audiencias |= {'gerentes', 'funcionarios'} # O gerente também acompanha os avisos enviados aos funcionários
+    else:
+        audiencias.add('funcionarios')
+    return audiencias
+
+class CentralEventos:
+    # Uma thread por worker consulta a tabela de eventos enquanto houver conexões abertas e acorda todas
+    # elas de uma vez, em vez de cada conexão consultar o banco por conta própria.
+    def __init__(self):
+        self._condicao = threading.Condition()
+        self._eventos = deque(maxlen=EVENTOS_BUFFER) # (id, tipo, audiencia, dados)
+        self._base_id = None # Eventos com id <= base não estão no buffer
+        self._ultimo_id = None # Todos os eventos com id <= este já foram lidos (ou a lacuna expirou)
+        self._lacunas = {} # id ausente -> instante em que a lacuna foi vista
+        self._assinantes = 0
+        self._thread = None
+
+    def assinar(self):
+        with self._condicao:
+            self._assinantes += 1
+            if self._thread is None:
+                with app.app_context():
+                    self._ultimo_id = self._base_id = db.session.query(db.func.coalesce(db.func.max(Evento.id), 0)).scalar()
+                    db.session.remove()
+                self._thread = threading.Thread(target=self._consultar, name='central-eventos', daemon=True)
+                self._thread.start()
+            self._condicao.notify_all()
+            return self._ultimo_id
+
+    def cancelar(self):
+        with self._condicao:
+            self._assinantes -= 1
+
+    def confirmado(self):
+        with self._condicao:
+            return self._ultimo_id
+
+    def _sem_lacunas(self, ultimo_id, novos):
+        # No PostgreSQL o id sai da sequência no INSERT, mas a linha só aparece no COMMIT: o evento N pode
+        # ficar visível depois do N+1. Só avança até a primeira lacuna; uma lacuna mais velha que
+        # EVENTOS_ESPERA_LACUNA é tratada como transação desfeita (a sequência não reaproveita ids).
+        agora = time.monotonic()
+        aceitos = []
+        for evento in novos:
+            for faltante in range(ultimo_id + 1, evento[0]):
+                visto = self._lacunas.setdefault(faltante, agora)
+                if agora - visto < EVENTOS_ESPERA_LACUNA:
+                    return aceitos
+            aceitos.append(evento)
+            ultimo_id = evento[0]
+        return aceitos
+
+    def _consultar(self):
+        while True:
+            with self._condicao:
+                while self._assinantes == 0:
+                    self._condicao.wait() # Sem conexões abertas, não consulta o banco
+                ultimo_id = self._ultimo_id
+            try:
+                with app.app_context():
+                    novos = db.session.query(Evento.id, Evento.tipo, Evento.audiencia, Evento.dados).filter(
+                        Evento.id > ultimo_id).order_by(Evento.id.asc()).limit(EVENTOS_BUFFER).all()
+                    db.session.remove()
+            except Exception:
+                app.logger.exception('central-eventos: falha ao consultar eventos')
+                novos = []
+            novos = self._sem_lacunas(ultimo_id, novos)
+            if novos:
+                with self._condicao:
+                    if len(self._eventos) + len(novos) > EVENTOS_BUFFER:
+                        descartados = len(self._eventos) + len(novos) - EVENTOS_BUFFER
+                        self._base_id = (list(self._eventos) + novos)[descartados - 1][0]
+                    self._eventos.extend(tuple(e) for e in novos)
+                    self._ultimo_id = novos[-1][0]
+                    self._lacunas = {i: visto for i, visto in self._lacunas.items() if i > self._ultimo_id}
+                    self._condicao.notify_all()
+            time.sleep(EVENTOS_INTERVALO)
+
+    def aguardar(self, depois_de, timeout):
+        # Devolve (eventos com id > depois_de, precisa_consultar_banco)
+        with self._condicao:
+            if self._ultimo_id <= depois_de:
+                self._condicao.wait(timeout)
+            if depois_de < self._base_id:
+                return [], True # A conexão ficou para trás do buffer em memória
+            return [e for e in self._eventos if e[0] > depois_de], False
+
+central_eventos = CentralEventos()
+
+@app.cli.command('limpar-eventos')
+@click.option('--dias', default=7, show_default=True, help='Remove eventos mais antigos que este número de dias.')
+def limpar_eventos(dias):
+    """Remove eventos antigos da tabela usada pelo stream de eventos."""
+    limite = datetime.datetime.utcnow() - datetime.timedelta(days=dias)
+    removidos = Evento.query.filter(Evento.criado_em < limite).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f'{removidos} eventos removidos')
+
+# ROTA DE STREAM DE EVENTOS (SSE)
+@app.route('/api/eventos/stream', methods=['GET'])
+def stream_eventos():
+    current_user, erro = autenticar_requisicao(permitir_query=True)
+    if erro:
+        return erro
+    audiencias = audiencias_do_usuario(current_user)
+    db.session.remove() # A autenticação sem cache abre uma transação; o stream não deve segurar a conexão
+    ultimo_id = request.headers.get('Last-Event-ID', type=int) # Enviado automaticamente pelo EventSource ao reconectar
+    if ultimo_id is None:
+        ultimo_id = request.args.get('ultimo_id', type=int)
+
+    def eventos_do_banco(depois_de, ate):
+        # Só até onde a central já confirmou que não há lacunas (eventos ainda não commitados)
+        linhas = db.session.query(Evento.id, Evento.tipo, Evento.audiencia, Evento.dados).filter(
+            Evento.id > depois_de, Evento.id <= ate).order_by(Evento.id.asc()).limit(EVENTOS_BUFFER).all()
+        db.session.close() # Devolve a conexão ao pool enquanto o stream fica ocioso
+        return [tuple(l) for l in linhas]
+
+    def formatar(evento):
+        evento_id, tipo, audiencia, dados = evento
+        return f'id: {evento_id}\nevent: {tipo}\ndata: {dados}\n\n'
+
+    def gerar():
+        posicao = central_eventos.assinar() # Sem Last-Event-ID, começa pelos eventos novos
+        if ultimo_id is not None:
+            posicao = ultimo_id # Retoma de onde o cliente parou
+        try:
+            yield 'retry: 3000\n\n' # Intervalo de reconexão do EventSource
+            fim = time.monotonic() + EVENTOS_DURACAO_MAXIMA
+            while time.monotonic() < fim:
+                eventos, atrasado = central_eventos.aguardar(posicao, EVENTOS_HEARTBEAT)
+                if atrasado:
+                    confirmado = central_eventos.confirmado()
+                    eventos = eventos_do_banco(posicao, confirmado) # Retomada (Last-Event-ID) anterior ao buffer
+                    if not eventos:
+                        posicao = confirmado # Nada commitado no intervalo (eventos já limpos)
+                        continue
+                if not eventos:
+                    yield ': keep-alive\n\n'
+                    continue
+                for evento in eventos:
+                    if evento[2] in audiencias:
+                        yield formatar(evento)
+                posicao = eventos[-1][0]
+        finally:
+            central_eventos.cancelar()
+
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}) # Desativa buffer em proxies
+
+# RESUMO DE HORAS TRABALHADAS
+def _hora_local(dt):
+    # Datas sem fuso já estão no horário de Brasília (como são gravadas); as com fuso são convertidas
+    return dt.astimezone(BRASILIA_TZ).replace(tzinfo=None) if dt.tzinfo else dt
+
+def minutos_por_dia(entrada, saida):
+    # Divide o intervalo na meia-noite e devolve {dia: minutos} para turnos que atravessam dias
+    inicio, fim = _hora_local(entrada), _hora_local(saida)
+    resultado = {}
+    while inicio < fim:
+        proxima_meia_noite = datetime.datetime.combine(inicio.date() + datetime.timedelta(days=1), datetime.time())
+        fim_trecho = min(fim, proxima_meia_noite)
+        resultado[inicio.date()] = resultado.get(inicio.date(), 0) + int((fim_trecho - inicio).total_seconds() // 60)
+        inicio = fim_trecho
+    return resultado
+
+def _somar_minutos(modelo, minutos, **chave):
+    atualizados = modelo.query.filter_by(**chave).update(
+        {modelo.minutos: modelo.minutos + minutos}, synchronize_session=False) # Incrementa no próprio banco
+    if not atualizados:
+        db.session.add(modelo(minutos=minutos, **chave))
+
+def acumular_resumo_pontos(usuario_id, entrada, saida):
+    # Soma o turno encerrado aos resumos diário e mensal, na mesma transação da saída
+    por_mes = {}
+    for dia, minutos in minutos_por_dia(entrada, saida).items():
+        _somar_minutos(ResumoPontoDiario, minutos, usuario_id=usuario_id, dia=dia)
+        por_mes[(dia.year, dia.month)] = por_mes.get((dia.year, dia.month), 0) + minutos
+    for (ano, mes), minutos in por_mes.items():
+        _somar_minutos(ResumoPontoMensal, minutos, usuario_id=usuario_id, ano=ano, mes=mes)
+
+@app.cli.command('recalcular-resumos-pontos')
+@click.option('--inicio', help='Primeiro mês a recalcular (YYYY-MM). Padrão: mês do ponto mais antigo.')
+@click.option('--fim', help='Último mês a recalcular (YYYY-MM). Padrão: mês atual.')
+def recalcular_resumos_pontos(inicio, fim):
+    """Reconstrói os resumos de horas a partir dos pontos (backfill), um mês por transação."""
+    if inicio:
+        ano, mes = map(int, inicio.split('-'))
+    else:
+        mais_antigo = db.session.query(db.func.min(Ponto.entrada)).scalar()
+        if not mais_antigo:
+            click.echo('Nenhum ponto registrado.')
+            return
+        ano, mes = mais_antigo.year, mais_antigo.month
+    hoje = datetime.datetime.now(BRASILIA_TZ)
+    ano_fim, mes_fim = map(int, fim.split('-')) if fim else (hoje.year, hoje.month)
+
+    while (ano, mes) <= (ano_fim, mes_fim):
+        start_date, end_date = intervalo_mes(ano, mes)
+        ResumoPontoDiario.query.filter(ResumoPontoDiario.dia >= start_date.date(), ResumoPontoDiario.dia < end_date.date()).delete(
+            synchronize_session=False)
+        ResumoPontoMensal.query.filter_by(ano=ano, mes=mes).delete(synchronize_session=False)
+        # Turnos que tocam o mês, inclusive os que começaram no dia anterior
+        pontos = db.session.query(Ponto.usuario_id, Ponto.entrada, Ponto.saida).filter(
+            Ponto.saida.isnot(None), Ponto.entrada < end_date, Ponto.entrada >= start_date - datetime.timedelta(days=1)
+        ).yield_per(EXPORTACAO_LOTE)
+        diario, mensal = {}, {}
+        for usuario_id, entrada, saida in pontos:
+            for dia, minutos in minutos_por_dia(entrada, saida).items():
+                if start_date.date() <= dia < end_date.date():
+                    diario[(usuario_id, dia)] = diario.get((usuario_id, dia), 0) + minutos
+                    mensal[usuario_id] = mensal.get(usuario_id, 0) + minutos
+        db.session.add_all([ResumoPontoDiario(usuario_id=u, dia=d, minutos=m) for (u, d), m in diario.items()])
+        db.session.add_all([ResumoPontoMensal(usuario_id=u, ano=ano, mes=mes, minutos=m) for u, m in mensal.items()])
+        db.session.commit()
+        click.echo(f'{ano:04d}-{mes:02d}: {len(diario)} resumos diários, {len(mensal)} mensais')
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+
+# GROUP COMMIT DE PONTOS
+# Na troca de turno centenas de batidas chegam em poucos segundos, e cada uma fazia o próprio commit.
+# Com PONTO_GROUP_COMMIT_MS > 0, as batidas concorrentes deste worker são aplicadas por uma única thread
+# em lotes de poucos milissegundos: cada batida roda em um savepoint (uma rejeitada não desfaz as outras)
+# e o lote é confirmado com um só commit. A requisição só recebe a resposta depois do commit do seu lote.
+PONTO_GROUP_COMMIT_MS = float(os.environ.get('PONTO_GROUP_COMMIT_MS', 0)) # Largura da janela do lote; 0 desativa
+PONTO_GROUP_COMMIT_MAX = int(os.environ.get('PONTO_GROUP_COMMIT_MAX', 200)) # Batidas por transação
+
+MENSAGEM_PONTO_ABERTO = 'Já existe um ponto de entrada registrado sem saída.'
+MENSAGEM_SEM_PONTO_ABERTO = 'Não há um ponto de entrada aberto para registrar a saída.'
+
+def aplicar_entrada(usuario_id, agora):
+    # Aplica a batida na sessão atual, sem commit; devolve (corpo, status)
+    if Ponto.query.filter_by(usuario_id=usuario_id, saida=None).first(): # Busca o turno aberto (índice parcial)
+        return {'message': MENSAGEM_PONTO_ABERTO}, 400
+    try:
+        with db.session.begin_nested(): # Savepoint: o conflito desfaz só esta batida
+            db.session.add(Ponto(usuario_id=usuario_id, entrada=agora))
+    except IntegrityError: # Outra requisição abriu um ponto ao mesmo tempo (índice único de ponto aberto)
+        return {'message': MENSAGEM_PONTO_ABERTO}, 400
+    return {'message': 'Entrada registrada com sucesso!', 'entrada': agora.isoformat()}, 200 # Horário de Brasília, como é lido do banco
+
+def aplicar_saida(usuario_id, agora):
+    ponto_aberto = Ponto.query.filter_by(usuario_id=usuario_id, saida=None).first() # Busca o turno aberto (índice parcial)
+    if not ponto_aberto:
+        return {'message': MENSAGEM_SEM_PONTO_ABERTO}, 400
+    # Só fecha se ainda estiver aberto, para que duas saídas simultâneas não se sobrescrevam
+    fechados = Ponto.query.filter(Ponto.id == ponto_aberto.id, Ponto.saida.is_(None)).update(
+        {Ponto.saida: agora}, synchronize_session=False) # Registra a saída
+    if not fechados:
+        return {'message': MENSAGEM_SEM_PONTO_ABERTO}, 400
+    acumular_resumo_pontos(usuario_id, ponto_aberto.entrada, agora) # Atualiza as horas do dia e do mês
+    return {'message': 'Saída registrada com sucesso!', 'saida': agora.isoformat()}, 200
+
+class ColetorPontos:
+    def __init__(self, janela_ms, maximo):
+        self.janela = janela_ms / 1000.0
+        self.maximo = maximo
+        self.fila = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None # Iniciada na primeira batida, já dentro do worker (depois do fork)
+        self.stats = {'lotes': 0, 'batidas': 0, 'maior_lote': 0, 'lotes_refeitos': 0}
+
+    def submeter(self, operacao, *args):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._executar, name='coletor-pontos', daemon=True)
+                self.thread.start()
+        futuro = Future()
+        self.fila.put((futuro, operacao, args))
+        return futuro.result() # Espera o commit do lote; exceções da batida são repassadas
+
+    def _coletar(self):
+        lote = [self.fila.get()] # Bloqueia até a primeira batida
+        limite = time.monotonic() + self.janela
+        while len(lote) < self.maximo:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _executar(self):
+        while True:
+            lote = self._coletar()
+            with app.app_context():
+                try:
+                    self._aplicar_lote(lote)
+                except Exception as e: # Falha inesperada: ninguém fica esperando para sempre
+                    db.session.rollback()
+                    for futuro, _, _ in lote:
+                        if not futuro.done():
+                            futuro.set_exception(e)
+                finally:
+                    db.session.remove()
+
+    def _aplicar(self, operacao, args):
+        try:
+            with db.session.begin_nested(): # Erros inesperados de uma batida não derrubam o lote
+                return operacao(*args), None
+        except Exception as e:
+            return None, e
+
+    def _aplicar_lote(self, lote):
+        if db.engine.dialect.name == 'sqlite':
+            # O driver do SQLite não abre transação antes de um SAVEPOINT, e cada RELEASE viraria um commit
+            db.session.execute(db.text('BEGIN IMMEDIATE'))
+        resultados = [self._aplicar(operacao, args) for _, operacao, args in lote]
+        try:
+            db.session.commit()
+        except Exception:
+            # O commit do lote falhou (ex.: conflito com outro worker): refaz cada batida na própria transação
+            db.session.rollback()
+            self.stats['lotes_refeitos'] += 1
+            resultados = []
+            for _, operacao, args in lote:
+                resultado = self._aplicar(operacao, args)
+                try:
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    resultado = (None, e)
+                resultados.append(resultado)
+        self.stats['lotes'] += 1
+        self.stats['batidas'] += len(lote)
+        self.stats['maior_lote'] = max(self.stats['maior_lote'], len(lote))
+        for (futuro, _, _), (resposta, erro) in zip(lote, resultados):
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resposta)
+
+coletor_pontos = ColetorPontos(PONTO_GROUP_COMMIT_MS, PONTO_GROUP_COMMIT_MAX)
+
+def registrar_batida(operacao, usuario_id):
+    # Horário da requisição (não do lote), já em Brasília e sem fuso: é o valor gravado em Ponto.entrada/saida e
+    # somado nos resumos, igual ao que o recalcular-resumos-pontos lê do banco (independe do TimeZone da sessão)
+    agora_brasilia = datetime.datetime.now(BRASILIA_TZ).replace(tzinfo=None)
+    if PONTO_GROUP_COMMIT_MS > 0:
+        # A autenticação sem cache abriu uma transação: devolve a conexão antes de esperar o lote, senão as
+        # requisições paradas ocupam o pool e o coletor não consegue uma conexão para gravá-lo
+        db.session.close()
+        corpo, status = coletor_pontos.submeter(operacao, usuario_id, agora_brasilia)
+    else:
+        corpo, status = operacao(usuario_id, agora_brasilia)
+        db.session.commit()
+    return jsonify(corpo), status
+
+def estatisticas_group_commit():
+    return {**coletor_pontos.stats, 'janela_ms': PONTO_GROUP_COMMIT_MS, 'ativo': PONTO_GROUP_COMMIT_MS > 0}
+
 # ROTAS DE PONTO
 @app.route('/api/ponto/entrada', methods=['POST'])
 @token_required
 def registrar_entrada(current_user):
-    ultimo_ponto = Ponto.query.filter_by(usuario_id=current_user.id).order_by(Ponto.entrada.desc()).first() # Pega o último ponto
-    if ultimo_ponto and not ultimo_ponto.saida: 
-        return jsonify({'message': 'Já existe um ponto de entrada registrado sem saída.'}), 400 # Verifica se já existe um ponto aberto
-    agora_brasilia = datetime.datetime.now(BRASILIA_TZ)
-    novo_ponto = Ponto(usuario_id=current_user.id, entrada=agora_brasilia) # Cria novo ponto
-    db.session.add(novo_ponto) # Adiciona ao banco
-    db.session.commit()
-    return jsonify({'message': 'Entrada registrada com sucesso!', 'entrada': novo_ponto.entrada.isoformat()}) # Retorna sucesso
+    return registrar_batida(aplicar_entrada, current_user.id) # Cria novo ponto
 
 # ROTA PARA REGISTRAR SAÍDA
 @app.route('/api/ponto/saida', methods=['POST'])
 @token_required
 def registrar_saida(current_user):
-    ultimo_ponto = Ponto.query.filter_by(usuario_id=current_user.id).order_by(Ponto.entrada.desc()).first() # Pega o último ponto
-    if not ultimo_ponto or ultimo_ponto.saida:
-        return jsonify({'message': 'Não há um ponto de entrada aberto para registrar a saída.'}), 400 # Verifica se há um ponto aberto
-    agora_brasilia = datetime.datetime.now(BRASILIA_TZ)
-    ultimo_ponto.saida = agora_brasilia # Registra a saída
-    db.session.commit()
-    return jsonify({'message': 'Saída registrada com sucesso!', 'saida': ultimo_ponto.saida.isoformat()}) # Retorna sucessor
+    return registrar_batida(aplicar_saida, current_user.id) # Fecha o ponto aberto
 
 # ROTA PARA LISTAR PONTOS DO USUÁRIO ATUAL
 @app.route('/api/meus-pontos', methods=['GET'])
 @token_required
 def meus_pontos(current_user):
-    pontos = Ponto.query.filter_by(usuario_id=current_user.id).order_by(Ponto.entrada.desc()).all() # Pega todos os pontos do usuário
+    try:
+        query = filtrar_periodo(Ponto.query.filter_by(usuario_id=current_user.id), Ponto.entrada) # Filtra por mês/ano ou intervalo de datas
+    except ValueError:
+        return jsonify({'message': 'Período inválido. Use month/year ou inicio/fim no formato YYYY-MM-DD'}), 400
+    pontos, proximo_cursor = paginar(query, (Ponto.entrada, Ponto.id), lambda p: (p.entrada, p.id)) # Pega os pontos do usuário (mais recentes primeiro)
     pontos_serializados = [{ # Serializa os pontos
         'id': p.id,
         'entrada': p.entrada.isoformat() if p.entrada else None, # Formata as datas para ISO 8601 
         'saida': p.saida.isoformat() if p.saida else None # Formata as datas para ISO 8601 
     } for p in pontos] # Formata as datas para ISO 8601
-    return jsonify(pontos_serializados) # Retorna os pontos serializados
+    return resposta_paginada(pontos_serializados, proximo_cursor) # Retorna os pontos serializados
 
 # ROTAS DE AVISOS
-@app.route('/api/avisos', methods=['GET'])
-@token_required
-def listar_avisos(current_user): # Rota para listar avisos
-    avisos = Aviso.query.order_by(Aviso.data_envio.desc()).all() # Pega todos os avisos
-    avisos_serializados = [{
+# Destinatários visíveis por audiência; o gerente vê todos os avisos para poder gerenciá-los
+AUDIENCIAS_AVISOS = {
+    'todos': ('todos',),
+    'funcionarios': ('todos', 'funcionarios'),
+    'gerentes': None
+}
+
+_feed_avisos_local = {} # audiência -> (versão, bytes): camada local na frente do cache compartilhado
+_feed_avisos_lock = threading.Lock()
+
+def audiencia_avisos(usuario):
+    return {'funcionario': 'funcionarios', 'gerente': 'gerentes'}.get(usuario.tipo_usuario, 'todos')
+
+def filtrar_audiencia_avisos(query, audiencia):
+    destinatarios = AUDIENCIAS_AVISOS[audiencia]
+    return query if destinatarios is None else query.filter(Aviso.destinatarios.in_(destinatarios)) # Filtra no SQL
+
+def serializar_aviso(a):
+    return {
         'id': a.id, # ID do aviso
         'titulo': a.titulo, # Titúlo do aviso
         'mensagem': a.mensagem, # Mensagem de aviso
+        'destinatarios': a.destinatarios, # Público do aviso
         'data_envio': a.data_envio.astimezone(BRASILIA_TZ).isoformat() # Converte para horário de Brasília
-    } for a in avisos] # Serializa os avisos
-    return jsonify(avisos_serializados) # Retorna os avisos serializados
+    }
+
+def feed_avisos(audiencia):
+    # A versão de 'avisos' muda a cada criação/exclusão, o que invalida as duas camadas do cache
+    versao = versoes_recursos(('avisos',))[0]
+    with _feed_avisos_lock:
+        local = _feed_avisos_local.get(audiencia)
+    if local and local[0] == versao:
+        return local[1]
+    chave = f'avisos:{audiencia}'
+    corpo = cache_compartilhado.obter(chave, versao)
+    if corpo is None:
+        avisos = filtrar_audiencia_avisos(Aviso.query, audiencia).order_by(Aviso.data_envio.desc(), Aviso.id.desc()).all()
+        corpo = (app.json.dumps([serializar_aviso(a) for a in avisos]) + '\n').encode() # Mesmos bytes que o jsonify
+        cache_compartilhado.gravar(chave, versao, corpo)
+    with _feed_avisos_lock:
+        _feed_avisos_local[audiencia] = (versao, corpo)
+    return corpo
+
+@app.route('/api/avisos', methods=['GET'])
+@token_required
+@condicional('avisos')
+def listar_avisos(current_user): # Rota para listar avisos
+    audiencia = audiencia_avisos(current_user)
+    if request.args.get('limit') is None and not request.args.get('cursor'):
+        # Lista completa: bytes já serializados do cache (local, depois compartilhado entre workers)
+        return app.response_class(feed_avisos(audiencia), mimetype='application/json')
+    avisos, proximo_cursor = paginar(filtrar_audiencia_avisos(Aviso.query, audiencia), (Aviso.data_envio, Aviso.id),
+                                     lambda a: (a.data_envio, a.id)) # Pega os avisos
+    return resposta_paginada([serializar_aviso(a) for a in avisos], proximo_cursor) # Retorna os avisos serializados
 
 @app.route('/api/avisos/<int:aviso_id>', methods=['DELETE']) # ROTA PARA EXCLUIR AVISO
 @token_required
@@ -487,6 +1793,7 @@ def excluir_aviso(current_user, aviso_id):
     if not aviso:
         return jsonify({'message': 'Aviso não encontrado'}), 404
     db.session.delete(aviso)
+    incrementar_versao('avisos')
     db.session.commit()
     return jsonify({'message': 'Aviso excluído com sucesso!'}) 
     
@@ -512,6 +1819,9 @@ def criar_aviso(current_user):
 
     aviso = Aviso(titulo=titulo, mensagem=mensagem, destinatarios=destinatarios) # Cria o aviso
     db.session.add(aviso)
+    db.session.flush() # Gera o id para o evento
+    incrementar_versao('avisos')
+    registrar_evento('aviso', destinatarios, {'id': aviso.id, 'titulo': titulo})
     db.session.commit() # Salva as mudanças
     return jsonify({'message': 'Aviso publicado com sucesso!'}) # Retorna sucesso
 
@@ -533,6 +1843,9 @@ def enviar_feedback(current_user):
             mensagem=mensagem # Mensagem do feedback
         )
         db.session.add(novo_feedback)
+        db.session.flush() # Gera o id para o evento
+        incrementar_versao('feedbacks')
+        registrar_evento('feedback', 'gerentes', {'id': novo_feedback.id, 'autor': current_user.nome})
         db.session.commit()
         
         return jsonify({'message': 'Feedback enviado com sucesso!'}), 201 # Retorna sucesso
@@ -545,18 +1858,22 @@ def enviar_feedback(current_user):
 # ROTA PARA LISTAR FEEDBACKS (SOMENTE GERENTE)
 @app.route('/api/feedbacks', methods=['GET'])
 @token_required
+@condicional('feedbacks', 'funcionarios')
 def listar_feedbacks(current_user): # Rota para listar feedbacks
     if current_user.tipo_usuario != 'gerente':
         return jsonify({'message': 'Acesso negado'}), 403 # Verifica se é gerente
-    feedbacks = db.session.query(Feedback, Usuario.nome).join(Usuario).order_by(Feedback.criado_em.desc()).all() # Pega todos os feedbacks com o nome do usuário
+    # O estado de leitura vem no mesmo SELECT (outer join), sem uma consulta por feedback
+    feedbacks, proximo_cursor = paginar(db.session.query(Feedback, Usuario.nome, FeedbackVisualizado.id).join(Usuario).outerjoin(
+        FeedbackVisualizado, FeedbackVisualizado.feedback_id == Feedback.id
+    ), (Feedback.criado_em, Feedback.id), lambda linha: (linha[0].criado_em, linha[0].id)) # Pega os feedbacks com o nome do usuário
     feedbacks_serializados = [{ # Serializa os feedbacks
         'id': f.id,
         'autor': nome,
         'mensagem': f.mensagem,
         'criado_em': f.criado_em.isoformat(), # Formata as datas para ISO 8601
-        'visualizado': FeedbackVisualizado.query.filter_by(feedback_id=f.id).first() is not None
-    } for f, nome in feedbacks] 
-    return jsonify(feedbacks_serializados) # Retorna os feedbacks serializados
+        'visualizado': visualizacao_id is not None
+    } for f, nome, visualizacao_id in feedbacks] 
+    return resposta_paginada(feedbacks_serializados, proximo_cursor) # Retorna os feedbacks serializados
 
 # ROTA PARA MARCAR FEEDBACK COMO VISUALIZADO
 @app.route('/api/feedbacks/<int:feedback_id>/visualizar', methods=['PUT'])
@@ -572,11 +1889,351 @@ def marcar_feedback_visualizado(current_user, feedback_id):
     if not FeedbackVisualizado.query.filter_by(feedback_id=feedback_id).first():
         visualizacao = FeedbackVisualizado(feedback_id=feedback_id)
         db.session.add(visualizacao)
-        db.session.commit()
+        incrementar_versao('feedbacks')
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Outra requisição marcou ao mesmo tempo (índice único)
 
     return jsonify({'message': 'Feedback marcado como visualizado'})
 
+# ROTA PARA CONTAR FEEDBACKS E ATESTADOS NÃO VISUALIZADOS (SOMENTE GERENTE)
+@app.route('/api/gerente/nao-visualizados', methods=['GET'])
+@token_required
+def contar_nao_visualizados(current_user):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    feedbacks = db.session.query(db.func.count(Feedback.id)).outerjoin(
+        FeedbackVisualizado, FeedbackVisualizado.feedback_id == Feedback.id
+    ).filter(FeedbackVisualizado.id.is_(None)).scalar() # Feedbacks sem marcação de leitura
+    atestados = db.session.query(db.func.count(Atestado.id)).outerjoin(
+        AtestadoVisualizado, AtestadoVisualizado.atestado_id == Atestado.id
+    ).filter(AtestadoVisualizado.id.is_(None)).scalar() # Atestados sem marcação de leitura
+    return jsonify({'feedbacks': feedbacks, 'atestados': atestados})
+
+# ENVIO ASSÍNCRONO AO S3
+# A requisição só grava o arquivo no spool local e registra um EnvioArmazenamento na mesma transação da
+# linha que aponta para ele; uma thread por worker envia ao S3 em segundo plano, com novas tentativas
+# (espera exponencial). A latência do upload deixa de depender do S3. Itens com 'falhou' ficam no spool
+# e continuam sendo servidos dali; 'flask enviar-pendentes --reenviar-falhas' tenta de novo.
+S3_ENVIO_INTERVALO = float(os.environ.get('S3_ENVIO_INTERVALO', 5)) # Segundos entre consultas quando a fila está vazia
+S3_ENVIO_TENTATIVAS = int(os.environ.get('S3_ENVIO_TENTATIVAS', 8)) # Depois disso o item fica como 'falhou'
+S3_ENVIO_RESERVA = 600 # Segundos que um worker reserva o item enquanto envia
+
+def caminho_spool(chave):
+    return safe_join(app.config['S3_SPOOL_FOLDER'], chave) # None se a chave tentar sair da pasta
+
+def guardar_para_envio(chave, origem):
+    # origem: FileStorage do formulário ou caminho de um arquivo já no disco (upload em partes)
+    caminho = caminho_spool(chave)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    if isinstance(origem, str):
+        shutil.move(origem, caminho)
+    else:
+        origem.save(caminho)
+    envio = EnvioArmazenamento.query.filter_by(chave=chave).first()
+    if envio: # Mesma chave gravada de novo (ex.: conteúdo sendo apagado pela limpeza): envia a versão nova
+        proximo_em = datetime.datetime.utcnow()
+        if envio.status == 'apagando': # Deixa a limpeza apagar o objeto antigo antes de enviar de novo
+            proximo_em += datetime.timedelta(seconds=ARMAZENAMENTO_ESPERA_EXCLUSAO)
+        envio.status, envio.tentativas, envio.erro, envio.proximo_em = 'pendente', 0, None, proximo_em
+    else:
+        db.session.add(EnvioArmazenamento(chave=chave)) # Confirmado junto com a linha do atestado/foto
+
+def descartar_envio(chave):
+    # Arquivo substituído antes de chegar ao S3 (ex.: troca de foto de perfil)
+    EnvioArmazenamento.query.filter_by(chave=chave).delete(synchronize_session=False)
+    caminho = caminho_spool(chave)
+    if caminho and os.path.exists(caminho):
+        os.remove(caminho)
+
+def processar_envios_pendentes(limite=20):
+    # Envia até `limite` itens vencidos; devolve quantos foram processados (com sucesso ou não)
+    agora = datetime.datetime.utcnow()
+    ids = [i for i, in db.session.query(EnvioArmazenamento.id).filter(
+        EnvioArmazenamento.status == 'pendente', EnvioArmazenamento.proximo_em <= agora,
+        db.or_(EnvioArmazenamento.reservado_ate.is_(None), EnvioArmazenamento.reservado_ate < agora)
+    ).order_by(EnvioArmazenamento.proximo_em).limit(limite)]
+    db.session.rollback()
+    processados = 0
+    for envio_id in ids:
+        # Reserva o item; se outro worker reservou primeiro, pula
+        reservado = EnvioArmazenamento.query.filter(EnvioArmazenamento.id == envio_id, EnvioArmazenamento.status == 'pendente',
+            db.or_(EnvioArmazenamento.reservado_ate.is_(None), EnvioArmazenamento.reservado_ate < agora)).update(
+            {EnvioArmazenamento.reservado_ate: agora + datetime.timedelta(seconds=S3_ENVIO_RESERVA)}, synchronize_session=False)
+        db.session.commit()
+        if not reservado:
+            continue
+        envio = EnvioArmazenamento.query.get(envio_id)
+        if envio is None: # Descartado (ex.: troca de foto) entre a reserva e a leitura
+            continue
+        caminho = caminho_spool(envio.chave)
+        try:
+            enviar_arquivo_s3(caminho, envio.chave)
+        except Exception as e: # ClientError, falha de rede ou arquivo ausente
+            envio.tentativas += 1
+            envio.erro = str(e)[:255]
+            envio.proximo_em = datetime.datetime.utcnow() + datetime.timedelta(seconds=min(2 ** envio.tentativas * 5, 3600))
+            envio.status = 'falhou' if envio.tentativas >= S3_ENVIO_TENTATIVAS else 'pendente'
+            app.logger.warning('envio S3 %s falhou (tentativa %s): %s', envio.chave, envio.tentativas, e)
+        else:
+            envio.status, envio.erro, envio.enviado_em = 'enviado', None, datetime.datetime.utcnow()
+        envio.reservado_ate = None
+        db.session.commit()
+        if envio.status == 'enviado':
+            os.remove(caminho) # Só depois do commit: até aqui o arquivo continua sendo servido do spool
+        processados += 1
+    return processados
+
+class EnviadorS3:
+    def __init__(self):
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def acordar(self):
+        # Chamado depois do commit de um novo envio; também inicia a thread (uma por worker, depois do fork)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='enviador-s3', daemon=True)
+                self._thread.start()
+        self._evento.set()
+
+    def _executar(self):
+        while True:
+            processados = 0
+            with app.app_context():
+                try:
+                    processados = processar_envios_pendentes()
+                except Exception:
+                    app.logger.exception('enviador S3: erro ao processar a fila')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if not processados: # Fila vazia: espera um novo envio ou o próximo intervalo (novas tentativas)
+                self._evento.wait(S3_ENVIO_INTERVALO)
+                self._evento.clear()
+
+enviador_s3 = EnviadorS3()
+
+if USE_S3:
+    @app.before_request
+    def iniciar_enviador_s3():
+        if enviador_s3._thread is None: # Retoma envios pendentes de antes de um reinício
+            enviador_s3.acordar()
+
+@app.cli.command('enviar-pendentes')
+@click.option('--reenviar-falhas', is_flag=True, help="Volta os itens com 'falhou' para a fila antes de enviar.")
+def enviar_pendentes(reenviar_falhas):
+    """Envia agora ao S3 os arquivos que estão no spool."""
+    if not USE_S3:
+        click.echo('S3 não configurado (AWS_S3_BUCKET_NAME).')
+        return
+    if reenviar_falhas:
+        EnvioArmazenamento.query.filter_by(status='falhou').update(
+            {EnvioArmazenamento.status: 'pendente', EnvioArmazenamento.tentativas: 0,
+             EnvioArmazenamento.proximo_em: datetime.datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+    total = 0
+    while True:
+        processados = processar_envios_pendentes()
+        if not processados:
+            break
+        total += processados
+    restantes = dict(db.session.query(EnvioArmazenamento.status, db.func.count()).group_by(EnvioArmazenamento.status).all())
+    click.echo(f'{total} itens processados; situação da fila: {restantes}')
+
+# ARMAZENAMENTO POR CONTEÚDO
+# Atestados, fotos e miniaturas são gravados com o sha256 do conteúdo no nome ('<sha256>.pdf', ou
+# 'atestados/<sha256>.pdf' no S3): o mesmo arquivo enviado duas vezes ocupa espaço uma vez só, e nenhum upload
+# sobrescreve o de outro usuário. Como um objeto pode ser usado por várias linhas, nada é apagado na hora da troca
+# ou da exclusão; 'flask limpar-arquivos-orfaos' remove depois os objetos que nenhuma linha referencia.
+PASTAS_LOCAIS = {'atestados': 'UPLOAD_FOLDER', 'perfil': 'UPLOAD_FOLDER_PERFIL'} # Prefixo S3 -> pasta local
+ARMAZENAMENTO_CARENCIA_HORAS = int(os.environ.get('ARMAZENAMENTO_CARENCIA_HORAS', 24)) # Idade mínima para um órfão ser apagado
+ARMAZENAMENTO_ESPERA_EXCLUSAO = 300 # Segundos antes de reenviar ao S3 um objeto que a limpeza está apagando
+
+def _pasta_temporaria(pasta):
+    # Temporários ficam no mesmo disco do destino, para a publicação ser um rename
+    destino = app.config['S3_SPOOL_FOLDER'] if USE_S3 else app.config[PASTAS_LOCAIS[pasta]]
+    os.makedirs(destino, exist_ok=True)
+    return destino
+
+def _objeto_existe(pasta, nome):
+    # Reaproveitar um objeto renova o seu uso, para a limpeza de órfãos não apagá-lo antes de a linha nova ser gravada
+    if USE_S3: # Enviado ou na fila do spool, e não reservado pela limpeza (a trava da linha vale até o commit do upload)
+        return EnvioArmazenamento.query.filter(EnvioArmazenamento.chave == nome, EnvioArmazenamento.status != 'apagando').update(
+            {EnvioArmazenamento.ultimo_uso: datetime.datetime.utcnow()}, synchronize_session=False) > 0
+    try:
+        os.utime(os.path.join(app.config[PASTAS_LOCAIS[pasta]], nome)) # Volta a contar a carência
+    except FileNotFoundError: # Inexistente, ou já separado pela limpeza: grava de novo
+        return False
+    return True
+
+def _publicar(pasta, nome, temporario):
+    # Move o temporário para o nome definitivo (ou para a fila do S3), a menos que o conteúdo já esteja guardado
+    if _objeto_existe(pasta, nome):
+        os.remove(temporario)
+    elif USE_S3:
+        guardar_para_envio(nome, temporario)
+    else:
+        shutil.move(temporario, os.path.join(app.config[PASTAS_LOCAIS[pasta]], nome))
+
+def armazenar_por_conteudo(origem, pasta, extensao):
+    # origem: FileStorage do formulário ou caminho de um arquivo já no disco (consumido).
+    # Devolve (nome gravado no banco, sha256): '<sha256><ext>' no disco ou '<pasta>/<sha256><ext>' no S3
+    if isinstance(origem, str):
+        temporario = origem
+        with open(temporario, 'rb') as arquivo:
+            sha256 = hashlib.file_digest(arquivo, 'sha256').hexdigest()
+    else:
+        descritor, temporario = tempfile.mkstemp(suffix='.tmp', dir=_pasta_temporaria(pasta))
+        hash_arquivo = hashlib.sha256()
+        with os.fdopen(descritor, 'wb') as destino: # Copia em blocos calculando o hash, sem ler tudo na memória
+            while bloco := origem.stream.read(UPLOAD_BLOCO):
+                destino.write(bloco)
+                hash_arquivo.update(bloco)
+        sha256 = hash_arquivo.hexdigest()
+    nome = f"{pasta + '/' if USE_S3 else ''}{sha256}{extensao.lower()}"
+    _publicar(pasta, nome, temporario)
+    return nome, sha256
+
+def _referenciados(nomes):
+    # Quais destes nomes (arquivos locais ou chaves S3) ainda aparecem em alguma linha do banco
+    usados = set()
+    for coluna in (Atestado.arquivo, DadosUsuario.foto_perfil, DadosUsuario.foto_miniatura):
+        usados.update(v for v, in db.session.query(coluna).filter(coluna.in_(nomes)))
+    return usados
+
+def _listar_objetos(lote):
+    # Lotes de (nome no banco, alvo para apagar, modificado em UTC) de todos os uploads guardados
+    if USE_S3:
+        paginador = cliente_s3().get_paginator('list_objects_v2')
+        for prefixo in PASTAS_LOCAIS:
+            for pagina in paginador.paginate(Bucket=AWS_S3_BUCKET_NAME, Prefix=f'{prefixo}/', PaginationConfig={'PageSize': lote}):
+                yield [(o['Key'], o['Key'], o['LastModified'].astimezone(datetime.timezone.utc).replace(tzinfo=None))
+                       for o in pagina.get('Contents', [])]
+        return
+    for pasta in dict.fromkeys(app.config[p] for p in PASTAS_LOCAIS.values()): # Sem repetir se forem a mesma pasta
+        itens = []
+        with os.scandir(pasta) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.name != 'default-user.png':
+                    itens.append((entrada.name, entrada.path, datetime.datetime.utcfromtimestamp(entrada.stat().st_mtime)))
+                    if len(itens) >= lote:
+                        yield itens
+                        itens = []
+        if itens:
+            yield itens
+
+def _reservar_exclusao(chaves, limite):
+    # S3: marca como 'apagando' as linhas sem reaproveitamento recente e devolve as chaves que podem ser apagadas
+    # (inclusive as sem linha). Um upload que chegar depois não reaproveita a chave: envia o objeto de novo.
+    EnvioArmazenamento.query.filter(
+        EnvioArmazenamento.chave.in_(chaves), EnvioArmazenamento.status.in_(('enviado', 'apagando')),
+        db.or_(EnvioArmazenamento.ultimo_uso.is_(None), EnvioArmazenamento.ultimo_uso < limite)
+    ).update({EnvioArmazenamento.status: 'apagando'}, synchronize_session=False)
+    mantidas = {c for c, in db.session.query(EnvioArmazenamento.chave).filter(
+        EnvioArmazenamento.chave.in_(chaves), EnvioArmazenamento.status != 'apagando')}
+    db.session.commit()
+    return [c for c in chaves if c not in mantidas]
+
+def _apagar_objetos(alvos, limite):
+    # Roda nas threads da limpeza: sem acesso ao banco. Devolve os alvos apagados
+    if USE_S3:
+        resposta = cliente_s3().delete_objects(Bucket=AWS_S3_BUCKET_NAME, Delete={'Objects': [{'Key': k} for k in alvos], 'Quiet': True})
+        falhas = {erro.get('Key') for erro in resposta.get('Errors', [])}
+        for erro in resposta.get('Errors', []):
+            app.logger.error(f"limpar-arquivos-orfaos: {erro.get('Key')} não removido: {erro.get('Message')}")
+        return [k for k in alvos if k not in falhas]
+    removidos = []
+    for caminho in alvos:
+        separado = caminho + '.apagando'
+        try:
+            os.rename(caminho, separado) # Depois disso, um upload do mesmo conteúdo grava o arquivo de novo
+        except FileNotFoundError:
+            continue
+        if datetime.datetime.utcfromtimestamp(os.stat(separado).st_mtime) >= limite: # Reaproveitado depois da listagem
+            os.replace(separado, caminho)
+            continue
+        os.remove(separado)
+        removidos.append(caminho)
+    return removidos
+
+def _concluir_exclusao(futuros):
+    # Soma os apagados e, no S3, remove as linhas reservadas (as reaproveitadas nesse meio-tempo voltaram a 'pendente')
+    apagados = [alvo for futuro in futuros for alvo in futuro.result()]
+    if USE_S3 and apagados:
+        EnvioArmazenamento.query.filter(EnvioArmazenamento.chave.in_(apagados), EnvioArmazenamento.status == 'apagando').delete(
+            synchronize_session=False)
+        db.session.commit()
+    return len(apagados)
+
+@app.cli.command('limpar-arquivos-orfaos')
+@click.option('--carencia-horas', default=ARMAZENAMENTO_CARENCIA_HORAS, show_default=True,
+              help='Só apaga objetos sem modificação há mais tempo que isso (uploads cuja linha ainda não foi gravada).')
+@click.option('--lote', default=1000, show_default=True, help='Objetos por consulta ao banco e por chamada de exclusão.')
+@click.option('--concorrencia', default=4, show_default=True, help='Lotes sendo apagados ao mesmo tempo.')
+@click.option('--simular', is_flag=True, help='Só conta os órfãos, sem apagar.')
+def limpar_arquivos_orfaos(carencia_horas, lote, concorrencia, simular):
+    """Apaga uploads (disco ou S3) que nenhum atestado ou foto de perfil referencia."""
+    limite = datetime.datetime.utcnow() - datetime.timedelta(hours=carencia_horas)
+    vistos = orfaos_total = removidos = 0
+
+    # Fila do spool (S3): envios de arquivos que perderam a referência antes de chegar ao bucket
+    if USE_S3:
+        pendentes = EnvioArmazenamento.query.filter(EnvioArmazenamento.status != 'enviado', EnvioArmazenamento.criado_em < limite).all()
+        for i in range(0, len(pendentes), lote):
+            chaves = [e.chave for e in pendentes[i:i + lote]]
+            for chave in set(chaves) - _referenciados(chaves):
+                orfaos_total += 1
+                if not simular:
+                    descartar_envio(chave)
+            db.session.commit()
+
+    # Marca (consulta ao banco) e varre (exclusão) lote a lote. As referências são consultadas de novo logo antes
+    # de apagar, e o reaproveitamento concorrente é barrado na própria exclusão: no disco o arquivo é renomeado e a
+    # data de modificação conferida; no S3 a linha do envio é reservada ('apagando') se ultimo_uso for antigo.
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        em_andamento = set()
+        for objetos in _listar_objetos(lote):
+            vistos += len(objetos)
+            antigos = {nome: alvo for nome, alvo, modificado in objetos if modificado < limite}
+            usados = _referenciados(list(antigos)) if antigos else set()
+            candidatos = [nome for nome in antigos if nome not in usados]
+            db.session.rollback() # Não segura a transação enquanto lista o próximo lote
+            orfaos_total += len(candidatos)
+            if simular or not candidatos:
+                continue
+            if len(em_andamento) >= concorrencia:
+                concluidos, em_andamento = wait(em_andamento, return_when=FIRST_COMPLETED)
+                removidos += _concluir_exclusao(concluidos)
+            usados = _referenciados(candidatos) # Linhas gravadas enquanto o lote esperava a vez
+            orfaos = [antigos[nome] for nome in candidatos if nome not in usados]
+            if USE_S3:
+                orfaos = _reservar_exclusao(orfaos, limite)
+            else:
+                db.session.rollback()
+            if orfaos:
+                em_andamento.add(executor.submit(_apagar_objetos, orfaos, limite))
+        removidos += _concluir_exclusao(em_andamento)
+    acao = 'seriam apagados' if simular else f'{removidos} apagados'
+    click.echo(f'{vistos} objetos verificados; {orfaos_total} órfãos ({acao})')
+
 # ROTAS DE ATESTADOS
+ATESTADO_TAMANHO_MAXIMO = int(os.environ.get('ATESTADO_TAMANHO_MAXIMO', 10 * 1024 * 1024)) # Bytes por atestado
+
+def extensao_atestado(nome_original):
+    return os.path.splitext(secure_filename(nome_original))[1].lower() # O nome do arquivo no disco é o sha256 do conteúdo
+
+def registrar_atestado(usuario, motivo, arquivo):
+    novo_atestado = Atestado(usuario_id=usuario.id, motivo=motivo, arquivo=arquivo)
+    db.session.add(novo_atestado)
+    db.session.flush() # Gera o id para o evento
+    incrementar_versao('atestados')
+    registrar_evento('atestado', 'gerentes', {'id': novo_atestado.id, 'funcionario': usuario.nome, 'status': novo_atestado.status})
+    db.session.commit()
+    return novo_atestado
+
 @app.route('/api/atestado', methods=['POST']) # ROTA PARA ENVIAR ATESTADO
 @token_required
 def enviar_atestado(current_user): # Rota para enviar atestado
@@ -586,33 +2243,164 @@ def enviar_atestado(current_user): # Rota para enviar atestado
     motivo = request.form.get('motivo') # Pega o motivo
     if file.filename == '' or not motivo:
         return jsonify({'message': 'Arquivo ou motivo não selecionado'}), 400 # Verifica se o arquivo e motivo foram fornecidos
+    if request.content_length and request.content_length > ATESTADO_TAMANHO_MAXIMO + 64 * 1024: # Folga para os campos do formulário
+        return jsonify({'message': 'Arquivo maior que o permitido.'}), 413
     if file and allowed_file(file.filename):
-        # Utiliza o id do usuário para nomear o arquivo e evitar conflitos
-        filename = secure_filename(f"atestado_{current_user.id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}") # Nome seguro do arquivo
+        # Nomeado pelo conteúdo: arquivo repetido não ocupa espaço de novo (com S3, vai em segundo plano)
+        arquivo, _ = armazenar_por_conteudo(file, 'atestados', extensao_atestado(file.filename))
+        registrar_atestado(current_user, motivo, arquivo) # Salva o nome (ou a chave S3) no banco
         if USE_S3:
-            key = f"atestados/{filename}"
-            success = upload_to_s3(file, key)
-            if not success:
-                return jsonify({'message': 'Erro ao enviar arquivo para armazenamento'}), 500
-            novo_atestado = Atestado(usuario_id=current_user.id, motivo=motivo, arquivo=key) # Salva a chave no banco
-        else:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename) # Caminho completo do arquivo
-            file.save(filepath)
-            novo_atestado = Atestado(usuario_id=current_user.id, motivo=motivo, arquivo=filename) # Cria o atestado
-
-        db.session.add(novo_atestado)
-        db.session.commit()
+            enviador_s3.acordar()
         return jsonify({'message': 'Atestado enviado com sucesso!'}), 201 # Retorna sucesso
     return jsonify({'message': 'Tipo de arquivo não permitido'}), 400 # Tipo de arquivo não permitido
 
+# UPLOAD DE ATESTADO EM PARTES (retomável)
+# 1. POST /api/atestados/uploads {nome_arquivo, tamanho, motivo, sha256?} cria a sessão;
+# 2. PUT /api/atestados/uploads/<id> com Content-Range: bytes inicio-fim/total envia cada parte, em ordem;
+#    GET na mesma URL informa quantos bytes já chegaram, para retomar depois de uma queda;
+# 3. POST /api/atestados/uploads/<id>/concluir confere tamanho e sha256 e cria o atestado.
+# Cada parte é copiada do corpo da requisição direto para o disco em blocos, sem ficar inteira na memória.
+UPLOAD_PARTE_TAMANHO = int(os.environ.get('UPLOAD_PARTE_TAMANHO', 1024 * 1024)) # Tamanho de parte sugerido ao cliente
+UPLOAD_SESSAO_HORAS = int(os.environ.get('UPLOAD_SESSAO_HORAS', 24)) # Validade de uma sessão não concluída
+UPLOAD_BLOCO = 64 * 1024
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+def _caminho_parcial(sessao_id):
+    return os.path.join(app.config['UPLOAD_PARCIAL_FOLDER'], f'{sessao_id}.part')
+
+def _sessao_upload(current_user, sessao_id):
+    sessao = UploadSessao.query.get(sessao_id)
+    if not sessao or sessao.usuario_id != current_user.id:
+        return None
+    if sessao.criado_em < datetime.datetime.utcnow() - datetime.timedelta(hours=UPLOAD_SESSAO_HORAS):
+        return None # Expirada: será apagada pelo comando limpar-uploads
+    return sessao
+
+def _estado_upload(sessao):
+    return {'id': sessao.id, 'tamanho': sessao.tamanho, 'recebido': sessao.recebido, 'tamanho_parte': UPLOAD_PARTE_TAMANHO}
+
+@app.route('/api/atestados/uploads', methods=['POST'])
+@token_required
+def iniciar_upload_atestado(current_user):
+    data = request.get_json(silent=True) or {}
+    nome_arquivo, motivo = (data.get('nome_arquivo') or '').strip(), (data.get('motivo') or '').strip()
+    sha256 = (data.get('sha256') or '').strip().lower() or None
+    if not nome_arquivo or not motivo:
+        return jsonify({'message': 'Arquivo ou motivo não selecionado'}), 400
+    if not allowed_file(nome_arquivo):
+        return jsonify({'message': 'Tipo de arquivo não permitido'}), 400
+    tamanho = data.get('tamanho')
+    if not isinstance(tamanho, int) or tamanho <= 0:
+        return jsonify({'message': 'Tamanho do arquivo inválido'}), 400
+    if tamanho > ATESTADO_TAMANHO_MAXIMO:
+        return jsonify({'message': 'Arquivo maior que o permitido.', 'tamanho_maximo': ATESTADO_TAMANHO_MAXIMO}), 413
+    if sha256 and not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        return jsonify({'message': 'sha256 inválido'}), 400
+    sessao = UploadSessao(id=secrets.token_hex(16), usuario_id=current_user.id, motivo=motivo[:255],
+                          nome_arquivo=nome_arquivo[:255], tamanho=tamanho, sha256=sha256)
+    open(_caminho_parcial(sessao.id), 'wb').close()
+    db.session.add(sessao)
+    db.session.commit()
+    resposta = jsonify(_estado_upload(sessao))
+    resposta.headers['Location'] = url_for('enviar_parte_atestado', sessao_id=sessao.id)
+    return resposta, 201
+
+@app.route('/api/atestados/uploads/<sessao_id>', methods=['GET', 'PUT'])
+@token_required
+def enviar_parte_atestado(current_user, sessao_id):
+    sessao = _sessao_upload(current_user, sessao_id)
+    if not sessao:
+        return jsonify({'message': 'Sessão de upload não encontrada ou expirada'}), 404
+    if request.method == 'GET':
+        return jsonify(_estado_upload(sessao)) # Onde retomar
+
+    intervalo = CONTENT_RANGE_RE.match(request.headers.get('Content-Range', ''))
+    if not intervalo:
+        return jsonify({'message': 'Cabeçalho Content-Range ausente ou inválido (bytes inicio-fim/total)'}), 400
+    inicio, fim, total = map(int, intervalo.groups())
+    tamanho_parte = fim - inicio + 1
+    if total != sessao.tamanho or fim < inicio or fim >= total or request.content_length != tamanho_parte:
+        return jsonify({'message': 'Content-Range não corresponde ao arquivo ou ao corpo enviado'}), 400
+    if inicio != sessao.recebido:
+        if fim < sessao.recebido: # Parte repetida (ex.: resposta perdida na rede): já está gravada
+            return jsonify(_estado_upload(sessao))
+        return jsonify({'message': 'As partes devem ser enviadas em ordem', **_estado_upload(sessao)}), 409
+    db.session.rollback() # Não segura a conexão do banco durante a cópia de uma rede lenta
+
+    hash_parte = hashlib.sha256()
+    copiados = 0
+    with open(_caminho_parcial(sessao_id), 'r+b') as destino:
+        destino.seek(inicio)
+        while copiados < tamanho_parte:
+            bloco = request.stream.read(min(UPLOAD_BLOCO, tamanho_parte - copiados))
+            if not bloco:
+                break
+            destino.write(bloco)
+            hash_parte.update(bloco)
+            copiados += len(bloco)
+        esperado = request.headers.get('X-Chunk-Sha256', '').lower() # Hash opcional da parte
+        parte_ok = copiados == tamanho_parte and (not esperado or esperado == hash_parte.hexdigest())
+        if not parte_ok:
+            destino.truncate(inicio) # Descarta a parte: o arquivo volta a ter só os bytes confirmados
+    if not parte_ok:
+        return jsonify({'message': 'Parte incompleta ou corrompida; envie novamente', **_estado_upload(sessao)}), 400
+    # Avança o contador só se ninguém avançou antes (duas tentativas da mesma parte ao mesmo tempo)
+    UploadSessao.query.filter_by(id=sessao_id, recebido=inicio).update({UploadSessao.recebido: fim + 1}, synchronize_session=False)
+    db.session.commit()
+    return jsonify({**_estado_upload(sessao), 'recebido': fim + 1})
+
+@app.route('/api/atestados/uploads/<sessao_id>/concluir', methods=['POST'])
+@token_required
+def concluir_upload_atestado(current_user, sessao_id):
+    sessao = _sessao_upload(current_user, sessao_id)
+    if not sessao:
+        return jsonify({'message': 'Sessão de upload não encontrada ou expirada'}), 404
+    caminho = _caminho_parcial(sessao_id)
+    if sessao.recebido != sessao.tamanho or not os.path.exists(caminho) or os.path.getsize(caminho) != sessao.tamanho:
+        return jsonify({'message': 'Upload incompleto', **_estado_upload(sessao)}), 409
+    esperado = ((request.get_json(silent=True) or {}).get('sha256') or sessao.sha256 or '').lower()
+    if esperado:
+        with open(caminho, 'rb') as arquivo:
+            calculado = hashlib.file_digest(arquivo, 'sha256').hexdigest()
+        if calculado != esperado: # Arquivo corrompido: recomeça do zero
+            open(caminho, 'wb').close()
+            sessao.recebido = 0
+            db.session.commit()
+            return jsonify({'message': 'O arquivo recebido não confere com o sha256 informado; envie novamente', **_estado_upload(sessao)}), 422
+    arquivo, _ = armazenar_por_conteudo(caminho, 'atestados', extensao_atestado(sessao.nome_arquivo))
+    db.session.delete(sessao)
+    registrar_atestado(current_user, sessao.motivo, arquivo)
+    if USE_S3:
+        enviador_s3.acordar()
+    return jsonify({'message': 'Atestado enviado com sucesso!'}), 201
+
+@app.cli.command('limpar-uploads')
+def limpar_uploads():
+    """Remove sessões de upload expiradas e partes sem sessão."""
+    limite = datetime.datetime.utcnow() - datetime.timedelta(hours=UPLOAD_SESSAO_HORAS)
+    expiradas = [s.id for s in UploadSessao.query.filter(UploadSessao.criado_em < limite)]
+    UploadSessao.query.filter(UploadSessao.id.in_(expiradas)).delete(synchronize_session=False)
+    db.session.commit()
+    ativas = {s for s, in db.session.query(UploadSessao.id)}
+    removidos = 0
+    for nome in os.listdir(app.config['UPLOAD_PARCIAL_FOLDER']):
+        if nome.endswith('.part') and nome[:-5] not in ativas:
+            os.remove(os.path.join(app.config['UPLOAD_PARCIAL_FOLDER'], nome))
+            removidos += 1
+    click.echo(f'{len(expiradas)} sessões expiradas, {removidos} arquivos parciais removidos')
+
 # ROTA PARA LISTAR ATESTADOS (SOMENTE GERENTE)
 @app.route('/api/atestados', methods=['GET'])
 @token_required
+@condicional('atestados', 'funcionarios')
 def listar_atestados(current_user): # Rota para listar atestados
     if current_user.tipo_usuario != 'gerente':
         return jsonify({'message': 'Acesso negado'}), 403 # Verifica se é gerente
 
-    atestados = db.session.query(Atestado, Usuario.nome).join(Usuario).order_by(Atestado.criado_em.desc()).all() # Pega todos os atestados com o nome do usuário
+    # O estado de leitura vem no mesmo SELECT (outer join), sem uma consulta por atestado
+    atestados, proximo_cursor = paginar(db.session.query(Atestado, Usuario.nome, AtestadoVisualizado.id).join(Usuario).outerjoin(
+        AtestadoVisualizado, AtestadoVisualizado.atestado_id == Atestado.id
+    ), (Atestado.criado_em, Atestado.id), lambda linha: (linha[0].criado_em, linha[0].id)) # Pega os atestados com o nome do usuário
     atestados_serializados = [{ # Serializa os atestados
         'id': a.id,
         'funcionario': nome,
@@ -620,9 +2408,9 @@ def listar_atestados(current_user): # Rota para listar atestados
         'arquivo': a.arquivo,
         'criado_em': a.criado_em.isoformat(), # Formata as datas para ISO 8601
         'status': a.status, # Status do atestado
-        'visualizado': AtestadoVisualizado.query.filter_by(atestado_id=a.id).first() is not None
-    } for a, nome in atestados] # Serializa os atestados
-    return jsonify(atestados_serializados) # Retorna os atestados serializados
+        'visualizado': visualizacao_id is not None
+    } for a, nome, visualizacao_id in atestados] # Serializa os atestados
+    return resposta_paginada(atestados_serializados, proximo_cursor) # Retorna os atestados serializados
 
 # ROTA PARA MARCAR ATESTADO COMO VISUALIZADO
 @app.route('/api/atestados/<int:atestado_id>/visualizar', methods=['PUT'])
@@ -638,7 +2426,11 @@ def marcar_atestado_visualizado(current_user, atestado_id):
     if not AtestadoVisualizado.query.filter_by(atestado_id=atestado_id).first():
         visualizacao = AtestadoVisualizado(atestado_id=atestado_id)
         db.session.add(visualizacao)
-        db.session.commit()
+        incrementar_versao('atestados')
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Outra requisição marcou ao mesmo tempo (índice único)
 
     return jsonify({'message': 'Atestado marcado como visualizado'})
 
@@ -654,14 +2446,19 @@ def gerenciar_atestado(current_user, atestado_id, status): # Rota para gerenciar
     if status not in ['aprovado', 'rejeitado']:
         return jsonify({'message': 'Status inválido'}), 400 # Verifica se o status é válido
     atestado.status = status
+    incrementar_versao('atestados')
+    registrar_evento('atestado_status', f'usuario:{atestado.usuario_id}', {'id': atestado.id, 'status': status}) # Avisa o funcionário
     db.session.commit()
     return jsonify({'message': f'Atestado {status} com sucesso!'}) # Retorna sucesso
 
 # ROTA PARA LISTAR ATESTADOS DO USUÁRIO ATUAL
 @app.route('/api/meus-atestados', methods=['GET']) # Rota para listar atestados do usuário atual
 @token_required
+@condicional('atestados')
 def meus_atestados(current_user): # Rota para listar atestados do usuário atual
-    atestados = Atestado.query.filter_by(usuario_id=current_user.id).order_by(Atestado.criado_em.desc()).all() # Pega todos os atestados do usuário atual 
+    atestados, proximo_cursor = paginar(
+        Atestado.query.filter_by(usuario_id=current_user.id), (Atestado.criado_em, Atestado.id), lambda a: (a.criado_em, a.id)
+    ) # Pega os atestados do usuário atual 
     atestados_serializados = [{ # Serializa os atestados
         'id': a.id,
         'motivo': a.motivo,
@@ -669,46 +2466,62 @@ def meus_atestados(current_user): # Rota para listar atestados do usuário atual
         'criado_em': a.criado_em.isoformat(),
         'status': a.status
     } for a in atestados] # Serializa os atestados
-    return jsonify(atestados_serializados) # Retorna os atestados serializados
+    return resposta_paginada(atestados_serializados, proximo_cursor) # Retorna os atestados serializados
 
 # ROTA PARA SERVIR ARQUIVOS DE UPLOAD (atestados e fotos de perfil)
+def servir_upload(pasta, filename):
+    # O nome é o sha256 do conteúdo (outro arquivo, outro nome), então o conteúdo de uma URL nunca muda
+    resposta = send_from_directory(pasta, filename, max_age=UPLOAD_CACHE_MAX_AGE) # Também responde 304 pelo ETag
+    resposta.cache_control.public = False # O send_file marca como public; atestados não devem ir para caches compartilhados
+    resposta.cache_control.private = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+def servir_upload_s3(filename):
+    caminho = caminho_spool(filename)
+    if caminho and os.path.isfile(caminho): # Ainda não chegou ao S3: serve do spool
+        return servir_upload(app.config['S3_SPOOL_FOLDER'], filename)
+    url, validade = url_assinada(filename)
+    if not url:
+        return jsonify({'message': 'Arquivo não encontrado'}), 404
+    resposta = redirect(url)
+    resposta.cache_control.private = True
+    resposta.cache_control.max_age = validade # O navegador repete o redirect sem voltar ao servidor enquanto a URL vale
+    return resposta
+
 @app.route('/static/uploads/<path:filename>') # ROTA PARA SERVIR ARQUIVOS DE UPLOAD (aceita subpaths)
 def uploaded_file(filename):
-    # Se estiver usando S3, gera URL pré-assinada para o arquivo
+    # Se estiver usando S3, redireciona para uma URL pré-assinada (reaproveitada do cache)
     if USE_S3:
-        url = get_presigned_url(filename)
-        if url:
-            return redirect(url)
-        return jsonify({'message': 'Arquivo não encontrado'}), 404
+        return servir_upload_s3(filename)
 
     # Garante que apenas arquivos na pasta UPLOAD_FOLDER podem ser servidos
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename) # Retorna o arquivo solicitado
+    return servir_upload(app.config['UPLOAD_FOLDER'], filename) # Retorna o arquivo solicitado
 
 
 @app.route('/static/uploads/perfil/<path:filename>') # ROTA PARA SERVIR FOTOS DE PERFIL (aceita subpaths)
 def uploaded_profile_picture(filename):
     if USE_S3:
-        url = get_presigned_url(filename)
-        if url:
-            return redirect(url)
-        return jsonify({'message': 'Arquivo não encontrado'}), 404
+        return servir_upload_s3(filename)
 
     # Garante que apenas arquivos na pasta UPLOAD_FOLDER_PERFIL podem ser servidos
-    return send_from_directory(app.config['UPLOAD_FOLDER_PERFIL'], filename) # Retorna o arquivo solicitado
+    return servir_upload(app.config['UPLOAD_FOLDER_PERFIL'], filename) # Retorna o arquivo solicitado
 
 # ROTAS DE DADOS DO USUÁRIO
 @app.route('/api/meus-dados', methods=['GET', 'PUT']) # ROTA PARA VER E EDITAR OS DADOS DO USUÁRIO ATUAL
 @token_required
 def meus_dados(current_user): # Rota para ver e editar os dados do usuário atual
+    usuario = Usuario.query.get(current_user.id) # current_user é apenas um snapshot; carrega o registro completo
     if request.method == 'GET': 
-        dados = current_user.dados_adicionais # Pega os dados adicionais do usuário
+        dados = usuario.dados_adicionais # Pega os dados adicionais do usuário
         return jsonify({ # Serializa os dados
-            'nome': current_user.nome,
-            'email': current_user.email,
+            'nome': usuario.nome,
+            'email': usuario.email,
             'telefone': dados.telefone if dados else '',
             'nascimento': dados.nascimento.isoformat() if dados and dados.nascimento else '',
             'endereco': dados.endereco if dados else '',
-            'foto_perfil': dados.foto_perfil if dados else 'default-user.png'
+            'foto_perfil': dados.foto_perfil if dados else 'default-user.png',
+            'foto_miniatura_url': url_miniatura(dados)
         }) # Retorna os dados do usuário atual
     
     elif request.method == 'PUT': # Rota para editar os dados do usuário atual
@@ -719,16 +2532,16 @@ def meus_dados(current_user): # Rota para ver e editar os dados do usuário atua
 
             # Atualiza dados básicos
             if 'nome' in data:
-                current_user.nome = data['nome'] # Atualiza o nome
+                usuario.nome = data['nome'] # Atualiza o nome
             if 'email' in data:
-                if Usuario.query.filter(Usuario.email == data['email'], Usuario.id != current_user.id).first(): # Verifica email duplicado
+                if Usuario.query.filter(Usuario.email == data['email'], Usuario.id != usuario.id).first(): # Verifica email duplicado
                     return jsonify({'message': 'Email já está em uso'}), 400 # Verifica email duplicado
-                current_user.email = data['email'] # Atualiza o email
+                usuario.email = data['email'] # Atualiza o email
 
             # Garante que os dados adicionais existem
-            dados = current_user.dados_adicionais # Pega os dados adicionais
+            dados = usuario.dados_adicionais # Pega os dados adicionais
             if not dados:
-                dados = DadosUsuario(user_id=current_user.id) # Cria os dados adicionais se não existirem
+                dados = DadosUsuario(user_id=usuario.id) # Cria os dados adicionais se não existirem
                 db.session.add(dados) # Adiciona ao banco
 
             # Atualiza campos adicionais
@@ -745,7 +2558,9 @@ def meus_dados(current_user): # Rota para ver e editar os dados do usuário atua
             if 'endereco' in data: 
                 dados.endereco = data['endereco'] # Atualiza o endereço
 
+            incrementar_versao('funcionarios')
             db.session.commit() # Salva as mudanças
+            invalidar_principal(usuario.id) # Remove o usuário do cache de autenticação
             return jsonify({'message': 'Dados atualizados com sucesso!'}) # Retorna sucesso
 
         except Exception as e: # Captura exceções genéricas para evitar falhas silenciosas
@@ -753,6 +2568,111 @@ def meus_dados(current_user): # Rota para ver e editar os dados do usuário atua
             app.logger.error(f'Erro ao atualizar dados: {str(e)}') # Log para depuração
             return jsonify({'message': 'Erro interno no servidor'}), 500 # Retorna erro genérico
     
+# FOTOS DE PERFIL E MINIATURAS
+# Cada foto enviada gera, uma única vez, uma miniatura quadrada em WEBP (poucos KB) guardada ao lado da original.
+# As listas mostram a miniatura como avatar; a original continua disponível para a tela de dados do usuário.
+MINIATURA_TAMANHO = int(os.environ.get('MINIATURA_TAMANHO', 80)) # Lado em px (o dobro do avatar de 40px, para telas retina)
+MINIATURA_QUALIDADE = int(os.environ.get('MINIATURA_QUALIDADE', 80)) # Qualidade do WEBP (0-100)
+
+Image = ImageOps = None # Pillow: importado na primeira miniatura (ver pillow_disponivel)
+
+def pillow_disponivel():
+    # O Pillow é opcional (sem ele, as listas usam a foto original) e só é importado quando a primeira miniatura é gerada
+    global Image, ImageOps
+    if Image is None:
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            Image = False # Não tenta importar de novo a cada upload
+    return bool(Image)
+
+def gerar_miniatura(origem, destino):
+    # Lê a imagem em `origem` e grava a miniatura em `destino`; False se não der (sem Pillow ou arquivo inválido)
+    if not pillow_disponivel():
+        return False
+    try:
+        with Image.open(origem) as imagem:
+            imagem.draft('RGB', (MINIATURA_TAMANHO * 2, MINIATURA_TAMANHO * 2)) # JPEG: decodifica já reduzida (fotos de celular)
+            imagem = ImageOps.exif_transpose(imagem) # Respeita a orientação gravada pela câmera
+            if imagem.mode not in ('RGB', 'RGBA'):
+                imagem = imagem.convert('RGBA' if imagem.mode in ('LA', 'P', 'PA') else 'RGB')
+            miniatura = ImageOps.fit(imagem, (MINIATURA_TAMANHO, MINIATURA_TAMANHO), Image.LANCZOS) # Recorta o centro
+            miniatura.save(destino, 'WEBP', quality=MINIATURA_QUALIDADE, method=4)
+        return True
+    except Exception as e:
+        app.logger.warning(f'Miniatura não gerada para {origem}: {e}')
+        return False
+
+def _guardar_miniatura(caminho, sha256):
+    # Miniatura da foto em `caminho` (de conteúdo `sha256`), gerada uma única vez por conteúdo e tamanho
+    nome = f"{'perfil/' if USE_S3 else ''}{sha256}_{MINIATURA_TAMANHO}.webp"
+    if _objeto_existe('perfil', nome):
+        return nome
+    descritor, temporario = tempfile.mkstemp(suffix='.tmp', dir=_pasta_temporaria('perfil'))
+    os.close(descritor)
+    if not gerar_miniatura(caminho, temporario):
+        os.remove(temporario)
+        return None
+    _publicar('perfil', nome, temporario)
+    return nome
+
+def salvar_foto_perfil(dados, foto):
+    # Grava a foto (nomeada pelo conteúdo) e a miniatura e atualiza `dados`; o commit fica com quem chamou.
+    # As anteriores não são apagadas aqui: outra linha pode usar o mesmo arquivo (ver limpar-arquivos-orfaos)
+    nome, sha256 = armazenar_por_conteudo(foto, 'perfil', os.path.splitext(secure_filename(foto.filename))[1])
+    caminho = caminho_spool(nome) if USE_S3 else os.path.join(app.config['UPLOAD_FOLDER_PERFIL'], nome)
+    dados.foto_perfil, dados.foto_miniatura = nome, _guardar_miniatura(caminho, sha256) # Nome local ou chave S3
+
+def url_miniatura(dados):
+    # Avatar das listas: miniatura quando existir; senão a foto original (ainda sem miniatura) ou a padrão
+    nome = (dados.foto_miniatura or dados.foto_perfil) if dados else None
+    return f"/static/uploads/perfil/{nome or 'default-user.png'}"
+
+@app.cli.command('gerar-miniaturas')
+@click.option('--lote', default=100, show_default=True, help='Fotos por commit.')
+def gerar_miniaturas_command(lote):
+    """Gera as miniaturas que faltam (fotos antigas ou depois de mudar MINIATURA_TAMANHO)."""
+    if not pillow_disponivel():
+        raise click.ClickException('Instale o Pillow para gerar miniaturas.')
+    geradas = falhas = 0
+    ultimo_id = 0
+    while True:
+        registros = DadosUsuario.query.filter(
+            DadosUsuario.id > ultimo_id, DadosUsuario.foto_perfil.isnot(None), DadosUsuario.foto_perfil != 'default-user.png',
+            db.or_(DadosUsuario.foto_miniatura.is_(None), DadosUsuario.foto_miniatura.notlike(f'%\\_{MINIATURA_TAMANHO}.webp', escape='\\'))
+        ).order_by(DadosUsuario.id).limit(lote).all()
+        if not registros:
+            break
+        for dados in registros:
+            ultimo_id = dados.id
+            caminho = caminho_spool(dados.foto_perfil) if USE_S3 else os.path.join(app.config['UPLOAD_FOLDER_PERFIL'], dados.foto_perfil)
+            baixado = None
+            if USE_S3 and (not caminho or not os.path.isfile(caminho)): # Já enviado: baixa a original do S3
+                descritor, baixado = tempfile.mkstemp()
+                os.close(descritor)
+                try:
+                    cliente_s3().download_file(AWS_S3_BUCKET_NAME, dados.foto_perfil, baixado)
+                except Exception as e:
+                    app.logger.warning(f'gerar-miniaturas: {dados.foto_perfil} não baixada: {e}')
+                caminho = baixado
+            miniatura = None
+            if os.path.isfile(caminho) and os.path.getsize(caminho):
+                with open(caminho, 'rb') as arquivo:
+                    miniatura = _guardar_miniatura(caminho, hashlib.file_digest(arquivo, 'sha256').hexdigest())
+            if baixado:
+                os.remove(baixado)
+            if miniatura:
+                dados.foto_miniatura = miniatura
+                geradas += 1
+            else:
+                falhas += 1
+        incrementar_versao('funcionarios')
+        db.session.commit()
+        if USE_S3:
+            enviador_s3.acordar()
+        click.echo(f'{geradas} miniaturas geradas, {falhas} fotos sem miniatura...')
+    click.echo(f'Concluído: {geradas} miniaturas geradas, {falhas} fotos sem miniatura (arquivo ausente ou inválido).')
+
 # ROTA PARA UPLOAD DE FOTO DE PERFIL
 @app.route('/api/upload-foto-perfil', methods=['POST']) 
 @token_required
@@ -770,41 +2690,17 @@ def upload_foto_perfil(current_user): # Rota para upload de foto de perfil
         return jsonify({'message': 'O arquivo deve ser uma imagem.'}), 400 # Verifica se o arquivo é uma imagem
     # Salva a foto de perfil
     if file:
-        # Gera um nome de arquivo único para a foto de perfil
-        filename = secure_filename(f"perfil_{current_user.id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}{os.path.splitext(file.filename)[1]}") # Nome seguro do arquivo
-        if USE_S3:
-            key = f"perfil/{filename}"
-            success = upload_to_s3(file, key)
-            if not success:
-                return jsonify({'message': 'Erro ao enviar arquivo para armazenamento'}), 500
-        else:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER_PERFIL'], filename) # Caminho completo do arquivo
-            file.save(filepath) # Salva o arquivo
-
         # Garante que os dados adicionais existem
         dados = DadosUsuario.query.filter_by(user_id=current_user.id).first() # Pega os dados adicionais
         if not dados:
             dados = DadosUsuario(user_id=current_user.id) # Cria os dados adicionais se não existirem
             db.session.add(dados) # Adiciona ao banco
 
-        # Remove a foto antiga se não for a padrão e se existir
-        if dados.foto_perfil and dados.foto_perfil != 'default-user.png':
-            if USE_S3:
-                try:
-                    s3_client.delete_object(Bucket=AWS_S3_BUCKET_NAME, Key=dados.foto_perfil)
-                except Exception as e:
-                    app.logger.error(f"Erro ao remover foto antiga do S3: {e}")
-            else:
-                old_filepath = os.path.join(app.config['UPLOAD_FOLDER_PERFIL'], dados.foto_perfil) # Caminho da foto antiga
-                if os.path.exists(old_filepath): # Verifica se o arquivo existe
-                    try:
-                        os.remove(old_filepath)
-                    except OSError as e:
-                        app.logger.error(f"Erro ao remover arquivo antigo: {e}") # Log para depuração
-
-        # Atualiza o nome do arquivo no banco de dados (salva chave S3 ou nome local)
-        dados.foto_perfil = key if USE_S3 else filename
+        salvar_foto_perfil(dados, file) # Grava a foto e a miniatura (nomeadas pelo conteúdo)
+        incrementar_versao('funcionarios')
         db.session.commit() # Salva as mudanças
+        if USE_S3:
+            enviador_s3.acordar()
 
         return jsonify({'message': 'Foto de perfil atualizada com sucesso!', 'filename': dados.foto_perfil}), 200 # Retorna sucesso
 
@@ -812,6 +2708,7 @@ def upload_foto_perfil(current_user): # Rota para upload de foto de perfil
 @app.route('/api/meus-dados/alterar-senha', methods=['PUT']) 
 @token_required
 def alterar_senha(current_user): # Rota para alterar a senha do usuário atual
+    usuario = Usuario.query.get(current_user.id) # Carrega o registro completo (com o hash da senha)
     data = request.get_json()  # Obtém os dados JSON da requisição
     senha_atual = data.get('senha_atual') # Pega a senha atual
     nova_senha = data.get('nova_senha') # Pega a nova senha
@@ -819,11 +2716,12 @@ def alterar_senha(current_user): # Rota para alterar a senha do usuário atual
     if not senha_atual or not nova_senha:
         return jsonify({'message': 'Preencha todos os campos.'}), 400 # Verifica campos obrigatórios
     # Verifica se a senha atual está correta
-    if not check_password_hash(current_user.senha, senha_atual):
+    if not verificar_senha(usuario.senha, senha_atual):
         return jsonify({'message': 'Senha atual incorreta.'}), 400 # Verifica se a senha atual está correta
     # Atualiza a senha
-    current_user.senha = generate_password_hash(nova_senha) # Hash da nova senha
+    usuario.senha = gerar_hash_senha(nova_senha) # Hash da nova senha
     db.session.commit()
+    invalidar_principal(usuario.id) # Remove o usuário do cache de autenticação
     return jsonify({'message': 'Senha alterada com sucesso!'}) # Retorna sucesso
 
 # ROTAS DE RELATÓRIOS E GERENCIAMENTO PARA GERENTE
@@ -833,7 +2731,9 @@ def relatorio_pontos_gerente(current_user): # Rota para relatório de pontos
     if current_user.tipo_usuario != 'gerente':
         return jsonify({'message': 'Acesso negado'}), 403 # Verifica se é gerente
 
-    pontos = db.session.query(Ponto, Usuario.nome).join(Usuario).order_by(Ponto.entrada.desc()).all() # Pega todos os pontos com o nome do usuário
+    pontos, proximo_cursor = paginar(
+        db.session.query(Ponto, Usuario.nome).join(Usuario), (Ponto.entrada, Ponto.id), lambda linha: (linha[0].entrada, linha[0].id)
+    ) # Pega os pontos com o nome do usuário
     
     pontos_serializados = [{ # Serializa os pontos
         'id': p.id,
@@ -842,17 +2742,70 @@ def relatorio_pontos_gerente(current_user): # Rota para relatório de pontos
         'saida': p.saida.isoformat() if p.saida else None
     } for p, nome in pontos] # Serializa os pontos
     
-    return jsonify(pontos_serializados) # Retorna os pontos serializados
+    return resposta_paginada(pontos_serializados, proximo_cursor) # Retorna os pontos serializados
+
+# ROTA PARA EXPORTAR O RELATÓRIO DE PONTOS EM STREAMING (CSV OU NDJSON)
+EXPORTACAO_LOTE = int(os.environ.get('EXPORTACAO_LOTE', 1000)) # Linhas lidas do cursor e enviadas por bloco
+
+@app.route('/api/gerente/relatorio-pontos/exportar', methods=['GET'])
+@token_required
+def exportar_relatorio_pontos(current_user):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403 # Verifica se é gerente
+
+    formato = request.args.get('formato', 'csv').lower() # 'csv' ou 'ndjson'
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({'message': 'Formato inválido. Use csv ou ndjson'}), 400
+    employee_id = request.args.get('employee_id', type=int) # ID do funcionário (opcional)
+
+    # Seleciona apenas as colunas exportadas e lê com cursor no servidor (yield_per), em blocos,
+    # para que a memória do worker não cresça com o número de pontos
+    query = db.session.query(Ponto.id, Usuario.id, Usuario.nome, Ponto.entrada, Ponto.saida).join(Usuario, Ponto.usuario_id == Usuario.id)
+    try:
+        query = filtrar_periodo(query, Ponto.entrada) # Filtra por mês/ano ou intervalo de datas
+    except ValueError:
+        return jsonify({'message': 'Período inválido. Use month/year ou inicio/fim no formato YYYY-MM-DD'}), 400
+    if employee_id:
+        query = query.filter(Ponto.usuario_id == employee_id)
+    query = query.order_by(Ponto.entrada.asc(), Ponto.id.asc()).yield_per(EXPORTACAO_LOTE)
+
+    def gerar():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        if formato == 'csv':
+            escritor.writerow(['id', 'funcionario_id', 'funcionario', 'entrada', 'saida']) # Cabeçalho
+        for numero, (ponto_id, funcionario_id, nome, entrada, saida) in enumerate(query, 1):
+            entrada = entrada.isoformat() if entrada else None
+            saida = saida.isoformat() if saida else None
+            if formato == 'csv':
+                escritor.writerow([ponto_id, funcionario_id, nome, entrada, saida or ''])
+            else:
+                buffer.write(json.dumps({'id': ponto_id, 'funcionario_id': funcionario_id, 'funcionario': nome,
+                                         'entrada': entrada, 'saida': saida}, ensure_ascii=False) + '\n')
+            if numero % EXPORTACAO_LOTE == 0: # Envia um bloco e esvazia o buffer
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    nome_arquivo = f'relatorio_pontos.{formato}'
+    return Response(stream_with_context(gerar()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'}) # Resposta em blocos (chunked)
 
 # ROTA PARA LISTAR FUNCIONÁRIOS COM DADOS ADICIONAIS
 @app.route('/api/gerente/funcionarios', methods=['GET']) # ROTA PARA LISTAR FUNCIONÁRIOS
 @token_required
+@condicional('funcionarios')
 def listar_funcionarios_gerente(current_user): # Rota para listar funcionários
     if current_user.tipo_usuario != 'gerente': 
         return jsonify({'message': 'Acesso negado'}), 403 # Verifica se é gerente
 
     # Inclui os dados adicionais para exibir telefone e foto de perfil
-    funcionarios = db.session.query(Usuario, DadosUsuario).join(DadosUsuario).filter(Usuario.tipo_usuario == 'funcionario').all() # Pega todos os funcionários com dados adicionais
+    funcionarios, proximo_cursor = paginar(
+        db.session.query(Usuario, DadosUsuario).join(DadosUsuario).filter(Usuario.tipo_usuario == 'funcionario'),
+        (Usuario.id,), lambda linha: (linha[0].id,), descendente=False
+    ) # Pega os funcionários com dados adicionais
     
     funcionarios_serializados = [{ # Serializa os funcionários
         'id': f.id,
@@ -860,10 +2813,12 @@ def listar_funcionarios_gerente(current_user): # Rota para listar funcionários
         'email': f.email,
         'telefone': d.telefone,
         'foto_perfil': d.foto_perfil,
+        'foto_miniatura': d.foto_miniatura,
+        'foto_miniatura_url': url_miniatura(d), # Avatar da lista
         'funcao': f.funcao
     } for f, d in funcionarios] # Serializa os funcionários
 
-    return jsonify(funcionarios_serializados) # Retorna os funcionários serializados
+    return resposta_paginada(funcionarios_serializados, proximo_cursor) # Retorna os funcionários serializados
 
 # ROTA PARA LISTAR PONTOS DE UM FUNCIONÁRIO ESPECÍFICO
 @app.route('/api/gerente/pontos/<int:user_id>', methods=['GET']) 
@@ -898,11 +2853,12 @@ def relatorio_pontos_calendario(current_user): # Rota para relatório de pontos
     employee_id = request.args.get('employee_id', type=int) # ID do funcionário (opcional)
 
     # Filtra pontos pelo mês/ano solicitado
-    start_date = datetime.datetime(year, month, 1)
-    if month == 12: # Se for dezembro, o próximo mês é janeiro do próximo ano
-        end_date = datetime.datetime(year + 1, 1, 1) # Próximo ano
-    else:
-        end_date = datetime.datetime(year, month + 1, 1) # Próximo mês
+    if not month or not year:
+        return jsonify({'message': 'Mês e ano são obrigatórios.'}), 400
+    try:
+        start_date, end_date = intervalo_mes(year, month)
+    except ValueError:
+        return jsonify({'message': 'Mês inválido.'}), 400
 
     query = db.session.query(Ponto, Usuario.nome).join(Usuario) # Consulta inicial
     query = query.filter( # Filtra pela data
@@ -924,6 +2880,45 @@ def relatorio_pontos_calendario(current_user): # Rota para relatório de pontos
 
     return jsonify(pontos_serializados) # Retorna os pontos serializados
 
+# ROTA PARA RELATÓRIO DE HORAS POR DIA (RESUMOS PRÉ-CALCULADOS)
+@app.route('/api/gerente/relatorio-pontos-resumo', methods=['GET'])
+@token_required
+def relatorio_pontos_resumo(current_user):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403 # Verifica se é gerente
+    month = request.args.get('month', type=int) # Mês
+    year = request.args.get('year', type=int) # Ano
+    employee_id = request.args.get('employee_id', type=int) # ID do funcionário (opcional)
+    if not month or not year:
+        return jsonify({'message': 'Mês e ano são obrigatórios.'}), 400
+    try:
+        start_date, end_date = intervalo_mes(year, month)
+    except ValueError:
+        return jsonify({'message': 'Mês inválido.'}), 400
+
+    # Turnos ainda abertos não entram no resumo até a saída ser registrada
+    dias = db.session.query(ResumoPontoDiario, Usuario.nome).join(Usuario, ResumoPontoDiario.usuario_id == Usuario.id).filter(
+        ResumoPontoDiario.dia >= start_date.date(), ResumoPontoDiario.dia < end_date.date())
+    totais = db.session.query(ResumoPontoMensal, Usuario.nome).join(Usuario, ResumoPontoMensal.usuario_id == Usuario.id).filter(
+        ResumoPontoMensal.ano == year, ResumoPontoMensal.mes == month)
+    if employee_id:
+        dias = dias.filter(ResumoPontoDiario.usuario_id == employee_id)
+        totais = totais.filter(ResumoPontoMensal.usuario_id == employee_id)
+
+    return jsonify({
+        'dias': [{
+            'funcionario_id': r.usuario_id,
+            'funcionario': nome,
+            'dia': r.dia.isoformat(),
+            'minutos': r.minutos
+        } for r, nome in dias.order_by(ResumoPontoDiario.dia.asc(), Usuario.nome.asc())], # Um bucket por funcionário e dia
+        'totais': [{
+            'funcionario_id': r.usuario_id,
+            'funcionario': nome,
+            'minutos': r.minutos
+        } for r, nome in totais.order_by(Usuario.nome.asc())] # Total do mês por funcionário
+    })
+
 # ROTA PARA LISTAR FEEDBACKS (SOMENTE GERENTE)
 @app.route('/api/gerente/feedbacks', methods=['GET']) # ROTA PARA LISTAR FEEDBACKS
 @token_required # Protege a rota
@@ -954,12 +2949,7 @@ def minha_contabilidade(current_user):
             'historico_pagamentos': []
         })
     
-    try:
-        historico = json.loads(contabilidade.historico_pagamentos or '[]')
-        if not isinstance(historico, list):
-            historico = []
-    except Exception:
-        historico = []
+    historico = holerites_do_funcionario(current_user.id) # Holerites em ordem de mês
     
     return jsonify({ # Retorna os dados de contabilidade do funcionário
         'id': current_user.id,
@@ -1007,7 +2997,11 @@ def contabilidade_funcionario(current_user, user_id):
         historico = data.get('historico_pagamentos', [])
         if not isinstance(historico, list):
             historico = []
-        contabilidade.historico_pagamentos = json.dumps(historico)
+        try:
+            salvar_holerites(user_id, historico) # Grava só os meses alterados
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'message': str(e)}), 400
         
         db.session.commit()
         return jsonify({'message': 'Dados de contabilidade salvos com sucesso!'})
@@ -1023,12 +3017,7 @@ def contabilidade_funcionario(current_user, user_id):
         db.session.add(contabilidade)
         db.session.commit()
     
-    try:
-        historico = json.loads(contabilidade.historico_pagamentos or '[]')
-        if not isinstance(historico, list):
-            historico = []
-    except Exception:
-        historico = []
+    historico = holerites_do_funcionario(user_id) # Holerites em ordem de mês
     
     dados = {
         'id': funcionario.id,
@@ -1046,6 +3035,413 @@ def contabilidade_funcionario(current_user, user_id):
     }
     return jsonify(dados)
 
+# ROTAS DE HOLERITES
+@app.route('/api/contabilidade/<int:user_id>/holerites', methods=['GET'])
+@token_required
+def listar_holerites(current_user, user_id):
+    # Gerente vê de todos, funcionário só os próprios; ?inicio=YYYY-MM&fim=YYYY-MM limita o período
+    if current_user.tipo_usuario != 'gerente' and current_user.id != user_id:
+        return jsonify({'message': 'Acesso negado'}), 403
+    query = Holerite.query.filter_by(funcionario_id=user_id)
+    try:
+        if request.args.get('inicio'):
+            query = query.filter(Holerite.mes_ano >= validar_mes_ano(request.args['inicio']))
+        if request.args.get('fim'):
+            query = query.filter(Holerite.mes_ano <= validar_mes_ano(request.args['fim']))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify([serializar_holerite(h) for h in query.order_by(Holerite.mes_ano)])
+
+@app.route('/api/contabilidade/<int:user_id>/holerites/<mes_ano>', methods=['GET'])
+@token_required
+def obter_holerite(current_user, user_id, mes_ano):
+    if current_user.tipo_usuario != 'gerente' and current_user.id != user_id:
+        return jsonify({'message': 'Acesso negado'}), 403
+    try:
+        mes_ano = validar_mes_ano(mes_ano)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    holerite = Holerite.query.filter_by(funcionario_id=user_id, mes_ano=mes_ano).first() # Índice único (funcionário, mês)
+    if not holerite:
+        return jsonify({'message': 'Holerite não encontrado'}), 404
+    return jsonify(serializar_holerite(holerite))
+
+@app.route('/api/gerente/holerites/<mes_ano>', methods=['GET'])
+@token_required
+def holerites_do_mes(current_user, mes_ano):
+    # Holerites de todos os funcionários no mês, paginados por funcionário, com os totais da empresa
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    try:
+        mes_ano = validar_mes_ano(mes_ano)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    query = db.session.query(Holerite, Usuario.nome).join(Usuario, Usuario.id == Holerite.funcionario_id).filter(Holerite.mes_ano == mes_ano)
+    linhas, proximo_cursor = paginar(query, (Holerite.funcionario_id,), lambda linha: (linha[0].funcionario_id,), descendente=False)
+    totais = db.session.query(db.func.count(Holerite.id), *[db.func.coalesce(db.func.sum(getattr(Holerite, campo)), 0) for campo in
+        ('salario_bruto', 'descontos', 'inss_valor', 'irrf_valor', 'fgts_mes', 'salario_liquido')]).filter(Holerite.mes_ano == mes_ano).one() # Uma consulta pelo índice do mês
+    return resposta_paginada({
+        'mes_ano': mes_ano,
+        'holerites': [{'funcionario_id': h.funcionario_id, 'nome': nome, **serializar_holerite(h)} for h, nome in linhas],
+        'totais': dict(zip(('quantidade', 'salario_bruto', 'descontos', 'inss_valor', 'irrf_valor', 'fgts_mes', 'salario_liquido'), totais))
+    }, proximo_cursor)
+
+@app.cli.command('migrar-holerites')
+@click.option('--lote', default=200, show_default=True, help='Funcionários por transação.')
+def migrar_holerites(lote):
+    """Move o JSON historico_pagamentos para a tabela holerites (também roda no migrar-esquema)."""
+    funcionarios, holerites, ignorados = migrar_historico_pagamentos(lote)
+    click.echo(f'{funcionarios} funcionários, {holerites} holerites migrados, {ignorados} itens não migrados (repetidos, ou inválidos e mantidos no JSON)')
+
+# FOLHA DE PAGAMENTO
+# Cálculo do mês para todos os funcionários de uma vez, no servidor, com as mesmas fórmulas da página
+# de edição: proventos = bruto + comissão + abonos; descontos = benefícios; líquido = proventos - descontos
+# - INSS - IRRF - faltas. As alíquotas vêm das tabelas progressivas abaixo (vigência 2024; atualize aqui).
+TABELA_INSS = ((1412.00, 0.075), (2666.68, 0.09), (4000.03, 0.12), (7786.02, 0.14)) # (teto da faixa, alíquota)
+TABELA_IRRF = ((2259.20, 0.0, 0.0), (2826.65, 0.075, 169.44), (3751.05, 0.15, 381.44), (4664.68, 0.225, 662.77),
+               (float('inf'), 0.275, 896.00)) # (teto da faixa, alíquota, parcela a deduzir)
+IRRF_DESCONTO_SIMPLIFICADO = 564.80 # Usado no lugar do INSS quando for maior (mais vantajoso)
+FGTS_ALIQUOTA = 0.08
+CONTRATOS_COM_ENCARGOS = {'CLT'} # Demais contratos (PJ, estágio...) não têm INSS/FGTS retidos
+
+# INSS acumulado até o início de cada faixa, para calcular cada salário com uma busca binária
+_INSS_TETOS = [teto for teto, _ in TABELA_INSS]
+_INSS_PISOS = [0.0] + _INSS_TETOS[:-1]
+_INSS_ACUMULADO = [0.0]
+for _piso, (_teto, _aliquota) in zip(_INSS_PISOS, TABELA_INSS):
+    _INSS_ACUMULADO.append(_INSS_ACUMULADO[-1] + (_teto - _piso) * _aliquota)
+_IRRF_TETOS = [teto for teto, _, _ in TABELA_IRRF]
+
+def calcular_inss(bases):
+    resultado = []
+    for base in bases:
+        base = min(base, _INSS_TETOS[-1]) # Contribuição limitada ao teto
+        faixa = bisect_left(_INSS_TETOS, base)
+        resultado.append(round(_INSS_ACUMULADO[faixa] + (base - _INSS_PISOS[faixa]) * TABELA_INSS[faixa][1], 2) if base > 0 else 0.0)
+    return resultado
+
+def calcular_irrf(bases):
+    resultado = []
+    for base in bases:
+        _, aliquota, deducao = TABELA_IRRF[bisect_left(_IRRF_TETOS, base)]
+        resultado.append(round(max(base * aliquota - deducao, 0.0), 2))
+    return resultado
+
+def _admitido_ate(data_admissao, fim_mes):
+    try:
+        return datetime.datetime.strptime(data_admissao, '%d/%m/%Y') < fim_mes
+    except (TypeError, ValueError): # Data ausente ou em outro formato: entra na folha
+        return True
+
+def calcular_folha(mes_ano, ajustes=None):
+    # Devolve (holerites calculados, ignorados). ajustes: {funcionario_id: {'comissao', 'abonos', 'descontos_falta'}};
+    # sem ajuste, reaproveita os valores já lançados no holerite do mês.
+    ano, mes = map(int, mes_ano.split('-'))
+    _, fim_mes = intervalo_mes(ano, mes)
+    ajustes = {int(k): v for k, v in (ajustes or {}).items()}
+    linhas = db.session.query(
+        Usuario.id, Usuario.nome, ContabilidadeFuncionario.salario_base, ContabilidadeFuncionario.tipo_contrato,
+        ContabilidadeFuncionario.data_admissao, ContabilidadeFuncionario.plano_saude, ContabilidadeFuncionario.vale_transporte,
+        ContabilidadeFuncionario.vale_refeicao, ContabilidadeFuncionario.bolsa_educacao, Holerite.comissao, Holerite.abonos,
+        Holerite.descontos_falta
+    ).join(ContabilidadeFuncionario, ContabilidadeFuncionario.funcionario_id == Usuario.id).outerjoin(
+        Holerite, (Holerite.funcionario_id == Usuario.id) & (Holerite.mes_ano == mes_ano)
+    ).filter(Usuario.tipo_usuario == 'funcionario').order_by(Usuario.id).all() # Uma consulta para a empresa inteira
+
+    ignorados, validas = [], []
+    for linha in linhas:
+        if not (linha.salario_base or 0) > 0:
+            ignorados.append({'funcionario_id': linha.id, 'motivo': 'Salário base não informado.'})
+        elif not _admitido_ate(linha.data_admissao, fim_mes):
+            ignorados.append({'funcionario_id': linha.id, 'motivo': 'Admitido depois do mês.'})
+        else:
+            validas.append(linha)
+
+    # Colunas da folha: cada etapa percorre uma lista inteira em vez de um funcionário por vez
+    def coluna(campo):
+        return [float(ajustes.get(l.id, {}).get(campo, getattr(l, campo)) or 0) for l in validas]
+    bruto = [float(l.salario_base) for l in validas]
+    comissao, abonos, faltas = coluna('comissao'), coluna('abonos'), coluna('descontos_falta')
+    encargos = [(l.tipo_contrato or '').upper() in CONTRATOS_COM_ENCARGOS for l in validas]
+    proventos = [round(b + c + a, 2) for b, c, a in zip(bruto, comissao, abonos)]
+    base_inss = [p if e else 0.0 for p, e in zip(proventos, encargos)]
+    inss = calcular_inss(base_inss)
+    base_irrf = [round(max(p - max(i, IRRF_DESCONTO_SIMPLIFICADO), 0.0), 2) for p, i in zip(proventos, inss)]
+    irrf = calcular_irrf(base_irrf)
+    fgts = [round(b * FGTS_ALIQUOTA, 2) for b in base_inss]
+    beneficios = [round(sum(x or 0 for x in (l.plano_saude, l.vale_transporte, l.vale_refeicao, l.bolsa_educacao)), 2) for l in validas]
+    liquido = [round(p - d - i - r - f, 2) for p, d, i, r, f in zip(proventos, beneficios, inss, irrf, faltas)]
+
+    holerites = [{
+        'funcionario_id': l.id, 'nome': l.nome, 'mes_ano': mes_ano, 'salario_bruto': bruto[n], 'comissao': comissao[n],
+        'abonos': abonos[n], 'descontos_falta': faltas[n], 'descontos': beneficios[n],
+        'inss_percentual': round(inss[n] * 100 / proventos[n], 2) if proventos[n] else 0.0, 'inss_valor': inss[n],
+        'irrf_percentual': round(irrf[n] * 100 / base_irrf[n], 2) if base_irrf[n] else 0.0, 'irrf_valor': irrf[n],
+        'salario_liquido': liquido[n], 'base_calc_fgts': base_inss[n], 'fgts_mes': fgts[n], 'base_calc_inss': base_inss[n],
+        'base_calc_irrf': base_irrf[n]
+    } for n, l in enumerate(validas)]
+    return holerites, ignorados
+
+def totais_folha(holerites):
+    campos = ('salario_bruto', 'descontos', 'inss_valor', 'irrf_valor', 'fgts_mes', 'salario_liquido')
+    return {'quantidade': len(holerites), **{c: round(sum(h[c] for h in holerites), 2) for c in campos}}
+
+def gravar_folha(mes_ano, holerites, sobrescrever_pagos=False):
+    # Grava a folha inteira na transação atual; holerites já pagos só são recalculados se pedido
+    existentes = {h.funcionario_id: h for h in Holerite.query.filter_by(mes_ano=mes_ano)} # Índice do mês
+    gravados, pagos = 0, []
+    for dados in holerites:
+        holerite = existentes.get(dados['funcionario_id'])
+        if holerite is None:
+            holerite = Holerite(funcionario_id=dados['funcionario_id'], mes_ano=mes_ano, status='Pendente')
+            db.session.add(holerite)
+        elif holerite.status == 'Pago' and not sobrescrever_pagos:
+            pagos.append(dados['funcionario_id'])
+            continue
+        for campo in CAMPOS_VALORES_HOLERITE:
+            setattr(holerite, campo, dados[campo])
+        gravados += 1
+    return gravados, pagos
+
+# ROTA PARA CALCULAR/FECHAR A FOLHA DO MÊS (SOMENTE GERENTE)
+@app.route('/api/gerente/folha/<mes_ano>', methods=['POST'])
+@token_required
+def fechar_folha(current_user, mes_ano):
+    # Corpo: {"simular": true|false, "ajustes": {"<funcionario_id>": {"comissao": 0, "abonos": 0, "descontos_falta": 0}},
+    #         "sobrescrever_pagos": false}. Na simulação nada é gravado e os holerites calculados são devolvidos.
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        mes_ano = validar_mes_ano(mes_ano)
+        inicio = time.perf_counter()
+        holerites, ignorados = calcular_folha(mes_ano, data.get('ajustes'))
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({'message': 'Mês ou ajustes inválidos.'}), 400
+    resposta = {'mes_ano': mes_ano, 'simulacao': bool(data.get('simular')), 'totais': totais_folha(holerites), 'ignorados': ignorados}
+    if data.get('simular'):
+        resposta['holerites'] = holerites
+    else:
+        gravados, pagos = gravar_folha(mes_ano, holerites, bool(data.get('sobrescrever_pagos')))
+        try:
+            db.session.commit() # Toda a folha em uma transação: ou grava tudo ou nada
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'message': 'A folha do mês foi alterada ao mesmo tempo. Tente novamente.'}), 409
+        resposta.update({'gravados': gravados, 'pagos_mantidos': pagos})
+    resposta['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    return jsonify(resposta)
+
+@app.cli.command('fechar-folha')
+@click.argument('mes_ano')
+@click.option('--simular', is_flag=True, help='Só calcula e mostra os totais, sem gravar.')
+@click.option('--sobrescrever-pagos', is_flag=True, help='Recalcula também os holerites já marcados como pagos.')
+def fechar_folha_cli(mes_ano, simular, sobrescrever_pagos):
+    """Calcula a folha do mês (YYYY-MM) para todos os funcionários e grava os holerites."""
+    holerites, ignorados = calcular_folha(validar_mes_ano(mes_ano))
+    click.echo(json.dumps(totais_folha(holerites), ensure_ascii=False))
+    for item in ignorados:
+        click.echo(f"ignorado {item['funcionario_id']}: {item['motivo']}")
+    if not simular:
+        gravados, pagos = gravar_folha(mes_ano, holerites, sobrescrever_pagos)
+        db.session.commit()
+        click.echo(f'{gravados} holerites gravados, {len(pagos)} já pagos mantidos')
+
+# PDF DE HOLERITES
+# Gerados no servidor (antes eram montados no navegador com jsPDF/html2canvas). O gerador abaixo escreve
+# um PDF simples só com texto e linhas nas fontes padrão (sem dependências), roda em um pool de processos
+# e o resultado fica em disco com o nome igual ao sha256 do layout: o mesmo holerite nunca é gerado duas vezes.
+PDF_LAYOUT_VERSAO = 1 # Incremente ao mudar o layout para invalidar o cache
+PDF_PROCESSOS = int(os.environ.get('PDF_PROCESSOS', PROCESSOS_POR_WORKER)) # Por worker; 0 gera na própria thread
+_FONTES_PDF = {'normal': 'Helvetica', 'negrito': 'Helvetica-Bold', 'mono': 'Courier'}
+
+_pool_pdf = None
+_pool_pdf_lock = threading.Lock()
+
+def _executor_pdf():
+    global _pool_pdf
+    with _pool_pdf_lock:
+        if _pool_pdf is None: # Criado sob demanda, uma vez por worker
+            _pool_pdf = ProcessPoolExecutor(max_workers=PDF_PROCESSOS, mp_context=CONTEXTO_PROCESSOS) # Filhos importam o app
+        return _pool_pdf
+
+def _texto_pdf(texto):
+    texto = str(texto).encode('cp1252', 'replace') # WinAnsiEncoding cobre os acentos do português
+    return b'(' + texto.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+def gerar_pdf(paginas):
+    # paginas: lista de páginas A4; cada elemento é ('t', x, y, fonte, tamanho, texto) ou ('l', x1, y1, x2, y2)
+    fontes = list(_FONTES_PDF)
+    objetos = [b'<< /Type /Catalog /Pages 2 0 R >>', None]
+    objetos += [b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % _FONTES_PDF[f].encode() for f in fontes]
+    recursos = b'<< /Font << %s >> >>' % b' '.join(b'/F%d %d 0 R' % (n, n + 3) for n in range(len(fontes)))
+    filhos = []
+    for pagina in paginas:
+        comandos = []
+        for elemento in pagina:
+            if elemento[0] == 't':
+                _, x, y, fonte, tamanho, texto = elemento
+                comandos.append(b'BT /F%d %g Tf %.2f %.2f Td %s Tj ET' % (fontes.index(fonte), tamanho, x, y, _texto_pdf(texto)))
+            else:
+                comandos.append(b'%.2f %.2f m %.2f %.2f l S' % elemento[1:])
+        conteudo = zlib.compress(b'\n'.join(comandos))
+        objetos.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(conteudo), conteudo))
+        objetos.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources %s /Contents %d 0 R >>' % (recursos, len(objetos)))
+        filhos.append(len(objetos))
+    objetos[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % n for n in filhos), len(filhos))
+    saida = bytearray(b'%PDF-1.4\n')
+    posicoes = []
+    for numero, objeto in enumerate(objetos, 1):
+        posicoes.append(len(saida))
+        saida += b'%d 0 obj\n%s\nendobj\n' % (numero, objeto)
+    inicio_xref = len(saida)
+    saida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+    saida += b''.join(b'%010d 00000 n \n' % posicao for posicao in posicoes)
+    saida += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objetos) + 1, inicio_xref)
+    return bytes(saida)
+
+def _moeda(valor):
+    return 'R$ ' + f'{valor or 0:,.2f}'.translate(str.maketrans(',.', '.,'))
+
+def layout_holerite(funcionario, holerite):
+    # funcionario: dict com nome, funcao, tipo_contrato e banco; holerite: serializar_holerite()
+    ano, mes = holerite['mes_ano'].split('-')
+    pagina = [('t', 40, 790, 'negrito', 16, 'NEORH'),
+              ('t', 40, 770, 'normal', 12, 'Demonstrativo de Pagamento de Salário'),
+              ('t', 430, 790, 'normal', 11, f'Referência: {mes}/{ano}'),
+              ('l', 40, 760, 555, 760)]
+    y = 740
+    for rotulo, valor in (('Funcionário', funcionario['nome']), ('Função', funcionario.get('funcao') or '-'),
+                          ('Contrato', funcionario.get('tipo_contrato') or '-'), ('Banco', funcionario.get('banco') or '-')):
+        pagina += [('t', 40, y, 'negrito', 10, f'{rotulo}:'), ('t', 120, y, 'normal', 10, valor)]
+        y -= 16
+    y -= 10
+    pagina += [('l', 40, y + 14, 555, y + 14), ('t', 40, y, 'negrito', 10, 'Descrição'),
+               ('t', 380, y, 'negrito', 10, 'Proventos'), ('t', 480, y, 'negrito', 10, 'Descontos'), ('l', 40, y - 6, 555, y - 6)]
+    itens = [('Salário base', holerite['salario_bruto'], None), ('Comissão', holerite['comissao'], None),
+             ('Abonos', holerite['abonos'], None),
+             (f"INSS ({holerite['inss_percentual']:.2f}%)".replace('.', ','), None, holerite['inss_valor']),
+             (f"IRRF ({holerite['irrf_percentual']:.2f}%)".replace('.', ','), None, holerite['irrf_valor']),
+             ('Faltas', None, holerite['descontos_falta']), ('Benefícios', None, holerite['descontos'])]
+    for descricao, provento, desconto in itens:
+        y -= 18
+        pagina.append(('t', 40, y, 'normal', 10, descricao))
+        for x, valor in ((450, provento), (550, desconto)):
+            if valor is not None:
+                texto = _moeda(valor)
+                pagina.append(('t', x - len(texto) * 6, y, 'mono', 10, texto)) # Courier: 6 pt por caractere em corpo 10
+    proventos = holerite['salario_bruto'] + holerite['comissao'] + holerite['abonos']
+    total_descontos = holerite['inss_valor'] + holerite['irrf_valor'] + holerite['descontos_falta'] + holerite['descontos']
+    y -= 12
+    pagina.append(('l', 40, y, 555, y))
+    for rotulo, valor in (('Total de proventos', proventos), ('Total de descontos', total_descontos),
+                          ('Líquido a receber', holerite['salario_liquido'])):
+        y -= 18
+        texto = _moeda(valor)
+        pagina += [('t', 40, y, 'negrito', 10, rotulo), ('t', 550 - len(texto) * 6, y, 'mono', 10, texto)]
+    y -= 30
+    pagina.append(('l', 40, y + 14, 555, y + 14))
+    for n, (rotulo, valor) in enumerate((('Base INSS', holerite['base_calc_inss']), ('Base FGTS', holerite['base_calc_fgts']),
+                                         ('FGTS do mês', holerite['fgts_mes']), ('Base IRRF', holerite['base_calc_irrf']))):
+        pagina += [('t', 40 + n * 130, y, 'negrito', 9, rotulo), ('t', 40 + n * 130, y - 14, 'mono', 9, _moeda(valor))]
+    pagina.append(('t', 40, y - 44, 'normal', 10, f"Situação: {holerite['status']}"))
+    return pagina
+
+def _chave_pdf(paginas):
+    return hashlib.sha256(json.dumps([PDF_LAYOUT_VERSAO, paginas], ensure_ascii=False).encode()).hexdigest()
+
+def _caminho_cache_pdf(chave, extensao='pdf'):
+    pasta = os.path.join(app.config['PDF_CACHE_FOLDER'], chave[:2])
+    os.makedirs(pasta, exist_ok=True)
+    return os.path.join(pasta, f'{chave}.{extensao}')
+
+def _gravar_atomico(caminho, conteudo):
+    # Grava em arquivo temporário e renomeia: leitores nunca veem um PDF pela metade
+    descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    with os.fdopen(descritor, 'wb') as arquivo:
+        arquivo.write(conteudo)
+    os.replace(temporario, caminho)
+
+def pdfs_em_cache(documentos):
+    # documentos: lista de listas de páginas; devolve (chave, caminho) de cada um, gerando só os que faltam
+    chaves = [_chave_pdf(paginas) for paginas in documentos]
+    caminhos = [_caminho_cache_pdf(chave) for chave in chaves]
+    faltando = [n for n, caminho in enumerate(caminhos) if not os.path.exists(caminho)]
+    if PDF_PROCESSOS <= 0 or not faltando:
+        gerados = [gerar_pdf(documentos[n]) for n in faltando]
+    else:
+        gerados = _executor_pdf().map(gerar_pdf, [documentos[n] for n in faltando], chunksize=max(1, len(faltando) // (PDF_PROCESSOS * 4)))
+    for n, conteudo in zip(faltando, gerados):
+        _gravar_atomico(caminhos[n], conteudo)
+    return list(zip(chaves, caminhos))
+
+def _dados_funcionario_pdf(funcionario):
+    contabilidade = funcionario.contabilidade
+    return {'nome': funcionario.nome, 'funcao': funcionario.funcao, 'tipo_contrato': contabilidade.tipo_contrato if contabilidade else None,
+            'banco': contabilidade.banco if contabilidade else None}
+
+def _enviar_pdf(chave, caminho, nome_arquivo, mimetype='application/pdf'):
+    resposta = send_file(caminho, mimetype=mimetype, as_attachment=True, download_name=nome_arquivo, etag=chave, conditional=True)
+    resposta.headers['Cache-Control'] = 'private, max-age=0, must-revalidate' # O ETag (hash do conteúdo) evita novo download
+    return resposta
+
+# ROTAS DE PDF DE HOLERITES
+@app.route('/api/contabilidade/<int:user_id>/holerites/pdf', methods=['GET'])
+@token_required
+def holerites_pdf(current_user, user_id):
+    # Histórico em um único PDF (um holerite por página); ?mes_ano=YYYY-MM para um mês ou ?inicio=&fim= para um período
+    if current_user.tipo_usuario != 'gerente' and current_user.id != user_id:
+        return jsonify({'message': 'Acesso negado'}), 403
+    funcionario = Usuario.query.get(user_id)
+    if not funcionario:
+        return jsonify({'message': 'Funcionário não encontrado'}), 404
+    query = Holerite.query.filter_by(funcionario_id=user_id)
+    try:
+        if request.args.get('mes_ano'):
+            query = query.filter(Holerite.mes_ano == validar_mes_ano(request.args['mes_ano']))
+        if request.args.get('inicio'):
+            query = query.filter(Holerite.mes_ano >= validar_mes_ano(request.args['inicio']))
+        if request.args.get('fim'):
+            query = query.filter(Holerite.mes_ano <= validar_mes_ano(request.args['fim']))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    holerites = [serializar_holerite(h) for h in query.order_by(Holerite.mes_ano)]
+    if not holerites:
+        return jsonify({'message': 'Holerite não encontrado'}), 404
+    dados = _dados_funcionario_pdf(funcionario)
+    [(chave, caminho)] = pdfs_em_cache([[layout_holerite(dados, h) for h in holerites]])
+    periodo = holerites[0]['mes_ano'] if len(holerites) == 1 else f"{holerites[0]['mes_ano']}_{holerites[-1]['mes_ano']}"
+    return _enviar_pdf(chave, caminho, f'holerite-{user_id}-{periodo}.pdf')
+
+@app.route('/api/gerente/holerites/<mes_ano>/pdf', methods=['GET'])
+@token_required
+def holerites_mes_zip(current_user, mes_ano):
+    # Todos os holerites do mês, um PDF por funcionário, em um único .zip
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    try:
+        mes_ano = validar_mes_ano(mes_ano)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    linhas = db.session.query(Holerite, Usuario.nome, Usuario.funcao, ContabilidadeFuncionario.tipo_contrato, ContabilidadeFuncionario.banco).join(
+        Usuario, Usuario.id == Holerite.funcionario_id).outerjoin(ContabilidadeFuncionario, ContabilidadeFuncionario.funcionario_id == Usuario.id).filter(
+        Holerite.mes_ano == mes_ano).order_by(Holerite.funcionario_id).all()
+    if not linhas:
+        return jsonify({'message': 'Nenhum holerite no mês'}), 404
+    documentos = [[layout_holerite({'nome': nome, 'funcao': funcao, 'tipo_contrato': contrato, 'banco': banco}, serializar_holerite(h))]
+                  for h, nome, funcao, contrato, banco in linhas]
+    pdfs = pdfs_em_cache(documentos)
+    nomes = [f'holerite-{h.funcionario_id}-{secure_filename(nome) or "funcionario"}-{mes_ano}.pdf' for h, nome, _, _, _ in linhas]
+    chave_zip = hashlib.sha256(json.dumps(list(zip(nomes, [chave for chave, _ in pdfs]))).encode()).hexdigest()
+    caminho_zip = _caminho_cache_pdf(chave_zip, 'zip')
+    if not os.path.exists(caminho_zip):
+        descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho_zip), suffix='.tmp')
+        with os.fdopen(descritor, 'wb') as arquivo, zipfile.ZipFile(arquivo, 'w', zipfile.ZIP_STORED) as pacote: # Os PDFs já são comprimidos
+            for nome, (_, caminho) in zip(nomes, pdfs):
+                pacote.write(caminho, nome)
+        os.replace(temporario, caminho_zip)
+    return _enviar_pdf(chave_zip, caminho_zip, f'holerites-{mes_ano}.zip', 'application/zip')
+
 @app.route('/api/funcionarios/<int:user_id>', methods=['GET'])
 @token_required
 def get_funcionario(current_user, user_id):
@@ -1061,12 +3457,409 @@ def get_funcionario(current_user, user_id):
         'email': funcionario.email,
         'funcao': funcionario.funcao,
         'telefone': dados.telefone if dados else '',
-        'foto_perfil': dados.foto_perfil if dados else 'default-user.png'
+        'foto_perfil': dados.foto_perfil if dados else 'default-user.png',
+        'foto_miniatura_url': url_miniatura(dados)
     })
 
+# MÉTRICAS (PROMETHEUS)
+# Cada worker acumula na memória, por endpoint: requisições, latência, tamanho da resposta, consultas SQL e
+# tempo no banco (eventos do SQLAlchemy), tempo de autenticação e requisições em andamento. A cada
+# METRICAS_INTERVALO segundos (numa thread própria, mesmo sem tráfego) o worker grava o seu total num SQLite
+# compartilhado pelos workers do container; GET /metrics soma os workers e responde no formato texto do Prometheus.
+# Contadores de workers encerrados (ex.: max_requests do gunicorn) são somados numa linha de 'aposentados', para
+# os totais nunca diminuírem.
+METRICAS_PATH = os.environ.get('METRICAS_PATH', os.path.join(tempfile.gettempdir(), 'neorh_metricas.sqlite'))
+METRICAS_INTERVALO = float(os.environ.get('METRICAS_INTERVALO', 5)) # Segundos entre gravações de cada worker
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN') # GET /metrics exige Authorization: Bearer <token>; sem token, a rota não existe
+METRICAS_APOSENTAR = 600 # Segundos sem gravar para um worker ser considerado encerrado (vivos gravam a cada intervalo)
+FAIXAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Segundos
+FAIXAS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+FAIXAS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200) # Consultas SQL por requisição (N+1 aparece nas faixas altas)
+
+class Metricas:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.worker = f'{os.getpid()}-{int(time.time())}' # O pid sozinho pode ser reaproveitado por outro worker
+        self._lock = threading.Lock()
+        self._contadores = {} # (nome, rótulos) -> valor
+        self._medidores = {} # (nome, rótulos) -> valor (só vale enquanto o worker estiver vivo)
+        self._histogramas = {} # (nome, rótulos) -> [contagem por faixa..., soma, total]
+        self._local = threading.local()
+        self._ultima_gravacao = 0.0
+        self._pid_batimento = None # Processo em que a thread de gravação foi iniciada
+
+    def _iniciar_batimento(self):
+        # Grava mesmo com o worker ocioso: sem isso ele seria aposentado e, na volta, somaria tudo de novo
+        if self._pid_batimento == os.getpid():
+            return
+        self._pid_batimento = os.getpid()
+        threading.Thread(target=self._batimento, name='metricas', daemon=True).start()
+
+    def _batimento(self):
+        while True:
+            time.sleep(METRICAS_INTERVALO)
+            self.gravar(forcar=True)
+
+    def _copiar_pool(self):
+        # Contadores do pool do banco (PoolMedido) deste worker, no formato das métricas
+        with _pool_stats_lock:
+            retiradas, espera, esgotado = _pool_stats['retiradas'], _pool_stats['espera_total_ms'] / 1000, _pool_stats['esgotado']
+        with self._lock:
+            self._contadores[('neorh_banco_pool_retiradas_total', '[]')] = retiradas
+            self._contadores[('neorh_banco_pool_espera_segundos_total', '[]')] = espera
+            self._contadores[('neorh_banco_pool_esgotado_total', '[]')] = esgotado
+
+    def somar(self, nome, rotulos, valor=1):
+        with self._lock:
+            self._contadores[(nome, rotulos)] = self._contadores.get((nome, rotulos), 0) + valor
+
+    def medir(self, nome, rotulos, delta):
+        with self._lock:
+            self._medidores[(nome, rotulos)] = self._medidores.get((nome, rotulos), 0) + delta
+
+    def observar(self, nome, rotulos, valor, faixas):
+        posicao = bisect_left(faixas, valor) # Primeira faixa com limite >= valor (len(faixas) = +Inf)
+        with self._lock:
+            histograma = self._histogramas.get((nome, rotulos))
+            if histograma is None:
+                histograma = self._histogramas[(nome, rotulos)] = [0] * (len(faixas) + 3)
+            histograma[posicao] += 1
+            histograma[-2] += valor
+            histograma[-1] += 1
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('CREATE TABLE IF NOT EXISTS metricas (worker TEXT NOT NULL, nome TEXT NOT NULL, tipo TEXT NOT NULL, '
+                            'serie TEXT NOT NULL, rotulos TEXT NOT NULL, le TEXT NOT NULL, valor REAL NOT NULL, atualizado REAL NOT NULL, '
+                            'PRIMARY KEY (worker, nome, serie, rotulos, le))')
+            self._local.conexao = conexao
+        return conexao
+
+    def _linhas(self):
+        # Séries acumuladas deste worker: (nome, tipo, série, rótulos, le, valor)
+        with self._lock:
+            contadores, medidores = list(self._contadores.items()), list(self._medidores.items())
+            histogramas = [(chave, list(valores)) for chave, valores in self._histogramas.items()]
+        linhas = [(nome, 'counter', '', rotulos, '', valor) for (nome, rotulos), valor in contadores]
+        linhas += [(nome, 'gauge', '', rotulos, '', valor) for (nome, rotulos), valor in medidores]
+        for (nome, rotulos), valores in histogramas:
+            faixas = FAIXAS_HISTOGRAMAS[nome]
+            acumulado = 0
+            for limite, contagem in zip([*map(str, faixas), '+Inf'], valores):
+                acumulado += contagem # Faixas do Prometheus são cumulativas
+                linhas.append((nome, 'histogram', '_bucket', rotulos, limite, acumulado))
+            linhas += [(nome, 'histogram', '_sum', rotulos, '', valores[-2]), (nome, 'histogram', '_count', rotulos, '', valores[-1])]
+        return linhas
+
+    def gravar(self, forcar=False):
+        self._iniciar_batimento()
+        agora = time.time()
+        if not forcar and agora - self._ultima_gravacao < METRICAS_INTERVALO:
+            return
+        self._ultima_gravacao = agora
+        self._copiar_pool()
+        try:
+            with self._conexao() as conexao:
+                conexao.executemany(
+                    'INSERT OR REPLACE INTO metricas (worker, nome, tipo, serie, rotulos, le, valor, atualizado) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(self.worker, *linha, agora) for linha in self._linhas()])
+                limite = agora - METRICAS_APOSENTAR # Workers encerrados: soma os contadores na linha 'aposentados'
+                conexao.execute(
+                    "INSERT INTO metricas (worker, nome, tipo, serie, rotulos, le, valor, atualizado) "
+                    "SELECT 'aposentados', nome, tipo, serie, rotulos, le, SUM(valor), ? FROM metricas "
+                    "WHERE worker NOT IN ('aposentados', ?) AND atualizado < ? AND tipo != 'gauge' GROUP BY nome, tipo, serie, rotulos, le "
+                    "ON CONFLICT (worker, nome, serie, rotulos, le) DO UPDATE SET valor = valor + excluded.valor, atualizado = excluded.atualizado",
+                    (agora, self.worker, limite))
+                conexao.execute("DELETE FROM metricas WHERE worker NOT IN ('aposentados', ?) AND atualizado < ?", (self.worker, limite))
+        except sqlite3.Error as e:
+            app.logger.warning(f'Métricas compartilhadas indisponíveis: {e}')
+
+    def texto_prometheus(self):
+        self.gravar(forcar=True)
+        try:
+            linhas = self._conexao().execute(
+                "SELECT nome, tipo, serie, rotulos, le, SUM(valor) FROM metricas WHERE tipo != 'gauge' OR atualizado >= ? "
+                "GROUP BY nome, tipo, serie, rotulos, le", (time.time() - 3 * METRICAS_INTERVALO,)).fetchall()
+        except sqlite3.Error as e: # Sem o arquivo compartilhado: só este worker
+            app.logger.warning(f'Métricas compartilhadas indisponíveis: {e}')
+            linhas = self._linhas()
+        ordem_series = {'_bucket': 0, '_sum': 1, '_count': 2, '': 0}
+        linhas.sort(key=lambda l: (l[0], l[3], ordem_series[l[2]], float(l[4]) if l[4] else 0))
+        saida, familia = [], None
+        for nome, tipo, serie, rotulos, le, valor in linhas:
+            if nome != familia:
+                familia = nome
+                saida += [f'# HELP {nome} {AJUDA_METRICAS.get(nome, nome)}', f'# TYPE {nome} {tipo}']
+            pares = [*(f'{k}="{v}"' for k, v in json.loads(rotulos)), *([f'le="{le}"'] if le else [])]
+            saida.append(f"{nome}{serie}{{{','.join(pares)}}} {valor:g}" if pares else f'{nome}{serie} {valor:g}')
+        return '\n'.join(saida) + '\n'
+
+FAIXAS_HISTOGRAMAS = {
+    'neorh_http_duracao_segundos': FAIXAS_LATENCIA,
+    'neorh_http_resposta_bytes': FAIXAS_BYTES,
+    'neorh_sql_consultas_por_requisicao': FAIXAS_CONSULTAS,
+    'neorh_sql_duracao_por_requisicao_segundos': FAIXAS_LATENCIA,
+    'neorh_autenticacao_duracao_segundos': FAIXAS_LATENCIA,
+}
+AJUDA_METRICAS = {
+    'neorh_http_requisicoes_total': 'Requisições respondidas, por endpoint, método e status.',
+    'neorh_http_duracao_segundos': 'Tempo até a resposta (em streams, até o envio dos cabeçalhos).',
+    'neorh_http_resposta_bytes': 'Tamanho do corpo das respostas com tamanho conhecido.',
+    'neorh_http_em_andamento': 'Requisições sendo atendidas agora.',
+    'neorh_sql_consultas_por_requisicao': 'Comandos SQL executados em cada requisição.',
+    'neorh_sql_duracao_por_requisicao_segundos': 'Tempo gasto no banco em cada requisição.',
+    'neorh_sql_consultas_total': 'Comandos SQL executados, por endpoint.',
+    'neorh_autenticacao_duracao_segundos': 'Tempo do token_required (JWT e carga do usuário).',
+    'neorh_banco_pool_retiradas_total': 'Conexões retiradas do pool do banco.',
+    'neorh_banco_pool_espera_segundos_total': 'Tempo total esperando uma conexão do pool.',
+    'neorh_banco_pool_esgotado_total': 'Retiradas que desistiram por falta de conexão livre.',
+}
+
+metricas = Metricas(METRICAS_PATH)
+
+def _rotulos(**valores):
+    return json.dumps(sorted(valores.items())) # Chave estável e fácil de serializar
+
+def _sql_inicio(conexao, cursor, instrucao, parametros, contexto, executemany):
+    contexto._inicio_metricas = time.perf_counter()
+
+def _sql_fim(conexao, cursor, instrucao, parametros, contexto, executemany):
+    if has_request_context() and 'sql_consultas' in g: # Fora de requisições (CLI, threads de fundo) não conta
+        duracao = time.perf_counter() - contexto._inicio_metricas
+        g.sql_consultas += 1
+        g.sql_tempo += duracao
+        if 'perfil_sql' in g: # Requisição sendo perfilada: guarda cada comando
+            g.perfil_sql.append((instrucao, duracao, executemany))
+
+event.listen(Engine, 'before_cursor_execute', _sql_inicio)
+event.listen(Engine, 'after_cursor_execute', _sql_fim)
+
+def _endpoint_metricas():
+    return request.endpoint or 'nao_encontrado' # 404 agrupados num só rótulo (URLs livres não viram séries)
+
+@app.before_request
+def iniciar_metricas():
+    g.inicio_metricas = time.perf_counter()
+    g.sql_consultas, g.sql_tempo = 0, 0.0
+    metricas.medir('neorh_http_em_andamento', _rotulos(endpoint=_endpoint_metricas()), 1)
+
+@app.after_request
+def registrar_metricas(resposta):
+    if 'inicio_metricas' not in g:
+        return resposta
+    endpoint = _endpoint_metricas()
+    rotulos = _rotulos(endpoint=endpoint)
+    metricas.somar('neorh_http_requisicoes_total', _rotulos(endpoint=endpoint, metodo=request.method, status=resposta.status_code))
+    metricas.observar('neorh_http_duracao_segundos', rotulos, time.perf_counter() - g.inicio_metricas, FAIXAS_LATENCIA)
+    if not resposta.is_streamed and resposta.content_length is not None:
+        metricas.observar('neorh_http_resposta_bytes', rotulos, resposta.content_length, FAIXAS_BYTES)
+    metricas.observar('neorh_sql_consultas_por_requisicao', rotulos, g.sql_consultas, FAIXAS_CONSULTAS)
+    metricas.observar('neorh_sql_duracao_por_requisicao_segundos', rotulos, g.sql_tempo, FAIXAS_LATENCIA)
+    metricas.somar('neorh_sql_consultas_total', rotulos, g.sql_consultas)
+    if 'tempo_autenticacao' in g:
+        metricas.observar('neorh_autenticacao_duracao_segundos', rotulos, g.tempo_autenticacao, FAIXAS_LATENCIA)
+    return resposta
+
+@app.teardown_request
+def finalizar_metricas(erro):
+    if 'inicio_metricas' in g: # Também roda quando a requisição termina em exceção
+        metricas.medir('neorh_http_em_andamento', _rotulos(endpoint=_endpoint_metricas()), -1)
+        metricas.gravar()
+
+@app.route('/metrics', methods=['GET'])
+def exportar_metricas():
+    if not METRICAS_TOKEN: # Não publica tráfego, SQL e pool na porta pública por padrão
+        return jsonify({'message': 'Não encontrado'}), 404
+    if not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICAS_TOKEN}'):
+        return jsonify({'message': 'Acesso negado'}), 403
+    return Response(metricas.texto_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# PERFIL DE REQUISIÇÕES (PROFILER)
+# Uma requisição é perfilada quando traz o cabeçalho X-Perfil com o PERFIL_TOKEN, ou por amostragem
+# (PERFIL_AMOSTRAGEM, fração das requisições). Nela, o cProfile registra as chamadas e cada comando SQL é
+# guardado com o tempo. Comandos com o mesmo formato repetidos PERFIL_N_MAIS_1 vezes são marcados como N+1.
+# A captura é gravada se foi pedida pelo cabeçalho ou se a requisição passou de PERFIL_LIMITE_MS; ficam só as
+# PERFIL_MAXIMO mais recentes em PERFIL_FOLDER (.json com o SQL e .prof para snakeviz/flameprof/pstats).
+PERFIL_TOKEN = os.environ.get('PERFIL_TOKEN') # Vazio: só por amostragem
+PERFIL_AMOSTRAGEM = float(os.environ.get('PERFIL_AMOSTRAGEM', 0)) # 0.01 = 1% das requisições; 0 desativa
+PERFIL_LIMITE_MS = float(os.environ.get('PERFIL_LIMITE_MS', 500)) # Amostras mais rápidas que isso são descartadas
+PERFIL_MAXIMO = int(os.environ.get('PERFIL_MAXIMO', 50)) # Capturas mantidas no disco (todos os workers)
+PERFIL_N_MAIS_1 = int(os.environ.get('PERFIL_N_MAIS_1', 5)) # Repetições do mesmo formato de comando para marcar N+1
+PERFIL_FOLDER = os.environ.get('PERFIL_FOLDER', os.path.join(tempfile.gettempdir(), 'neorh_perfis'))
+PERFIL_ID_RE = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+_LITERAIS_SQL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b") # Textos e números escritos no comando
+_LISTA_PARAMETROS_RE = re.compile(r'\((?:\s*(?:\?|%\([^)]*\)s|%s)\s*,)+\s*(?:\?|%\([^)]*\)s|%s)\s*\)') # IN (?, ?, ?)
+
+def formato_sql(instrucao):
+    # Mesmo formato = mesmo comando com outros valores (ex.: o SELECT de cada item de um laço)
+    formato = _LISTA_PARAMETROS_RE.sub('(?)', _LITERAIS_SQL_RE.sub('?', instrucao))
+    return ' '.join(formato.split())
+
+def _perfilar_requisicao():
+    if PERFIL_TOKEN and secrets.compare_digest(request.headers.get('X-Perfil', ''), PERFIL_TOKEN):
+        return 'pedido'
+    if PERFIL_AMOSTRAGEM and random.random() < PERFIL_AMOSTRAGEM:
+        return 'amostra'
+    return None
+
+@app.before_request
+def iniciar_perfil():
+    motivo = _perfilar_requisicao()
+    if not motivo:
+        return
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError: # Outro profiler já ativo nesta thread
+        return
+    g.perfil, g.perfil_motivo, g.perfil_sql, g.perfil_inicio = perfil, motivo, [], time.perf_counter()
+
+@app.after_request
+def status_do_perfil(resposta):
+    if 'perfil' in g:
+        g.perfil_status = resposta.status_code
+    return resposta
+
+@app.teardown_request
+def finalizar_perfil(erro):
+    if 'perfil' not in g:
+        return
+    g.perfil.disable()
+    duracao_ms = (time.perf_counter() - g.perfil_inicio) * 1000
+    if g.perfil_motivo == 'amostra' and duracao_ms < PERFIL_LIMITE_MS:
+        return
+    try:
+        gravar_perfil(g.perfil, g.perfil_sql, {
+            'endpoint': request.endpoint, 'metodo': request.method, 'caminho': request.full_path.rstrip('?'),
+            'status': g.get('perfil_status', 500), 'motivo': g.perfil_motivo, 'duracao_ms': round(duracao_ms, 1),
+            'erro': repr(erro) if erro else None,
+        })
+    except OSError as e:
+        app.logger.warning(f'Perfil da requisição não gravado: {e}')
+
+def gravar_perfil(perfil, comandos, resumo):
+    formatos = {}
+    for instrucao, duracao, _ in comandos:
+        item = formatos.setdefault(formato_sql(instrucao), {'formato': formato_sql(instrucao), 'vezes': 0, 'tempo_ms': 0.0})
+        item['vezes'] += 1
+        item['tempo_ms'] += duracao * 1000
+    repetidos = sorted((f for f in formatos.values() if f['vezes'] >= PERFIL_N_MAIS_1), key=lambda f: -f['vezes'])
+    captura_id = f"{datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{secrets.token_hex(4)}"
+    os.makedirs(PERFIL_FOLDER, exist_ok=True)
+    perfil.dump_stats(os.path.join(PERFIL_FOLDER, f'{captura_id}.prof'))
+    dados = {
+        'id': captura_id, 'criado_em': datetime.datetime.utcnow().isoformat(), 'pid': os.getpid(), **resumo,
+        'sql_consultas': len(comandos), 'sql_tempo_ms': round(sum(d for _, d, _ in comandos) * 1000, 3),
+        'n_mais_1': [{**f, 'tempo_ms': round(f['tempo_ms'], 3)} for f in repetidos], # Formatos suspeitos, do mais repetido
+        'sql': [{'instrucao': i, 'tempo_ms': round(d * 1000, 3), 'executemany': m} for i, d, m in comandos],
+    }
+    _gravar_atomico(os.path.join(PERFIL_FOLDER, f'{captura_id}.json'), json.dumps(dados, ensure_ascii=False).encode())
+    for antigo in listar_perfis()[PERFIL_MAXIMO:]: # Remove as capturas mais antigas (de qualquer worker)
+        for extensao in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(PERFIL_FOLDER, antigo + extensao))
+            except FileNotFoundError:
+                pass
+    if repetidos:
+        app.logger.warning(f"perfil {captura_id}: possível N+1 em {resumo['endpoint']} "
+                           f"({repetidos[0]['vezes']}x {repetidos[0]['formato'][:120]})")
+
+def listar_perfis():
+    # Ids das capturas, da mais recente para a mais antiga (o id começa pela data/hora)
+    if not os.path.isdir(PERFIL_FOLDER):
+        return []
+    return sorted((n[:-5] for n in os.listdir(PERFIL_FOLDER) if n.endswith('.json') and PERFIL_ID_RE.match(n[:-5])), reverse=True)
+
+def _ler_perfil(captura_id):
+    try:
+        with open(os.path.join(PERFIL_FOLDER, f'{captura_id}.json'), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (FileNotFoundError, ValueError): # Removida por outro worker ou ainda sendo gravada
+        return None
+
+@app.route('/api/gerente/perfis', methods=['GET'])
+@token_required
+def listar_perfis_gerente(current_user):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    resumos = []
+    for captura_id in listar_perfis():
+        dados = _ler_perfil(captura_id)
+        if dados:
+            dados.pop('sql') # A lista completa fica no detalhe
+            resumos.append(dados)
+    return jsonify(resumos)
+
+@app.route('/api/gerente/perfis/<captura_id>', methods=['GET'])
+@token_required
+def detalhe_perfil(current_user, captura_id):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    dados = _ler_perfil(captura_id) if PERFIL_ID_RE.match(captura_id) else None
+    if not dados:
+        return jsonify({'message': 'Captura não encontrada'}), 404
+    return jsonify(dados)
+
+@app.route('/api/gerente/perfis/<captura_id>/prof', methods=['GET'])
+@token_required
+def baixar_perfil(current_user, captura_id):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    if not PERFIL_ID_RE.match(captura_id) or not os.path.isfile(os.path.join(PERFIL_FOLDER, f'{captura_id}.prof')):
+        return jsonify({'message': 'Captura não encontrada'}), 404
+    return send_from_directory(PERFIL_FOLDER, f'{captura_id}.prof', as_attachment=True, mimetype='application/octet-stream')
+
+# ROTA DE DIAGNÓSTICO (SOMENTE GERENTE)
+@app.route('/api/gerente/diagnostico', methods=['GET'])
+@token_required
+def diagnostico(current_user):
+    if current_user.tipo_usuario != 'gerente':
+        return jsonify({'message': 'Acesso negado'}), 403
+    return jsonify({
+        'cache_autenticacao': estatisticas_cache_principal(), # Acertos/erros do cache de autenticação deste worker
+        'hash_senhas': estatisticas_hash(), # Fila do pool de hash de senhas deste worker
+        'ponto_group_commit': estatisticas_group_commit(), # Lotes de batidas confirmados por este worker
+        'urls_assinadas': {**_urls_assinadas_stats, 'tamanho': len(_urls_assinadas)} if USE_S3 else None, # Cache de URLs do S3 deste worker
+        'envios_s3': dict(db.session.query(EnvioArmazenamento.status, db.func.count()).group_by(EnvioArmazenamento.status).all()), # Fila do spool
+        'inicializacao': {**TEMPOS_BOOT, 'orcamento_ms': BOOT_ORCAMENTO_MS}, # Tempo de boot deste worker, por etapa
+        'pool_banco': estatisticas_pool() # Espera por conexão e saturação do pool deste worker
+    })
+
+@app.cli.command('migrar-esquema')
+def migrar_esquema_command():
+    """Aplica as migrações pendentes do banco (uma vez por deploy, antes de subir os workers)."""
+    aplicadas = aplicar_migracoes()
+    click.echo(f"Esquema na versão {ESQUEMA_VERSAO}; migrações aplicadas agora: {', '.join(map(str, aplicadas)) or 'nenhuma'}")
+
+# VERIFICAÇÃO DO ESQUEMA E ORÇAMENTO DE INICIALIZAÇÃO
+# Cada worker só lê a linha de versao_esquema (não cria tabelas nem consulta o gerente padrão); o tempo total
+# do import é comparado com BOOT_ORCAMENTO_MS, para regressões no cold start aparecerem nos logs.
+BOOT_ORCAMENTO_MS = float(os.environ.get('BOOT_ORCAMENTO_MS', 1500))
+TEMPOS_BOOT['modulo_ms'] = round((time.perf_counter() - _INICIO_BOOT) * 1000, 1)
+with app.app_context():
+    try:
+        _versao_banco = versao_do_esquema()
+    except Exception: # Banco fora do ar: o worker sobe e as requisições falham até ele voltar
+        app.logger.exception('boot: não foi possível ler a versão do esquema')
+        _versao_banco = None
+    finally:
+        db.session.remove()
+if _versao_banco is None or _versao_banco < ESQUEMA_VERSAO:
+    app.logger.warning(f'boot: esquema do banco na versão {_versao_banco}, o código espera {ESQUEMA_VERSAO}; '
+                       'rode "flask --app app migrar-esquema"')
+elif _versao_banco > ESQUEMA_VERSAO: # Deploy em andamento: o banco já foi migrado por uma versão mais nova
+    app.logger.warning(f'boot: esquema do banco na versão {_versao_banco}, mais nova que a deste código ({ESQUEMA_VERSAO})')
+TEMPOS_BOOT['esquema_versao'] = _versao_banco
+TEMPOS_BOOT['total_ms'] = round((time.perf_counter() - _INICIO_BOOT) * 1000, 1)
+(app.logger.warning if TEMPOS_BOOT['total_ms'] > BOOT_ORCAMENTO_MS else app.logger.info)(
+    f"boot: {TEMPOS_BOOT['total_ms']:.0f} ms (orçamento {BOOT_ORCAMENTO_MS:.0f} ms) {TEMPOS_BOOT}")
+
 # PONTO DE ENTRADA DA APLICAÇÃO
 if __name__ == '__main__':
-    create_tables() # Cria as tabelas no banco de dados (para desenvolvimento rápido)
+    create_tables() # Aplica as migrações pendentes (para desenvolvimento rápido)
     # Controle de debug via variável de ambiente FLASK_DEBUG (1/true) e porta via PORT
     debug = os.environ.get('FLASK_DEBUG', 'True').lower() in ('1', 'true', 'yes')
     host = os.environ.get('HOST', '0.0.0.0')
@@ -1,5 +1,6 @@
 #!/bin/sh
-# Ensure DB tables exist (create_all) and then start the server
-# Calls the app's `create_tables()` function (safe no-op if tables exist)
-python -c 'from app import create_tables; create_tables()'
-exec gunicorn -w 4 -b 0.0.0.0:${PORT:-5000} "app:app"
+# Passo único de inicialização: aplica as migrações pendentes do banco (os workers só conferem a versão ao subir)
+flask --app app migrar-esquema || exit 1
+# Workers gthread: conexões ociosas (ex.: /api/eventos/stream) ocupam uma thread, não um worker inteiro.
+# Para milhares de conexões simultâneas, instale gevent e use GUNICORN_WORKER_CLASS=gevent.
+exec gunicorn -w ${GUNICORN_WORKERS:-4} -k ${GUNICORN_WORKER_CLASS:-gthread} --threads ${GUNICORN_THREADS:-16} -b 0.0.0.0:${PORT:-5000} "app:app"
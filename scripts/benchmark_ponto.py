@@ -0,0 +1,103 @@
+# Benchmark do registro de ponto: commits/s e batidas/s com e sem group commit.
+# Simula a troca de turno: todos os funcionários batem a entrada ao mesmo tempo e depois a saída, com o cache
+# de autenticação frio (cada requisição carrega o usuário do banco), como na primeira batida do dia.
+#
+# Uso (a partir da raiz do projeto):
+#   python scripts/benchmark_ponto.py --usuarios 300 --threads 32 --janelas 0,2,5
+#   python scripts/benchmark_ponto.py --cache-quente   # mede só o registro do ponto, sem carregar usuários
+#   DATABASE_URL=postgresql://... python scripts/benchmark_ponto.py
+#
+# Sem DATABASE_URL, usa um SQLite temporário. As tabelas de pontos e resumos são limpas entre as rodadas,
+# então NÃO aponte para o banco de produção.
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser(description='Benchmark de commits do registro de ponto')
+parser.add_argument('--usuarios', type=int, default=200, help='Funcionários batendo ponto ao mesmo tempo')
+parser.add_argument('--threads', type=int, default=32, help='Requisições simultâneas (threads do worker)')
+parser.add_argument('--janelas', default='0,5', help='Valores de PONTO_GROUP_COMMIT_MS a comparar (0 = sem lote)')
+parser.add_argument('--cache-quente', action='store_true', help='Aquece o cache de autenticação antes de cada etapa')
+args = parser.parse_args()
+
+pasta_temporaria = tempfile.mkdtemp(prefix='benchmark_ponto_')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(pasta_temporaria, 'benchmark.db'))
+os.environ.setdefault('CACHE_COMPARTILHADO_PATH', os.path.join(pasta_temporaria, 'cache.sqlite'))
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(pasta_temporaria, 'uploads'))
+os.environ.setdefault('UPLOAD_FOLDER_PERFIL', os.path.join(pasta_temporaria, 'uploads', 'perfil'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt, datetime
+from sqlalchemy import event
+import app as neorh
+
+app, db = neorh.app, neorh.db
+neorh.create_tables() # Banco temporário: aplica as migrações antes de começar
+commits = {'total': 0}
+
+with app.app_context():
+    @event.listens_for(db.engine, 'commit')
+    def contar_commit(conexao):
+        commits['total'] += 1
+
+    existentes = {u.email for u in neorh.Usuario.query.filter(neorh.Usuario.email.like('benchmark%')).all()}
+    for i in range(args.usuarios): # Senha fictícia: o benchmark gera os tokens direto, sem login
+        if f'benchmark{i}@neorh.local' not in existentes:
+            db.session.add(neorh.Usuario(nome=f'Benchmark {i}', email=f'benchmark{i}@neorh.local', senha='-', tipo_usuario='funcionario'))
+    db.session.commit()
+    usuarios = [u.id for u in neorh.Usuario.query.filter(neorh.Usuario.email.like('benchmark%')).order_by(neorh.Usuario.id).limit(args.usuarios)]
+
+expiracao = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+tokens = [jwt.encode({'user_id': u, 'exp': expiracao}, app.config['SECRET_KEY'], algorithm='HS256') for u in usuarios]
+clientes = threading.local()
+
+def bater(rota, token):
+    if not hasattr(clientes, 'cliente'):
+        clientes.cliente = app.test_client()
+    return clientes.cliente.post(rota, headers={'Authorization': f'Bearer {token}'}).status_code
+
+def limpar():
+    with app.app_context():
+        for modelo in (neorh.Ponto, neorh.ResumoPontoDiario, neorh.ResumoPontoMensal):
+            modelo.query.filter(modelo.usuario_id.in_(usuarios)).delete(synchronize_session=False)
+        db.session.commit()
+
+def preparar_cache(executor):
+    if args.cache_quente:
+        rodada('/api/meus-pontos', tokens, executor)
+    else: # Troca de turno: nenhum usuário no cache do worker
+        for u in usuarios:
+            neorh.invalidar_principal(u)
+
+def rodada(rota, lista_tokens, executor):
+    antes = commits['total']
+    inicio = time.perf_counter()
+    status = list(executor.map(lambda t: bater(rota, t), lista_tokens))
+    duracao = time.perf_counter() - inicio
+    return status, commits['total'] - antes, duracao
+
+print(f"banco: {app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]} | usuários: {len(usuarios)} | threads: {args.threads} | "
+      f"cache: {'quente' if args.cache_quente else 'frio'}")
+print(f"{'janela_ms':>9} {'etapa':>9} {'batidas/s':>10} {'commits':>8} {'commits/s':>10} {'batidas/commit':>15} {'erros':>6}")
+for janela in [float(j) for j in args.janelas.split(',')]:
+    neorh.PONTO_GROUP_COMMIT_MS = janela
+    neorh.coletor_pontos = neorh.ColetorPontos(janela, neorh.PONTO_GROUP_COMMIT_MAX)
+    limpar()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for etapa, rota in (('entrada', '/api/ponto/entrada'), ('saida', '/api/ponto/saida')):
+            preparar_cache(executor)
+            status, total_commits, duracao = rodada(rota, tokens, executor)
+            erros = sum(1 for s in status if s != 200) # Inclui 401/500 por falta de conexão no pool
+            print(f'{janela:>9g} {etapa:>9} {len(status) / duracao:>10.1f} {total_commits:>8} {total_commits / duracao:>10.1f} '
+                  f'{len(status) / max(total_commits, 1):>15.1f} {erros:>6}')
+        # Conflito de turno aberto: duas entradas simultâneas por usuário, só uma pode passar
+        limpar()
+        preparar_cache(executor)
+        status, _, _ = rodada('/api/ponto/entrada', tokens + tokens, executor)
+        aceitas = sum(1 for s in status if s == 200)
+        print(f"{janela:>9g} {'conflito':>9} {aceitas} entradas aceitas de {len(status)} (esperado: {len(usuarios)})")
+limpar()